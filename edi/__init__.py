@@ -19,6 +19,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import sys
 import argparse
 import argcomplete
@@ -28,6 +29,8 @@ from edi.commands import clean, config, image, lxc, qemu, target, version, docum
 from edi.lib.commandfactory import get_sub_commands, get_command
 from edi.lib.helpers import print_error_and_exit, FatalError
 from edi.lib.edicommand import EdiCommand
+from edi.lib.subprocesstrace import SubprocessTrace
+from edi.lib.hostfacts import HostFacts
 from subprocess import CalledProcessError
 
 
@@ -53,6 +56,9 @@ def _setup_command_line_interface():
     parser.add_argument('--log', choices=['DEBUG', 'INFO', 'WARNING',
                                           'ERROR', 'CRITICAL'],
                         help="modify log level (default is WARNING)")
+    parser.add_argument('--trace', metavar='FILE',
+                        help=("write a trace of all executed subprocesses to FILE "
+                              "(alternatively use the environment variable EDI_TRACE)"))
 
     subparsers = parser.add_subparsers(title='commands',
                                        dest="command_name")
@@ -68,6 +74,9 @@ def main():
         cli_interface = _setup_command_line_interface()
         cli_args = cli_interface.parse_args(sys.argv[1:])
         _setup_logging(cli_args)
+        trace_file = cli_args.trace or os.environ.get('EDI_TRACE')
+        if trace_file:
+            SubprocessTrace.enable(trace_file)
 
         if cli_args.command_name is None:
             raise FatalError("Missing command. Use 'edi --help' for help.")
@@ -80,9 +89,18 @@ def main():
     except KeyboardInterrupt:
         print_error_and_exit("Command interrupted by user.")
     except CalledProcessError as subprocess_error:
-        print_error_and_exit("{}\nFor more information increase the log level.".format(subprocess_error))
+        if subprocess_error.output and isinstance(subprocess_error.output, str):
+            output_tail = '\n'.join(subprocess_error.output.splitlines()[-10:])
+            print_error_and_exit("{}\nLast lines of output:\n{}\nFor more information increase the log level.".format(
+                subprocess_error, output_tail))
+        else:
+            print_error_and_exit("{}\nFor more information increase the log level.".format(subprocess_error))
     except requests.exceptions.SSLError as ssl_error:
         print_error_and_exit("{}\nPlease verify your ssl/proxy setup.".format(ssl_error))
     except requests.exceptions.ConnectionError as connection_error:
         print_error_and_exit(("{}\nPlease verify your internet connectivity and the requested url."
                               ).format(connection_error))
+    finally:
+        # the facts that got probed one by one
+        HostFacts.persist()
+        SubprocessTrace.finish()
@@ -20,7 +20,7 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 from edi.commands.imagecommands import bootstrap, create, imageclean  # noqa: ignore=F401
-from edi.commands.lxccommands import (export, importcmd, launch, lxcclean, lxcconfigure,  # noqa: ignore=F401
+from edi.commands.lxccommands import (clone, export, importcmd, launch, lxcclean, lxcconfigure,  # noqa: ignore=F401
                                       lxcprepare, profile, publish, stop)  # noqa: ignore=F401
 from edi.commands.configcommands import configclean, configinit  # noqa: ignore=F401
 from edi.commands.targetcommands import targetconfigure  # noqa: ignore=F401
@@ -22,10 +22,10 @@
 import os
 from edi.lib.helpers import FatalError, copy_tree, print_success
 from edi.lib.versionhelpers import get_edi_version, get_stripped_version
-from jinja2 import Template
 import yaml
 from edi.commands.config import Config
 from edi.lib.configurationparser import get_base_dictionary
+from edi.lib.jinja2helpers import render_template
 from edi.lib.configurationhelpers import (get_available_templates, get_template,
                                           get_project_tree, ConfigurationTemplate)
 
@@ -61,8 +61,8 @@ class Init(Config):
         copy_tree(source, workdir)
         template = ConfigurationTemplate(workdir)
         with open(get_template(config_template), encoding="UTF-8", mode="r") as template_file:
-            t = Template(template_file.read())
-            template_dict = yaml.safe_load(t.render(get_base_dictionary())).get('parameters', {})
+            template_dict = yaml.safe_load(render_template(template_file.read(),
+                                                           get_base_dictionary())).get('parameters', {})
 
         template_dict['edi_project_name'] = project_name
         template_dict["edi_edi_version"] = get_stripped_version(get_edi_version())
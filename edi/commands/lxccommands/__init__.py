@@ -20,4 +20,4 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 __all__ = ["lxcprepare", "importcmd", "launch", "lxcclean", "profile", "lxcconfigure",
-           "stop", "publish", "export"]
+           "stop", "publish", "export", "clone"]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+from edi.commands.lxc import Lxc
+from edi.commands.lxccommands.profile import Profile
+from edi.commands.lxccommands.lxcconfigure import Configure, configuration_fingerprint_key
+from edi.lib.helpers import FatalError, print_success
+from edi.lib.networkhelpers import is_valid_hostname
+from edi.lib.sharedfoldercoordinator import SharedFolderCoordinator
+from edi.lib.lxchelpers import (is_container_existing, find_containers, copy_container, apply_profiles,
+                                start_container, is_bridge_available, create_bridge)
+
+
+class Clone(Lxc):
+
+    def __init__(self):
+        super().__init__()
+        self.container_name = ""
+
+    @classmethod
+    def advertise(cls, subparsers):
+        help_text = "clone an identically configured LXC container"
+        description_text = ("Clone an identically configured LXC container. "
+                            "If there is no such container, a new container gets configured.")
+        parser = subparsers.add_parser(cls._get_short_command_name(),
+                                       help=help_text,
+                                       description=description_text)
+        cls._offer_options(parser, introspection=True, clean=False)
+        parser.add_argument('container_name')
+        cls._require_config_file(parser)
+
+    @staticmethod
+    def _unpack_cli_args(cli_args):
+        return [cli_args.container_name, cli_args.config_file]
+
+    def run_cli(self, cli_args):
+        self._dispatch(*self._unpack_cli_args(cli_args), run_method=self._get_run_method(cli_args))
+
+    def dry_run(self, container_name, config_file):
+        return self._dispatch(container_name, config_file, run_method=self._dry_run)
+
+    def _dry_run(self):
+        return Configure().dry_run(self._result(), self.config.get_base_config_file())
+
+    def run(self, container_name, config_file):
+        return self._dispatch(container_name, config_file, run_method=self._run)
+
+    def _run(self):
+        if not is_valid_hostname(self._result()):
+            raise FatalError(("The provided container name '{}' "
+                              "is not a valid host name."
+                              ).format(self._result()))
+
+        if is_container_existing(self._result()):
+            raise FatalError(("The container '{}' is already existing. "
+                              "Use 'edi lxc configure' to reconfigure it."
+                              ).format(self._result()))
+
+        fingerprint = Configure().get_fingerprint(self._result(), self.config.get_base_config_file())
+        golden_containers = find_containers(configuration_fingerprint_key, fingerprint)
+        if not golden_containers:
+            print(("There is no identically configured container. "
+                   "Going to configure container {} from scratch.").format(self._result()))
+            return Configure().run(self._result(), self.config.get_base_config_file())
+
+        golden_container = golden_containers[0]
+        print("Going to clone container {} from {}.".format(self._result(), golden_container))
+        copy_container(golden_container, self._result())
+
+        # the post config profiles (e.g. the shared folders) are specific to the current user
+        profiles = Profile().run(self.config.get_base_config_file(), include_post_config_profiles=True)
+        apply_profiles(self._result(), profiles)
+
+        sfc = SharedFolderCoordinator(self.config)
+        sfc.create_host_folders()
+
+        self._setup_bridge()
+        start_container(self._result())
+        sfc.verify_container_mountpoints(self._result())
+
+        print_success("Cloned container {} from {}.".format(self._result(), golden_container))
+        return self._result()
+
+    def _setup_bridge(self):
+        bridge_name = self.config.get_lxc_bridge_interface_name()
+        if not is_bridge_available(bridge_name):
+            print("Creating new bridge '{}'.".format(bridge_name))
+            create_bridge(bridge_name)
+
+    def _dispatch(self, container_name, config_file, run_method):
+        self._setup_parser(config_file)
+        self.container_name = container_name
+        return run_method()
+
+    def _result(self):
+        return self.container_name
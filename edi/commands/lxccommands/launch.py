@@ -93,7 +93,8 @@ class Launch(Lxc):
                 if is_container_running(self._result()):
                     logging.info(("Stopping container {0} to update profiles."
                                   ).format(self._result()))
-                    stop_container(self._result(), timeout=self.config.get_lxc_stop_timeout())
+                    stop_container(self._result(), timeout=self.config.get_lxc_stop_timeout(),
+                                   hang_timeout=self.config.get_lxc_stop_hang_timeout())
                 apply_profiles(self._result(), profiles)
 
             if not is_container_running(self._result()):
@@ -119,7 +120,8 @@ class Launch(Lxc):
     def _clean(self):
         if self.config.create_distributable_image():
             # Do not delete containers that were generated using "edi lxc configure ..."!
-            if try_delete_container(self._result(), self.config.get_lxc_stop_timeout()):
+            if try_delete_container(self._result(), self.config.get_lxc_stop_timeout(),
+                                    self.config.get_lxc_stop_hang_timeout()):
                 print_success("Deleted lxc container {}.".format(self._result()))
 
         if self.clean_depth > 0:
@@ -19,13 +19,19 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import partial
 from edi.commands.lxc import Lxc
 from edi.commands.lxccommands.profile import Profile
 from edi.commands.lxccommands.launch import Launch
 from edi.lib.playbookrunner import PlaybookRunner
 from edi.lib.helpers import print_success
 from edi.lib.sharedfoldercoordinator import SharedFolderCoordinator
-from edi.lib.lxchelpers import apply_profiles
+from edi.lib.lxchelpers import apply_profiles, set_container_config_item, wait_for_container_network
+from edi.lib.cachehelpers import get_content_hash
+
+
+# containers with the same configuration fingerprint got configured identically (apart from post config profiles)
+configuration_fingerprint_key = 'user.edi.configuration'
 
 
 class Configure(Lxc):
@@ -33,6 +39,7 @@ class Configure(Lxc):
     def __init__(self):
         super().__init__()
         self.container_name = ""
+        self.force = False
         self.ansible_connection = 'lxd'
 
     @classmethod
@@ -42,7 +49,9 @@ class Configure(Lxc):
         parser = subparsers.add_parser(cls._get_short_command_name(),
                                        help=help_text,
                                        description=description_text)
-        cls._offer_options(parser, introspection=True, clean=True)
+        exclusive_group = cls._offer_options(parser, introspection=True, clean=True)
+        exclusive_group.add_argument('--force', action="store_true",
+                                     help='apply all playbooks even if they did not change since the last run')
         parser.add_argument('container_name')
         cls._require_config_file(parser)
 
@@ -51,7 +60,11 @@ class Configure(Lxc):
         return [cli_args.container_name, cli_args.config_file]
 
     def run_cli(self, cli_args):
-        self._dispatch(*self._unpack_cli_args(cli_args), run_method=self._get_run_method(cli_args))
+        run_method = self._get_run_method(cli_args)
+        if cli_args.force:
+            # --force excludes the other options, therefore the run method is self.run
+            run_method = partial(run_method, force=True)
+        self._dispatch(*self._unpack_cli_args(cli_args), run_method=run_method)
 
     def dry_run(self, container_name, config_file):
         return self._dispatch(container_name, config_file, run_method=self._dry_run)
@@ -64,15 +77,18 @@ class Configure(Lxc):
         plugins.update(Profile().dry_run(self.config.get_base_config_file(), include_post_config_profiles=True))
         return plugins
 
-    def run(self, container_name, config_file):
-        return self._dispatch(container_name, config_file, run_method=self._run)
+    def run(self, container_name, config_file, force=False):
+        return self._dispatch(container_name, config_file, run_method=self._run, force=force)
 
     def _run(self):
         Launch().run(self.container_name, self.config.get_base_config_file())
+        # the playbooks (e.g. package installations) need the network of the freshly started container
+        wait_for_container_network(self._result())
 
         print("Going to configure container {} - be patient.".format(self._result()))
 
-        playbook_runner = PlaybookRunner(self.config, self._result(), self.ansible_connection)
+        playbook_runner = PlaybookRunner(self.config, self._result(), self.ansible_connection,
+                                         force=self.force)
         playbook_runner.run_all()
 
         sfc = SharedFolderCoordinator(self.config)
@@ -84,9 +100,24 @@ class Configure(Lxc):
         apply_profiles(self.container_name, profiles)
         # TODO: restart container if needed
 
+        set_container_config_item(self.container_name, configuration_fingerprint_key, self._get_fingerprint())
+
         print_success("Configured container {}.".format(self._result()))
         return self._result()
 
+    def get_fingerprint(self, container_name, config_file):
+        return self._dispatch(container_name, config_file, run_method=self._get_fingerprint)
+
+    def _get_fingerprint(self):
+        """
+        The fingerprint covers the configuration name, the pre config profiles and the playbooks.
+        It does not depend on the current user, therefore teammates can clone each other's containers.
+        """
+        profiles = Profile().get_profile_names(self.config.get_base_config_file(), include_post_config_profiles=False)
+        playbook_runner = PlaybookRunner(self.config, self._result(), self.ansible_connection)
+        return get_content_hash(self.config.get_configuration_name(),
+                                *(profiles + playbook_runner.get_fingerprints(portable=True)))
+
     def clean_recursive(self, container_name, config_file, depth):
         self.clean_depth = depth
         self._dispatch(container_name, config_file, run_method=self._clean)
@@ -95,9 +126,10 @@ class Configure(Lxc):
         if self.clean_depth > 0:
             Launch().clean_recursive(self.container_name, self.config.get_base_config_file(), self.clean_depth - 1)
 
-    def _dispatch(self, container_name, config_file, run_method):
+    def _dispatch(self, container_name, config_file, run_method, force=False):
         self._setup_parser(config_file)
         self.container_name = container_name
+        self.force = force
         return run_method()
 
     def _result(self):
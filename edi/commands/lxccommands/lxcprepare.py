@@ -27,7 +27,6 @@ import calendar
 import yaml
 import shutil
 import glob
-from jinja2 import Template
 from codecs import open
 from edi.commands.lxc import Lxc
 from edi.commands.imagecommands.bootstrap import Bootstrap
@@ -145,11 +144,12 @@ class Prepare(Lxc):
             os.mkdir(templates_dest)
 
         for template, name, path, dictionary in template_list:
-            logging.info(("Loading template {} located in "
-                          "{} with dictionary:\n{}"
-                          ).format(name, path,
-                                   yaml.dump(remove_passwords(dictionary),
-                                             default_flow_style=False)))
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info(("Loading template {} located in "
+                              "{} with dictionary:\n{}"
+                              ).format(name, path,
+                                       yaml.dump(remove_passwords(dictionary),
+                                                 default_flow_style=False)))
 
             sub_node = yaml.safe_load(template)
             template_node = dict(template_node, **sub_node)
@@ -170,15 +170,9 @@ class Prepare(Lxc):
             f.write(yaml.dump(metadata))
 
     def _get_templates(self):
-        collected_templates = []
-        template_list = self.config.get_ordered_path_items(self.config_section)
-        for name, path, dictionary, _ in template_list:
-            with open(path, encoding="UTF-8", mode="r") as template_file:
-                t = Template(template_file.read())
-                template_text = normalize_yaml(t.render(dictionary))
-                collected_templates.append((template_text, name, path, dictionary))
-
-        return collected_templates
+        rendered_templates = self.config.get_plugin_plan(self.config_section).get_rendered_plugins()
+        return [(normalize_yaml(template_text), name, path, dictionary)
+                for template_text, name, path, dictionary in rendered_templates]
 
     def _get_plugin_report(self):
         result = {}
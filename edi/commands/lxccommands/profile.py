@@ -22,12 +22,11 @@
 
 import logging
 import yaml
-from jinja2 import Template
 from edi.commands.lxc import Lxc
 from edi.lib.helpers import print_success
 from edi.lib.sharedfoldercoordinator import SharedFolderCoordinator
 from edi.lib.configurationparser import remove_passwords
-from edi.lib.lxchelpers import write_lxc_profile
+from edi.lib.lxchelpers import reconcile_lxc_profiles, get_lxc_profile_name
 from edi.lib.yamlhelpers import LiteralString
 
 
@@ -37,6 +36,7 @@ class Profile(Lxc):
         super().__init__()
         self.config_section = 'lxc_profiles'
         self.include_post_config_profiles = False
+        self.remove_unused_profiles = False
 
     @classmethod
     def advertise(cls, subparsers):
@@ -49,34 +49,41 @@ class Profile(Lxc):
         cls._require_config_file(parser)
         parser.add_argument("-p", "--include-post-config", action="store_true",
                             help="include profiles that can only be applied after configuration")
+        parser.add_argument("-r", "--remove-unused", action="store_true",
+                            help="remove the edi profiles that are not used by any container")
 
     @staticmethod
     def _unpack_cli_args(cli_args):
-        return [cli_args.config_file, cli_args.include_post_config]
+        return [cli_args.config_file, cli_args.include_post_config, cli_args.remove_unused]
 
     def run_cli(self, cli_args):
         self._dispatch(*self._unpack_cli_args(cli_args), run_method=self._get_run_method(cli_args))
 
-    def dry_run(self, config_file, include_post_config_profiles):
-        return self._dispatch(config_file, include_post_config_profiles, run_method=self._dry_run)
+    def dry_run(self, config_file, include_post_config_profiles, remove_unused_profiles=False):
+        return self._dispatch(config_file, include_post_config_profiles, remove_unused_profiles,
+                              run_method=self._dry_run)
 
     def _dry_run(self):
         return self._get_plugin_report(self.include_post_config_profiles)
 
-    def run(self, config_file, include_post_config_profiles):
-        return self._dispatch(config_file, include_post_config_profiles, run_method=self._run)
+    def run(self, config_file, include_post_config_profiles, remove_unused_profiles=False):
+        return self._dispatch(config_file, include_post_config_profiles, remove_unused_profiles,
+                              run_method=self._run)
 
     def _run(self):
-        profile_name_list = []
+        profiles = self._get_profiles(self.include_post_config_profiles)
 
-        for profile, name, path, dictionary in self._get_profiles(self.include_post_config_profiles):
-            logging.info(("Creating profile {} located in "
-                          "{} with dictionary:\n{}"
-                          ).format(name, path,
-                                   yaml.dump(remove_passwords(dictionary),
-                                             default_flow_style=False)))
+        for _, name, path, dictionary in profiles:
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info(("Creating profile {} located in "
+                              "{} with dictionary:\n{}"
+                              ).format(name, path,
+                                       yaml.dump(remove_passwords(dictionary),
+                                                 default_flow_style=False)))
 
-            full_name, new_profile = write_lxc_profile(profile)
+        profile_name_list = []
+        for full_name, new_profile in reconcile_lxc_profiles([profile for profile, _, _, _ in profiles],
+                                                             remove_unused=self.remove_unused_profiles):
             if new_profile:
                 print_success("Created lxc profile {}.".format(full_name))
             profile_name_list.append(full_name)
@@ -84,19 +91,25 @@ class Profile(Lxc):
         print_success('The following profiles are now available: {}'.format(', '.join(profile_name_list)))
         return profile_name_list
 
-    def _dispatch(self, config_file, include_post_config_profiles, run_method):
+    def get_profile_names(self, config_file, include_post_config_profiles):
+        """
+        Get the names of the profiles without creating them.
+        """
+        return self._dispatch(config_file, include_post_config_profiles, False,
+                              run_method=self._get_profile_names)
+
+    def _get_profile_names(self):
+        return [get_lxc_profile_name(profile)
+                for profile, _, _, _ in self._get_profiles(self.include_post_config_profiles)]
+
+    def _dispatch(self, config_file, include_post_config_profiles, remove_unused_profiles, run_method):
         self._setup_parser(config_file)
         self.include_post_config_profiles = include_post_config_profiles
+        self.remove_unused_profiles = remove_unused_profiles
         return run_method()
 
     def _get_profiles(self, include_post_config_profiles):
-        collected_profiles = []
-        profile_list = self.config.get_ordered_path_items(self.config_section)
-        for name, path, dictionary, _ in profile_list:
-            with open(path, encoding="UTF-8", mode="r") as profile_file:
-                profile = Template(profile_file.read())
-                profile_text = profile.render(dictionary)
-                collected_profiles.append((profile_text, name, path, dictionary))
+        collected_profiles = self.config.get_plugin_plan(self.config_section).get_rendered_plugins()
 
         sfc = SharedFolderCoordinator(self.config)
         if include_post_config_profiles:
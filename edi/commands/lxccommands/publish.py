@@ -24,7 +24,7 @@ from edi.commands.lxc import Lxc
 from edi.lib.helpers import print_success
 from edi.commands.lxccommands.stop import Stop
 from edi.lib.configurationparser import command_context
-from edi.lib.lxchelpers import is_in_image_store, publish_container, delete_image
+from edi.lib.lxchelpers import is_in_image_store, publish_container, delete_image, delete_container_in_background
 
 
 class Publish(Lxc):
@@ -58,10 +58,20 @@ class Publish(Lxc):
                           ).format(self._result()))
             return self._result()
 
-        container_name = Stop().run(self.config.get_base_config_file())
+        if self.config.get_lxc_publish_snapshot():
+            # skip the graceful shutdown of the temporary container
+            container_name, snapshot_name = Stop().snapshot(self.config.get_base_config_file())
+
+            print("Going to publish snapshot of lxc container in image store.")
+            publish_container(container_name, self._result(), snapshot=snapshot_name)
+            print("Deleting lxc container {} in the background.".format(container_name))
+            delete_container_in_background(container_name)
+        else:
+            container_name = Stop().run(self.config.get_base_config_file())
+
+            print("Going to publish lxc container in image store.")
+            publish_container(container_name, self._result())
 
-        print("Going to publish lxc container in image store.")
-        publish_container(container_name, self._result())
         print_success("Published lxc container in image store as {}.".format(self._result()))
         return self._result()
 
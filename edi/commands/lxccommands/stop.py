@@ -24,7 +24,11 @@ from edi.commands.lxc import Lxc
 from edi.commands.lxccommands.lxcconfigure import Configure
 from edi.lib.configurationparser import command_context
 from edi.lib.helpers import print_success
-from edi.lib.lxchelpers import stop_container, try_delete_container
+from edi.lib.lxchelpers import (stop_container, try_delete_container, sync_container, get_container_snapshots,
+                                create_container_snapshot, delete_container_snapshot)
+
+
+publish_snapshot_name = 'edi-publish'
 
 
 class Stop(Lxc):
@@ -60,11 +64,31 @@ class Stop(Lxc):
         Configure().run(self._result(), self.config.get_base_config_file())
 
         print("Going to stop lxc container {}.".format(self._result()))
-        stop_container(self._result(), timeout=self.config.get_lxc_stop_timeout())
+        stop_container(self._result(), timeout=self.config.get_lxc_stop_timeout(),
+                       hang_timeout=self.config.get_lxc_stop_hang_timeout())
         print_success("Stopped lxc container {}.".format(self._result()))
 
         return self._result()
 
+    def snapshot(self, config_file):
+        """
+        Configure the container and take a snapshot of it instead of stopping it.
+        :return: The name of the container and the name of the snapshot.
+        """
+        return self._dispatch(config_file, run_method=self._snapshot)
+
+    def _snapshot(self):
+        Configure().run(self._result(), self.config.get_base_config_file())
+
+        print("Going to take a snapshot of lxc container {}.".format(self._result()))
+        sync_container(self._result())
+        if publish_snapshot_name in get_container_snapshots(self._result()):
+            delete_container_snapshot(self._result(), publish_snapshot_name)
+        create_container_snapshot(self._result(), publish_snapshot_name)
+        print_success("Took snapshot {} of lxc container {}.".format(publish_snapshot_name, self._result()))
+
+        return self._result(), publish_snapshot_name
+
     def clean_recursive(self, config_file, depth):
         self._delete_container = False  # Delete the container within the launch command!
         self.clean_depth = depth
@@ -74,7 +98,8 @@ class Stop(Lxc):
         self._dispatch(config_file, run_method=self._clean)
 
     def _clean(self):
-        if self._delete_container and try_delete_container(self._result(), self.config.get_lxc_stop_timeout()):
+        if self._delete_container and try_delete_container(self._result(), self.config.get_lxc_stop_timeout(),
+                                                           self.config.get_lxc_stop_hang_timeout()):
             print_success("Deleted lxc container {}.".format(self._result()))
 
         if self.clean_depth > 0:
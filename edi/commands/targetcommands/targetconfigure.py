@@ -19,6 +19,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import partial
 from edi.commands.target import Target
 from edi.lib.playbookrunner import PlaybookRunner
 from edi.lib.helpers import print_success
@@ -30,6 +31,7 @@ class Configure(Target):
     def __init__(self):
         super().__init__()
         self.ip_address = None
+        self.force = False
 
     @classmethod
     def advertise(cls, subparsers):
@@ -38,7 +40,9 @@ class Configure(Target):
         parser = subparsers.add_parser(cls._get_short_command_name(),
                                        help=help_text,
                                        description=description_text)
-        cls._offer_options(parser, introspection=True, clean=False)
+        exclusive_group = cls._offer_options(parser, introspection=True, clean=False)
+        exclusive_group.add_argument('--force', action="store_true",
+                                     help='apply all playbooks even if they did not change since the last run')
         parser.add_argument('ip_address')
         cls._require_config_file(parser)
 
@@ -47,7 +51,11 @@ class Configure(Target):
         return [cli_args.ip_address, cli_args.config_file]
 
     def run_cli(self, cli_args):
-        self._dispatch(*self._unpack_cli_args(cli_args), run_method=self._get_run_method(cli_args))
+        run_method = self._get_run_method(cli_args)
+        if cli_args.force:
+            # --force excludes the other options, therefore the run method is self.run
+            run_method = partial(run_method, force=True)
+        self._dispatch(*self._unpack_cli_args(cli_args), run_method=run_method)
 
     def dry_run(self, ip_address, config_file):
         return self._dispatch(ip_address, config_file, run_method=self._dry_run)
@@ -55,22 +63,23 @@ class Configure(Target):
     def _dry_run(self):
         return self.config.get_plugins('playbooks')
 
-    def run(self, ip_address, config_file):
-        return self._dispatch(ip_address, config_file, run_method=self._run)
+    def run(self, ip_address, config_file, force=False):
+        return self._dispatch(ip_address, config_file, run_method=self._run, force=force)
 
     def _run(self):
         print("Going to configure target system ({}) - be patient.".format(self._result()))
 
-        playbook_runner = PlaybookRunner(self.config, self._result(), "ssh")
+        playbook_runner = PlaybookRunner(self.config, self._result(), "ssh", force=self.force)
         playbook_runner.run_all()
 
         print_success("Configured target system ({}).".format(self._result()))
         return self._result()
 
-    def _dispatch(self, ip_address, config_file, run_method):
+    def _dispatch(self, ip_address, config_file, run_method, force=False):
         with command_context({'edi_configure_remote_target': True}):
             self._setup_parser(config_file)
             self.ip_address = ip_address
+            self.force = force
             return run_method()
 
     def _result(self):
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import logging
+import hashlib
+import tempfile
+import yaml
+from edi.lib.helpers import (get_cache_dir, create_cache_dir, get_user_cache_dir, create_user_cache_dir,
+                             chown_to_user)
+
+
+# use the (much faster) libyaml bindings if available
+_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+_max_entries_per_namespace = 32
+
+
+def get_content_hash(*items):
+    """
+    Calculate a stable hash over a number of items.
+    :param items: The items (e.g. file contents) that shall contribute to the hash.
+    :return: The hash as a hex string.
+    """
+    content_hash = hashlib.sha256()
+    for item in items:
+        content_hash.update(str(item).encode())
+        content_hash.update(b'\0')
+    return content_hash.hexdigest()
+
+
+def _get_cache_file(namespace, key, per_user):
+    cache_dir = get_user_cache_dir() if per_user else get_cache_dir()
+    return os.path.join(cache_dir, namespace, '{}.yml'.format(key))
+
+
+def load_cache_entry(namespace, key, per_user=False):
+    """
+    Load a persistent cache entry.
+    :param namespace: The namespace (sub folder) of the cache entry.
+    :param key: The key (e.g. a content hash) of the cache entry.
+    :param per_user: True if the entry is shared by all projects of the user.
+    :return: The cached data or None if there is no usable entry.
+    """
+    cache_file = _get_cache_file(namespace, key, per_user)
+    try:
+        with open(cache_file, encoding='utf-8', mode='r') as f:
+            return yaml.load(f, Loader=_loader)
+    except FileNotFoundError:
+        return None
+    except (OSError, yaml.YAMLError) as e:
+        logging.debug('''Ignoring unusable cache entry '{}': {}'''.format(cache_file, e))
+        return None
+
+
+def store_cache_entry(namespace, key, data, per_user=False):
+    """
+    Store a persistent cache entry.
+    A failure to write the entry is not considered as an error since edi works fine without the cache.
+    :param namespace: The namespace (sub folder) of the cache entry.
+    :param key: The key (e.g. a content hash) of the cache entry.
+    :param data: The data that can be represented using yaml.
+    :param per_user: True if the entry is shared by all projects of the user.
+    """
+    temp_file = None
+    try:
+        cache_dir = create_user_cache_dir() if per_user else create_cache_dir()
+        directory = os.path.join(cache_dir, namespace)
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+            chown_to_user(directory)
+
+        fd, temp_file = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, encoding='utf-8', mode='w') as f:
+            yaml.dump(data, f, Dumper=_dumper, default_flow_style=False)
+        chown_to_user(temp_file)
+        os.replace(temp_file, _get_cache_file(namespace, key, per_user))
+        temp_file = None
+        _prune(directory)
+    except (OSError, yaml.YAMLError) as e:
+        logging.debug('''Unable to store cache entry '{}' in namespace '{}': {}'''.format(key, namespace, e))
+    finally:
+        if temp_file and os.path.isfile(temp_file):
+            os.remove(temp_file)
+
+
+def _prune(directory):
+    entries = [entry for entry in os.scandir(directory) if entry.name.endswith('.yml')]
+    if len(entries) <= _max_entries_per_namespace:
+        return
+
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[_max_entries_per_namespace:]:
+        logging.debug('''Pruning cache entry '{}'.'''.format(entry.path))
+        os.remove(entry.path)
@@ -23,7 +23,6 @@ import os
 import logging
 import tempfile
 import yaml
-import jinja2
 import stat
 from codecs import open
 from edi.lib.helpers import (chown_to_user, FatalError, get_workdir, get_artifact_dir,
@@ -31,6 +30,7 @@ from edi.lib.helpers import (chown_to_user, FatalError, get_workdir, get_artifac
 from edi.lib.shellhelpers import run, safely_remove_artifacts_folder
 from edi.lib.configurationparser import remove_passwords
 from edi.lib.yamlhelpers import LiteralString
+from edi.lib.jinja2helpers import render_template_file
 
 
 class CommandRunner():
@@ -56,11 +56,12 @@ class CommandRunner():
                     chown_to_user(tmpdir)
                     require_root = raw_node.get('require_root', False)
 
-                    logging.info(("Running command {} located in "
-                                  "{} with dictionary:\n{}"
-                                  ).format(name, path,
-                                           yaml.dump(remove_passwords(dictionary),
-                                                     default_flow_style=False)))
+                    if logging.getLogger().isEnabledFor(logging.INFO):
+                        logging.info(("Running command {} located in "
+                                      "{} with dictionary:\n{}"
+                                      ).format(name, path,
+                                               yaml.dump(remove_passwords(dictionary),
+                                                         default_flow_style=False)))
 
                     command_file = self._flush_command_file(tmpdir, filename, content)
                     self._run_command(command_file, require_root)
@@ -179,10 +180,7 @@ class CommandRunner():
 
     @staticmethod
     def _render_command_file(input_file, dictionary):
-        with open(input_file, encoding="UTF-8", mode="r") as template_file:
-            template = jinja2.Template(template_file.read())
-            result = template.render(dictionary)
-
+        result = render_template_file(input_file, dictionary)
         filename = os.path.basename(input_file)
         return filename, result
 
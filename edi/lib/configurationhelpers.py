@@ -20,10 +20,10 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import jinja2
 import yaml
 from codecs import open
 from edi.lib.helpers import FatalError, get_edi_plugin_directory
+from edi.lib.jinja2helpers import render_template_file
 
 
 placeholder = 'PROJECTNAME'
@@ -109,9 +109,7 @@ class ConfigurationTemplate():
     @staticmethod
     def _render_jinja2(path, **kwargs):
         dictionary = kwargs
-        with open(path, encoding="UTF-8", mode="r") as template_file:
-            template = jinja2.Template(template_file.read(), trim_blocks=True, lstrip_blocks=True)
-            result = template.render(dictionary)
+        result = render_template_file(path, dictionary, trim_blocks=True, lstrip_blocks=True)
 
         with open(path, encoding="UTF-8", mode="w") as result_file:
             result_file.write(result)
@@ -23,21 +23,21 @@ import yaml
 import collections
 import copy
 import hashlib
-from jinja2 import Template
 import os
 from contextlib import contextmanager
 from os.path import dirname, abspath, basename, splitext, isfile, join
 import logging
-from edi.lib.helpers import (get_user, get_user_group, get_user_gid, get_user_uid, get_workdir,
-                             get_hostname, get_edi_plugin_directory, FatalError)
-from edi.lib.proxyhelpers import ProxySetup
-from edi.lib.sshkeyhelpers import get_user_ssh_pub_keys
-from edi.lib.versionhelpers import get_edi_version, get_stripped_version
-from edi.lib.shellhelpers import get_user_home_directory, get_current_display
-from edi.lib.lxchelpers import get_lxd_version
+from edi.lib.helpers import (get_user, get_workdir, get_hostname, get_edi_plugin_directory, FatalError,
+                             is_cache_dir_available)
+from edi.lib.hostfacts import HostFacts
+from edi.lib.versionhelpers import get_stripped_version
 from packaging.version import Version
 from edi.lib.urlhelpers import obfuscate_url_password
 from edi.lib.yamlhelpers import annotated_yaml_load
+from edi.lib.cachehelpers import get_content_hash, load_cache_entry, store_cache_entry
+from edi.lib.jinja2helpers import get_referenced_variables, render_template
+from edi.lib.pluginplan import PluginPlan
+from edi.lib.pluginindex import PluginIndex
 
 
 def remove_passwords(dictionary):
@@ -56,27 +56,7 @@ def remove_passwords(dictionary):
 
 
 def get_base_dictionary():
-    base_dict = {}
-    current_user_name = get_user()
-    base_dict["edi_current_user_name"] = current_user_name
-    base_dict["edi_current_user_group_name"] = get_user_group()
-    base_dict["edi_current_user_ssh_pub_keys"] = get_user_ssh_pub_keys()
-    base_dict["edi_current_user_uid"] = get_user_uid()
-    base_dict["edi_current_user_gid"] = get_user_gid()
-    base_dict["edi_current_user_host_home_directory"] = get_user_home_directory(current_user_name)
-    base_dict["edi_current_user_target_home_directory"] = "/home/{}".format(current_user_name)
-    base_dict["edi_host_hostname"] = get_hostname()
-    base_dict["edi_edi_plugin_directory"] = get_edi_plugin_directory()
-    proxy_setup = ProxySetup()
-    base_dict["edi_host_http_proxy"] = proxy_setup.get('http_proxy', default='')
-    base_dict["edi_host_https_proxy"] = proxy_setup.get('https_proxy', default='')
-    base_dict["edi_host_ftp_proxy"] = proxy_setup.get('ftp_proxy', default='')
-    base_dict["edi_host_socks_proxy"] = proxy_setup.get('all_proxy', default='')
-    base_dict["edi_host_no_proxy"] = proxy_setup.get('no_proxy', default='')
-    base_dict["edi_edi_version"] = get_edi_version()
-    base_dict["edi_lxd_version"] = get_lxd_version()
-    base_dict["edi_current_display"] = get_current_display()
-    return base_dict
+    return HostFacts.get_dictionary()
 
 
 @contextmanager
@@ -92,7 +72,18 @@ def command_context(dictionary):
 class ConfigurationParser:
 
     # shared data for all configuration parsers
-    _configurations = {}
+    # keyed by (absolute path, content hash, command context), least recently used first
+    _configurations = collections.OrderedDict()
+    _max_configurations = 32
+
+    # the resolved plugins of a configuration section, keyed by (registry key, section, ...)
+    _plugin_plans = {}
+
+    # increment this value if the structure of the persistent cache entries changes
+    _cache_format = 1
+
+    _plugin_sections = ["playbooks", "postprocessing_commands", "lxc_templates",
+                        "lxc_profiles", "documentation_steps"]
 
     # use the command_context contextmanager to manage dictionary
     command_context = {
@@ -190,13 +181,62 @@ class ConfigurationParser:
             raise FatalError('''The value of 'edi_lxc_stop_timeout' must be an integer.''')
         return timeout
 
+    def get_lxc_stop_hang_timeout(self):
+        hang_timeout = self._get_general_item("edi_lxc_stop_hang_timeout", None)
+        if hang_timeout is not None and (not isinstance(hang_timeout, int) or isinstance(hang_timeout, bool) or
+                                         hang_timeout <= 0):
+            raise FatalError('''The value of 'edi_lxc_stop_hang_timeout' must be a positive integer.''')
+        return hang_timeout
+
+    def get_lxc_playbook_snapshots(self):
+        snapshots = self._get_general_item("edi_lxc_playbook_snapshots", 0)
+        if not isinstance(snapshots, int) or isinstance(snapshots, bool) or snapshots < 0:
+            raise FatalError('''The value of 'edi_lxc_playbook_snapshots' must be a non-negative integer.''')
+        return snapshots
+
+    def get_lxc_publish_snapshot(self):
+        publish_snapshot = self._get_general_item("edi_lxc_publish_snapshot", False)
+        if not isinstance(publish_snapshot, bool):
+            raise FatalError('''The value of 'edi_lxc_publish_snapshot' must be a boolean.''')
+        return publish_snapshot
+
     def get_lxc_bridge_interface_name(self):
         return self._get_general_item("edi_lxc_bridge_interface_name", "lxdbr0")
 
     def get_general_parameters(self):
         return self._get_general_item("parameters", {})
 
+    def get_plugin_plan(self, section):
+        """
+        Get the resolved plugins of a section. The plan gets shared by all consumers
+        as long as neither the configuration, the context nor the plugin files change.
+        :param section: The plugin section (e.g. playbooks).
+        :return: A PluginPlan.
+        """
+        plan_key = (self._registry_key, section, get_workdir(),
+                    logging.getLevelName(logging.getLogger().getEffectiveLevel()))
+        plan = ConfigurationParser._plugin_plans.get(plan_key)
+        if plan is None or not plan.is_valid():
+            items = self._get_ordered_path_items(section)
+            plan = PluginPlan(items, self._get_watched_plugin_paths(section, items))
+            ConfigurationParser._plugin_plans[plan_key] = plan
+
+        return plan
+
     def get_ordered_path_items(self, section):
+        return self.get_plugin_plan(section).get_items()
+
+    def _get_watched_plugin_paths(self, section, items):
+        watched_paths = set()
+        for _, resolved_path, _, content in items:
+            watched_paths.add(resolved_path)
+            path = content.get("path")
+            if not os.path.isabs(path):
+                # a newly added project plugin might shadow the resolved plugin
+                watched_paths.add(join(self.get_project_plugin_directory(), path))
+        return watched_paths
+
+    def _get_ordered_path_items(self, section):
         citems = self._get_config().get(section, {})
         ordered_items = collections.OrderedDict(sorted(citems.items()))
         item_list = []
@@ -239,30 +279,41 @@ class ConfigurationParser:
         self.base_config_file = base_config_file
         self.project_directory = dirname(abspath(base_config_file.name))
         self.config_id = splitext(basename(base_config_file.name))[0]
-        if not ConfigurationParser._configurations.get(self.config_id):
-            logging.info(("Load time dictionary:\n{}"
-                          ).format(yaml.dump(remove_passwords(self._get_load_time_dictionary()),
-                                             default_flow_style=False)))
+        base_content = self._read_base_config_file(base_config_file)
+        self._registry_key = (abspath(base_config_file.name), get_content_hash(base_content),
+                              tuple(sorted(ConfigurationParser.command_context.items())))
+        self._configuration = ConfigurationParser._configurations.get(self._registry_key)
+        if self._configuration is not None:
+            ConfigurationParser._configurations.move_to_end(self._registry_key)
+        else:
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                # Hint: dumping the load time dictionary evaluates all lazy items
+                logging.debug(("Load time dictionary:\n{}"
+                               ).format(yaml.dump(remove_passwords(self._get_load_time_dictionary()),
+                                                  default_flow_style=False)))
             logging.info(("Using base configuration file '{0}'"
                           ).format(base_config_file.name))
-            base_config = self._get_base_config(base_config_file)
-            global_config = self._get_overlay_config(base_config_file,
-                                                     "global")
-            hostname = get_hostname()
-            system_config = self._get_overlay_config(base_config_file, hostname)
-            user = get_user()
-            if user == hostname:
-                user = '{}.user'.format(user)
-                logging.warning(("User name and host name are equal! Going to search user overlay file "
-                                 "with '.user' postfix."))
-            user_config = self._get_overlay_config(base_config_file, user)
-
-            merge_1 = self._merge_configurations(base_config, global_config)
-            merge_2 = self._merge_configurations(merge_1, system_config)
-            merged_config = self._merge_configurations(merge_2, user_config)
-
-            ConfigurationParser._configurations[self.config_id] = merged_config
-            logging.info("Merged configuration:\n{0}".format(self.dump()))
+            overlays = [(overlay, self._read_file(overlay)) for overlay in self._get_overlay_files(base_config_file)]
+
+            cache_key = self._get_cache_key(base_content, overlays)
+            cache_entry = load_cache_entry('configurations', cache_key)
+            if cache_entry:
+                logging.info("Using cached merged configuration '{}'.".format(cache_key))
+            else:
+                merged_config = self._get_base_config(base_content, base_config_file.name)
+                for overlay, overlay_content in overlays:
+                    merged_config = self._merge_configurations(merged_config,
+                                                               self._get_overlay_config(overlay, overlay_content))
+
+                cache_entry = {'config': merged_config, 'plugins': self._get_resolvable_plugins(merged_config)}
+                if is_cache_dir_available():
+                    # read-only commands (e.g. introspection) shall not create an artifact directory
+                    store_cache_entry('configurations', cache_key, cache_entry)
+
+            self._configuration = cache_entry
+            self._register_configuration(self._registry_key, cache_entry)
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info("Merged configuration:\n{0}".format(self.dump()))
 
             self._verify_version_compatibility()
 
@@ -273,8 +324,25 @@ class ConfigurationParser:
         """
         return self.base_config_file
 
+    @staticmethod
+    def _read_base_config_file(base_config_file):
+        # the same file object gets handed over to the sub commands
+        if base_config_file.seekable():
+            base_config_file.seek(0)
+        return base_config_file.read()
+
+    @staticmethod
+    def _register_configuration(registry_key, configuration):
+        configurations = ConfigurationParser._configurations
+        configurations[registry_key] = configuration
+        while len(configurations) > ConfigurationParser._max_configurations:
+            evicted_key, _ = configurations.popitem(last=False)
+            for plan_key in [key for key in ConfigurationParser._plugin_plans if key[0] == evicted_key]:
+                del ConfigurationParser._plugin_plans[plan_key]
+            logging.debug("Evicting configuration '{}' from the registry.".format(evicted_key[0]))
+
     def _verify_version_compatibility(self):
-        current_version = get_edi_version()
+        current_version = HostFacts.get().get('edi_edi_version')
         required_version = str(self._get_general_item('edi_required_minimal_edi_version', current_version))
         if Version(get_stripped_version(current_version)) < Version(get_stripped_version(required_version)):
             raise FatalError(('The current configuration requires a newer version of edi (>={}).\n'
@@ -282,30 +350,83 @@ class ConfigurationParser:
                               ).format(get_stripped_version(required_version)))
 
     def _get_config(self):
-        return ConfigurationParser._configurations.get(self.config_id, {})
+        return (self._configuration or {}).get('config', {})
+
+    def _get_resolved_plugins(self):
+        return (self._configuration or {}).get('plugins', {})
 
-    def _parse_jina2_file(self, config_file):
-        template = Template(config_file.read())
-        return template.render(self._get_load_time_dictionary())
+    def _parse_jina2_file(self, content):
+        return render_template(content, self._get_load_time_dictionary())
 
-    def _get_base_config(self, config_file):
-        return annotated_yaml_load(self._parse_jina2_file(config_file), config_file.name) or {}
+    def _get_base_config(self, content, file_name):
+        return annotated_yaml_load(self._parse_jina2_file(content), file_name) or {}
+
+    def _get_overlay_files(self, base_config_file):
+        hostname = get_hostname()
+        user = get_user()
+        if user == hostname:
+            user = '{}.user'.format(user)
+            logging.warning(("User name and host name are equal! Going to search user overlay file "
+                             "with '.user' postfix."))
 
-    def _get_overlay_config(self, base_config_file, overlay_name):
         fname, extension = splitext(basename(base_config_file.name))
         directory = dirname(base_config_file.name)
-        overlay_file = "{0}.{1}{2}".format(fname, overlay_name,
-                                           extension)
-        overlay = join(directory, "configuration", "overlay",
-                       overlay_file)
-        if isfile(overlay) and os.access(overlay, os.R_OK):
-            with open(overlay, encoding="UTF-8", mode="r") as config_file:
-                logging.info(("Using overlay configuration file '{0}'"
-                              ).format(config_file.name))
-                return annotated_yaml_load(self._parse_jina2_file(config_file), config_file.name) or {}
+        overlay_files = []
+        for overlay_name in ["global", hostname, user]:
+            overlay_file = "{0}.{1}{2}".format(fname, overlay_name,
+                                               extension)
+            overlay_files.append(join(directory, "configuration", "overlay",
+                                      overlay_file))
+        return overlay_files
+
+    @staticmethod
+    def _read_file(path):
+        if isfile(path) and os.access(path, os.R_OK):
+            with open(path, encoding="UTF-8", mode="r") as config_file:
+                return config_file.read()
         else:
+            return None
+
+    def _get_overlay_config(self, overlay, content):
+        if content is None:
             return {}
 
+        logging.info(("Using overlay configuration file '{0}'"
+                      ).format(overlay))
+        return annotated_yaml_load(self._parse_jina2_file(content), overlay) or {}
+
+    def _get_cache_key(self, base_content, overlays):
+        """
+        The cache key covers all inputs of the merged configuration: the configuration files,
+        the load time variables that are referenced by them and the version of the merge logic.
+        """
+        referenced_variables = get_referenced_variables(base_content)
+        for _, content in overlays:
+            if content is not None:
+                referenced_variables |= get_referenced_variables(content)
+
+        load_time_dictionary = self._get_load_time_dictionary()
+        referenced_items = {key: load_time_dictionary[key] for key in referenced_variables
+                            if key in load_time_dictionary}
+
+        items = [ConfigurationParser._cache_format, abspath(self.base_config_file.name), base_content,
+                 yaml.dump(referenced_items, default_flow_style=False)]
+        for overlay, content in overlays:
+            items.extend([overlay, content])
+        return get_content_hash(*items)
+
+    def _get_resolvable_plugins(self, config):
+        plugins = {}
+        for section in ConfigurationParser._plugin_sections:
+            for _, content in config.get(section, {}).items():
+                path = content.get("path", None)
+                if path and not content.get("skip", False) and not os.path.isabs(path):
+                    try:
+                        plugins[path] = self._resolve_path(path)
+                    except FatalError:
+                        pass
+        return plugins
+
     def _merge_configurations(self, base, overlay):
         merged_config = {}
 
@@ -400,16 +521,20 @@ class ConfigurationParser:
 
         general_parameters = self.get_general_parameters()
         if general_parameters:
-            node_dict = dict(node_dict, **general_parameters)
+            node_dict.update(general_parameters)
 
         parameters = node.get("parameters", None)
 
         if parameters:
-            return dict(node_dict, **parameters)
+            node_dict.update(parameters)
 
         return node_dict
 
     def _resolve_path(self, path):
+        cached_path = self._get_resolved_plugins().get(path)
+        if cached_path and self._is_cached_path_valid(path, cached_path):
+            return cached_path
+
         if os.path.isabs(path):
             if not os.path.isfile(path):
                 raise FatalError(("'{}' does not exist."
@@ -418,14 +543,36 @@ class ConfigurationParser:
         else:
             locations = [self.get_project_plugin_directory(), get_edi_plugin_directory()]
 
-            for location in locations:
-                abspath = os.path.join(location, path)
-                if os.path.isfile(abspath):
-                    return abspath
-
+            if os.path.normpath(path).startswith(os.pardir):
+                # paths that leave the plugin directories are not covered by the index
+                for location in locations:
+                    abspath = os.path.join(location, path)
+                    if os.path.isfile(abspath):
+                        return abspath
+                indexes = []
+            else:
+                indexes = [PluginIndex.get(location) for location in locations]
+                for index in indexes:
+                    resolved_path = index.resolve(path)
+                    if resolved_path:
+                        return resolved_path
+
+            suggestions = PluginIndex.get_close_matches(path, indexes)
+            hint = "\nDid you mean: {}?".format(", ".join(suggestions)) if suggestions else ""
             raise FatalError(("'{0}' not found in the "
-                              "following locations:\n{1}"
-                              ).format(path, "\n".join(locations)))
+                              "following locations:\n{1}{2}"
+                              ).format(path, "\n".join(locations), hint))
+
+    def _is_cached_path_valid(self, path, cached_path):
+        if not os.path.isfile(cached_path):
+            return False
+
+        # a project plugin might shadow a plugin that has been resolved within the edi plugin directory
+        project_plugin_directory = self.get_project_plugin_directory()
+        if cached_path == os.path.join(project_plugin_directory, path):
+            return True
+        else:
+            return not os.path.isfile(os.path.join(project_plugin_directory, path))
 
     def _has_node(self, node_name):
         if self._get_config().get(node_name, {}):
@@ -34,6 +34,7 @@ from debian.debian_support import Version
 from edi.lib.helpers import print_success, FatalError
 from edi.lib.helpers import get_workdir
 from edi.lib.configurationparser import remove_passwords
+from edi.lib.jinja2helpers import Jinja2Environments
 
 
 class ChangesAnnotator():
@@ -153,13 +154,14 @@ class DocumentationStepRunner():
                 with open(temp_output_path, encoding="UTF-8", mode="a") as output:
                     augmented_parameters = self.augment_step_parameters(parameters)
 
-                    logging.info(("Running documentation step {} located in "
-                                  "{} with parameters:\n{}\n"
-                                  "Writing output to {}."
-                                  ).format(name, path,
-                                           yaml.dump(remove_passwords(augmented_parameters),
-                                                     default_flow_style=False),
-                                           os.path.join(self.rendered_output, output_file)))
+                    if logging.getLogger().isEnabledFor(logging.INFO):
+                        logging.info(("Running documentation step {} located in "
+                                      "{} with parameters:\n{}\n"
+                                      "Writing output to {}."
+                                      ).format(name, path,
+                                               yaml.dump(remove_passwords(augmented_parameters),
+                                                         default_flow_style=False),
+                                               os.path.join(self.rendered_output, output_file)))
 
                     self._run_documentation_step(path, augmented_parameters, output)
                     applied_documentation_steps.append(name)
@@ -402,8 +404,7 @@ class DocumentationStepRunner():
     @staticmethod
     def _render_chunk(template_path, context, outfile):
         try:
-            template_loader = jinja2.FileSystemLoader(searchpath=os.path.dirname(template_path))
-            environment = jinja2.Environment(loader=template_loader)
+            environment = Jinja2Environments.get(searchpath=os.path.dirname(template_path))
             template_file = os.path.basename(template_path)
             template = environment.get_template(template_file)
         except jinja2.TemplateError as te:
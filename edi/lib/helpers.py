@@ -152,3 +152,54 @@ def create_artifact_dir():
         logging.info('''Creating artifact directory '{}'.'''.format(directory))
         os.mkdir(directory)
         chown_to_user(directory)
+
+
+def get_cache_dir():
+    """
+    Get the directory that holds the persistent caches of edi.
+    The location can be overridden using the environment variable EDI_CACHE_DIR.
+    """
+    return os.environ.get('EDI_CACHE_DIR', os.path.join(get_artifact_dir(), '.cache'))
+
+
+def get_user_cache_dir():
+    """
+    Get the directory that holds the persistent caches of edi that are shared by all projects of a user.
+    The location can be overridden using the environment variable EDI_CACHE_DIR.
+    """
+    return os.environ.get('EDI_CACHE_DIR', os.path.join(getpwnam(get_user()).pw_dir, '.cache', 'edi'))
+
+
+def create_user_cache_dir():
+    directory = get_user_cache_dir()
+    if not os.path.isdir(directory):
+        if 'EDI_CACHE_DIR' in os.environ:
+            os.makedirs(directory, mode=0o700)
+            chown_to_user(directory)
+        else:
+            parent = os.path.dirname(directory)
+            for path in [parent, directory]:
+                if not os.path.isdir(path):
+                    os.mkdir(path, mode=0o700)
+                    chown_to_user(path)
+        logging.debug('''Created user cache directory '{}'.'''.format(directory))
+    return directory
+
+
+def is_cache_dir_available():
+    """
+    The cache directory is available if it got configured explicitly or if the artifact directory exists.
+    Hint: edi shall not create an artifact directory in arbitrary working directories just for its caches.
+    """
+    return 'EDI_CACHE_DIR' in os.environ or os.path.isdir(get_artifact_dir())
+
+
+def create_cache_dir():
+    directory = get_cache_dir()
+    if not os.path.isdir(directory):
+        if 'EDI_CACHE_DIR' not in os.environ:
+            create_artifact_dir()
+        logging.debug('''Creating cache directory '{}'.'''.format(directory))
+        os.makedirs(directory)
+        chown_to_user(directory)
+    return directory
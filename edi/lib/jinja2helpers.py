@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import logging
+import hashlib
+import jinja2
+from collections import OrderedDict
+from codecs import open
+from jinja2 import meta
+from edi.lib.helpers import create_cache_dir, is_cache_dir_available, chown_to_user
+
+
+class _TolerantBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    A bytecode cache that does not fail the rendering if the cache can not be written.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            logging.debug('''Unable to store Jinja2 bytecode: {}'''.format(e))
+
+
+class Jinja2Environments:
+    """
+    Provides the edi wide Jinja2 environments.
+    All environments share a persistent bytecode cache within the edi cache directory.
+    Templates that get compiled from a string are kept in an in memory LRU cache.
+    """
+    _environments = dict()
+    _templates = OrderedDict()
+    _bytecode_cache = None
+    _bytecode_cache_initialized = False
+    _max_templates = 256
+
+    def __init__(self, clear_cache=False):
+        if clear_cache:
+            Jinja2Environments._environments = dict()
+            Jinja2Environments._templates = OrderedDict()
+            Jinja2Environments._bytecode_cache = None
+            Jinja2Environments._bytecode_cache_initialized = False
+
+    @staticmethod
+    def get_bytecode_cache():
+        if not Jinja2Environments._bytecode_cache_initialized:
+            if not is_cache_dir_available():
+                return None
+
+            Jinja2Environments._bytecode_cache_initialized = True
+            try:
+                directory = os.path.join(create_cache_dir(), 'jinja2')
+                if not os.path.isdir(directory):
+                    os.mkdir(directory)
+                    chown_to_user(directory)
+                Jinja2Environments._bytecode_cache = _TolerantBytecodeCache(directory=directory)
+            except OSError as e:
+                logging.debug('''Running without Jinja2 bytecode cache: {}'''.format(e))
+
+        return Jinja2Environments._bytecode_cache
+
+    @staticmethod
+    def get(searchpath=None, **options):
+        """
+        Get a shared Jinja2 environment.
+        :param searchpath: If provided, the environment will load its templates from this folder.
+        :param options: Additional options for the environment (e.g. trim_blocks=True).
+        :return: A Jinja2 environment.
+        """
+        key = (searchpath, tuple(sorted(options.items())))
+        environment = Jinja2Environments._environments.get(key)
+        if environment is None:
+            loader = jinja2.FileSystemLoader(searchpath=searchpath) if searchpath else None
+            environment = jinja2.Environment(loader=loader, bytecode_cache=Jinja2Environments.get_bytecode_cache(),
+                                             **options)
+            Jinja2Environments._environments[key] = environment
+
+        return environment
+
+    @staticmethod
+    def get_template(source, name=None, **options):
+        """
+        Get a compiled template together with the variables that it references.
+        :param source: The source of the Jinja2 template.
+        :param name: An optional name (e.g. the file path) of the template that shows up in error messages.
+        :param options: Additional options for the environment (e.g. trim_blocks=True).
+        :return: A tuple (template, referenced_variables)
+        """
+        source_hash = hashlib.sha256(source.encode()).hexdigest()
+        sorted_options = tuple(sorted(options.items()))
+        key = (name, source_hash, sorted_options)
+        templates = Jinja2Environments._templates
+        if key in templates:
+            templates.move_to_end(key)
+            return templates[key]
+
+        environment = Jinja2Environments.get(**options)
+        template_ast = environment.parse(source, name, name)
+        referenced_variables = frozenset(meta.find_undeclared_variables(template_ast))
+
+        bytecode_cache = environment.bytecode_cache
+        bucket = None
+        code = None
+        if bytecode_cache is not None:
+            # the compiled code depends on the environment options (e.g. trim_blocks)
+            bucket_name = '{}{}'.format(name or source_hash, sorted_options)
+            bucket = bytecode_cache.get_bucket(environment, bucket_name, name, source)
+            code = bucket.code
+
+        if code is None:
+            code = environment.compile(template_ast, name, name)
+            if bucket is not None:
+                bucket.code = code
+                bytecode_cache.set_bucket(bucket)
+
+        template = environment.template_class.from_code(environment, code, environment.make_globals(None))
+        templates[key] = (template, referenced_variables)
+        if len(templates) > Jinja2Environments._max_templates:
+            templates.popitem(last=False)
+
+        return templates[key]
+
+
+def get_referenced_variables(source):
+    """
+    Get the variables that a template references from its context.
+    :param source: The source of the Jinja2 template.
+    :return: A set of variable names.
+    """
+    _, referenced_variables = Jinja2Environments.get_template(source)
+    return set(referenced_variables)
+
+
+def select_referenced_items(referenced_variables, dictionary):
+    """
+    Picks the items of a (lazy) dictionary that are referenced by a template.
+    Only the picked items of a LazyDictionary get evaluated.
+    :param referenced_variables: The variables that are referenced by the template.
+    :param dictionary: A dictionary or a LazyDictionary.
+    :return: A dictionary that only contains the referenced items.
+    """
+    return {key: dictionary[key] for key in referenced_variables if key in dictionary}
+
+
+def render_template(source, dictionary, name=None, **options):
+    """
+    Renders a template using only the referenced items of a (lazy) dictionary.
+    :param source: The source of the Jinja2 template.
+    :param dictionary: A dictionary or a LazyDictionary.
+    :param name: An optional name (e.g. the file path) of the template that shows up in error messages.
+    :param options: Additional options for the environment (e.g. trim_blocks=True).
+    :return: The rendered template.
+    """
+    template, referenced_variables = Jinja2Environments.get_template(source, name=name, **options)
+    return template.render(select_referenced_items(referenced_variables, dictionary))
+
+
+def render_template_file(path, dictionary, **options):
+    """
+    Renders a template file using only the referenced items of a (lazy) dictionary.
+    :param path: The path of the Jinja2 template file.
+    :param dictionary: A dictionary or a LazyDictionary.
+    :param options: Additional options for the environment (e.g. trim_blocks=True).
+    :return: The rendered template.
+    """
+    with open(path, encoding="UTF-8", mode="r") as template_file:
+        return render_template(template_file.read(), dictionary, name=path, **options)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections.abc import MutableMapping
+
+
+class LazyDictionary(MutableMapping):
+    """
+    A dictionary whose values can be provided by getters.
+    A getter gets called upon the first access of the respective value.
+    Iterating over the items (e.g. dict(lazy_dictionary)) evaluates all getters.
+    """
+
+    def __init__(self, getters=None, values=None, prefetch=None):
+        """
+        :param getters: A dictionary that maps keys to getters without arguments.
+        :param values: A dictionary containing already known values.
+        :param prefetch: An optional callable that gets the keys of the pending getters
+                         before all items get evaluated (e.g. to evaluate them concurrently).
+        """
+        self._getters = dict(getters or {})
+        self._values = dict(values or {})
+        self._prefetch = prefetch
+        for key in self._values:
+            self._getters.pop(key, None)
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+
+        value = self._getters[key]()
+        self._values[key] = value
+        del self._getters[key]
+        return value
+
+    def __setitem__(self, key, value):
+        self._getters.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._values:
+            del self._values[key]
+        else:
+            del self._getters[key]
+
+    def __contains__(self, key):
+        return key in self._values or key in self._getters
+
+    def __iter__(self):
+        yield from list(self._values)
+        yield from list(self._getters)
+
+    def __len__(self):
+        return len(self._values) + len(self._getters)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, dict(self.items()))
+
+    def items(self):
+        self._prefetch_pending()
+        return super().items()
+
+    def values(self):
+        self._prefetch_pending()
+        return super().values()
+
+    def _prefetch_pending(self):
+        if self._prefetch and self._getters:
+            self._prefetch(list(self._getters))
+
+    def copy(self):
+        return LazyDictionary(getters=self._getters, values=self._values, prefetch=self._prefetch)
+
+    def is_evaluated(self, key):
+        return key in self._values
@@ -19,18 +19,56 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+import copy
+import json
+import time
+import queue
+import functools
+import threading
 import subprocess
 import yaml
 import logging
 import hashlib
+from collections import OrderedDict
 from packaging.version import Version
 from edi.lib.helpers import FatalError
 from edi.lib.versionhelpers import get_stripped_version
-from edi.lib.shellhelpers import run, Executables, require
+from edi.lib.shellhelpers import (run, run_async, run_bounded, run_concurrently, popen, terminate, Executables,
+                                  require)
+from edi.lib.lxdapi import LxdApi, LxdApiError, quote_name
 
 
 lxd_install_hint = "'sudo apt install lxd' or 'sudo snap install lxd'"
 
+# seconds between two checks of the state of a container (lxd events do not cover all state changes)
+_state_poll_interval = 1
+# seconds between two checks of the state of a stopping container if the lifecycle events are available
+_stop_check_interval = 10
+# seconds between two checks of the state of a container that waits for its network address
+_network_check_interval = 10
+
+# Blocks until the container got a global address (exit code 0). The address does not trigger a lxd event,
+# therefore the netlink events get followed within the container. Exit code 2: the tools are not available.
+_network_wait_script = '''
+command -v ip > /dev/null && command -v mkfifo > /dev/null || exit 2
+fifo="$(mktemp -u)" && mkfifo -m 600 "$fifo" || exit 2
+ip -o monitor address > "$fifo" &
+monitor=$!
+exec 3< "$fifo"
+rm -f "$fifo"
+result=1
+while true; do
+    if ip -o address show scope global | grep -q .; then
+        result=0
+        break
+    fi
+    read -r event <&3 || break
+done
+kill $monitor 2> /dev/null
+exit $result
+'''
+
 
 def lxc_exec():
     return Executables.get('lxc')
@@ -73,14 +111,284 @@ class LxdVersion:
             LxdVersion._check_done = True
 
 
+class LxcQueryCache:
+    """
+    Caches the results of read-only lxc queries during an edi invocation.
+    The helpers that modify the state of lxd invalidate the cache.
+    Hint: Modifications might run in a background thread (see delete_container_in_background).
+    """
+    _results = dict()
+    _generation = 0
+    _lock = threading.Lock()
+
+    def __init__(self, clear_cache=False):
+        if clear_cache:
+            LxcQueryCache.invalidate()
+
+    @staticmethod
+    def invalidate():
+        with LxcQueryCache._lock:
+            LxcQueryCache._results = dict()
+            LxcQueryCache._generation += 1
+
+    @staticmethod
+    def get(key, factory):
+        """
+        Get a cached result.
+        :param key: The key of the result.
+        :param factory: Computes the result upon a cache miss.
+        :return: The cached result (the caller must not modify it).
+        """
+        with LxcQueryCache._lock:
+            if key in LxcQueryCache._results:
+                return LxcQueryCache._results[key]
+            generation = LxcQueryCache._generation
+
+        # do not block other threads while talking to lxd
+        result = factory()
+
+        with LxcQueryCache._lock:
+            # a result that overlaps with a modification might already be stale
+            if LxcQueryCache._generation == generation:
+                LxcQueryCache._results[key] = result
+        return result
+
+    @staticmethod
+    def query(func):
+        """
+        Decorator for a read-only lxc query.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return copy.deepcopy(LxcQueryCache.get(key, lambda: func(*args, **kwargs)))
+        return wrapper
+
+    @staticmethod
+    def modification(func):
+        """
+        Decorator for a helper that modifies the state of lxd.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                LxcQueryCache.invalidate()
+        return wrapper
+
+
+class LxdInventory:
+    """
+    A snapshot of the containers and images of lxd.
+    """
+
+    def __init__(self, containers, images):
+        """
+        :param containers: The containers as reported by 'lxc list --format=json'.
+        :param images: The images as reported by 'lxc image list --format=json'.
+        """
+        self._containers = {container.get('name'): container for container in containers or []}
+        self._fingerprints = [image.get('fingerprint') for image in images or []]
+        self._aliases = {alias.get('name'): image.get('fingerprint')
+                         for image in images or [] for alias in image.get('aliases') or []}
+
+    def has_container(self, name):
+        return name in self._containers
+
+    def get_container_status(self, name):
+        """
+        :return: The status of the container (e.g. 'Running') or None if the container does not exist.
+        """
+        return self._containers.get(name, {}).get('status')
+
+    def get_container_profiles(self, name):
+        if name not in self._containers:
+            raise FatalError("The container '{}' does not exist.".format(name))
+        return list(self._containers[name].get('profiles') or [])
+
+    def get_container_config(self, name):
+        if name not in self._containers:
+            raise FatalError("The container '{}' does not exist.".format(name))
+        return dict(self._containers[name].get('config') or {})
+
+    def has_network_device(self, name):
+        if name not in self._containers:
+            raise FatalError("The container '{}' does not exist.".format(name))
+        devices = self._containers[name].get('expanded_devices') or self._containers[name].get('devices') or {}
+        return any(device.get('type') == 'nic' for device in devices.values())
+
+    def find_containers(self, key, value):
+        """
+        Find the containers with a given configuration item.
+        :return: The names of the matching containers, stopped containers first.
+        """
+        matches = [name for name, container in sorted(self._containers.items())
+                   if (container.get('config') or {}).get(key) == value]
+        return sorted(matches, key=lambda name: self.get_container_status(name) != 'Stopped')
+
+    def get_image_fingerprint(self, name):
+        """
+        Resolve an image alias or a (unique prefix of a) fingerprint.
+        :return: The fingerprint of the image or None if there is no such image.
+        """
+        if name in self._aliases:
+            return self._aliases[name]
+
+        matches = [fingerprint for fingerprint in self._fingerprints if fingerprint.startswith(name)]
+        if len(matches) == 1:
+            return matches[0]
+        else:
+            return None
+
+
+class LxdEventMonitor:
+    """
+    Follows the lifecycle events of lxd (events API or 'lxc monitor --type=lifecycle').
+    If the events are not available, waiting for an event degrades to sleeping.
+    """
+
+    def __init__(self):
+        self._process = None
+        self._stream = None
+        self._thread = None
+        self._events = queue.Queue()
+
+    def __enter__(self):
+        lxd = LxdApi.get()
+        try:
+            if lxd:
+                self._stream = lxd.get_events(['lifecycle'])
+                self._thread = threading.Thread(target=self._read_messages, daemon=True)
+            else:
+                cmd = [lxc_exec(), "monitor", "--type=lifecycle"]
+                self._process = popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                      universal_newlines=True)
+                self._thread = threading.Thread(target=self._read_events, daemon=True)
+        except (OSError, LxdApiError) as error:
+            logging.debug("Unable to monitor the lxd events ({}).".format(error))
+            return self
+
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._stream:
+            self._stream.close()
+            self._thread.join()
+        if self._process:
+            terminate(self._process)
+            self._thread.join()
+            self._process.stdout.close()
+
+    def _read_messages(self):
+        for message in self._stream.messages():
+            self._add_event(message, json.loads, ValueError)
+
+    def _read_events(self):
+        # the events are either json lines or yaml documents that are separated by empty lines
+        document = []
+        for line in self._process.stdout:
+            if line.startswith('{'):
+                self._add_event(line, json.loads, ValueError)
+            elif line.strip():
+                document.append(line)
+            elif document:
+                self._add_event(''.join(document), yaml.safe_load, yaml.YAMLError)
+                document = []
+
+        if document:
+            self._add_event(''.join(document), yaml.safe_load, yaml.YAMLError)
+
+    def _add_event(self, text, parse, parse_error):
+        try:
+            event = parse(text)
+        except parse_error:
+            logging.debug("Ignoring unparsable lxd event:\n{}".format(text))
+            return
+
+        if isinstance(event, dict):
+            self._events.put(event)
+
+    def is_monitoring(self):
+        """
+        :return: True if the lifecycle events are available.
+        """
+        return self._thread is not None
+
+    def wait(self, predicate, timeout):
+        """
+        Wait for an event.
+        :param predicate: Selects the event of interest.
+        :param timeout: The maximum waiting time in seconds.
+        :return: True if the event of interest occurred within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            if self._thread is None:
+                time.sleep(remaining)
+                return False
+
+            try:
+                event = self._events.get(timeout=remaining)
+            except queue.Empty:
+                return False
+
+            if predicate(event):
+                return True
+
+
+def is_lifecycle_event(event, name, actions):
+    """
+    Check if the event is one of the given lifecycle actions (e.g. 'stopped') of a container.
+    """
+    metadata = event.get('metadata') or {}
+    action = metadata.get('action') or ''
+    source = (metadata.get('source') or '').split('?')[0]
+    # lxd 3 reports 'container-<action>', newer versions report 'instance-<action>'
+    return (action.split('-', 1)[-1] in actions and
+            source in ('/1.0/containers/{}'.format(name), '/1.0/instances/{}'.format(name)))
+
+
+def _run_json_query(cmd):
+    result = run(cmd, stdout=subprocess.PIPE)
+    try:
+        return yaml.safe_load(result.stdout)
+    except yaml.YAMLError as exc:
+        raise FatalError("Unable to parse lxc output ({}).".format(exc))
+
+
+def _query_inventory():
+    lxd = LxdApi.get()
+    if lxd:
+        containers = lxd.get('/1.0/containers?recursion=1')
+        images = lxd.get('/1.0/images?recursion=1')
+    else:
+        containers = _run_json_query([lxc_exec(), "list", "--format=json"])
+        images = _run_json_query([lxc_exec(), "image", "list", "--format=json"])
+    return LxdInventory(containers, images)
+
+
 @require('lxc', lxd_install_hint, LxdVersion.check)
+def get_inventory():
+    """
+    Get a snapshot of the containers and images of lxd.
+    The snapshot gets taken again after a modification of the lxd state.
+    :return: A LxdInventory.
+    """
+    return LxcQueryCache.get(('inventory',), _query_inventory)
+
+
 def is_in_image_store(name):
-    cmd = [lxc_exec(), "image", "show", "local:{}".format(name)]
-    result = run(cmd, check=False, stderr=subprocess.PIPE)
-    return result.returncode == 0
+    return get_inventory().get_image_fingerprint(name) is not None
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
 def import_image(image, image_name):
     cmd = [lxc_exec(), "image", "import", image, "local:", "--alias", image_name]
     run(cmd)
@@ -93,45 +401,47 @@ def export_image(image_name, image_without_extension):
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
-def publish_container(container_name, image_name):
-    cmd = [lxc_exec(), "publish", container_name, "--alias", image_name]
+@LxcQueryCache.modification
+def publish_container(container_name, image_name, snapshot=None):
+    """
+    Publish a container or one of its snapshots within the image store.
+    Hint: A snapshot can get published while the container is running.
+    """
+    source = container_name if snapshot is None else "{}/{}".format(container_name, snapshot)
+    cmd = [lxc_exec(), "publish", source, "--alias", image_name]
     run(cmd)
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
 def delete_image(name):
+    lxd = LxdApi.get()
+    if lxd:
+        fingerprint = get_inventory().get_image_fingerprint(name)
+        if fingerprint is None:
+            raise FatalError("The image '{}' does not exist.".format(name))
+        lxd.request('DELETE', '/1.0/images/{}'.format(quote_name(fingerprint)))
+        return
+
     cmd = [lxc_exec(), "image", "delete", "local:{}".format(name)]
     run(cmd)
 
 
-@require('lxc', lxd_install_hint, LxdVersion.check)
 def is_container_existing(name):
-    cmd = [lxc_exec(), "info", name]
-    result = run(cmd, check=False, stderr=subprocess.PIPE)
-    return result.returncode == 0
+    return get_inventory().has_container(name)
 
 
-@require('lxc', lxd_install_hint, LxdVersion.check)
 def is_container_running(name):
-    cmd = [lxc_exec(), "list", "--format=json", "^{}$".format(name)]
-    result = run(cmd, stdout=subprocess.PIPE)
-
-    try:
-        parsed_result = yaml.safe_load(result.stdout)
-        if len(parsed_result) != 1:
-            return False
-        else:
-            status = parsed_result[0].get("status", "")
-            if status == "Running":
-                return True
-            else:
-                return False
-    except yaml.YAMLError as exc:
-        raise FatalError("Unable to parse lxc output ({}).".format(exc))
+    return get_inventory().get_container_status(name) == "Running"
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.query
 def is_bridge_available(bridge_name):
+    lxd = LxdApi.get()
+    if lxd:
+        return lxd.exists('/1.0/networks/{}'.format(quote_name(bridge_name)))
+
     cmd = [lxc_exec(), "network", "list", "--format=json"]
     result = run(cmd, stdout=subprocess.PIPE)
 
@@ -147,13 +457,43 @@ def is_bridge_available(bridge_name):
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
 def create_bridge(bridge_name):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('POST', '/1.0/networks', {'name': bridge_name, 'config': {}})
+        return
+
     cmd = [lxc_exec(), "network", "create", bridge_name]
     run(cmd)
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def delete_bridge(bridge_name):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('DELETE', '/1.0/networks/{}'.format(quote_name(bridge_name)))
+        return
+
+    cmd = [lxc_exec(), "network", "delete", bridge_name]
+    run(cmd)
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
 def launch_container(image, name, profiles):
+    lxd = LxdApi.get()
+    if lxd:
+        try:
+            lxd.request('POST', '/1.0/containers', {'name': name, 'profiles': list(profiles),
+                                                    'source': {'type': 'image', 'alias': image}})
+            lxd.request('PUT', '/1.0/containers/{}/state'.format(quote_name(name)), {'action': 'start'})
+        except LxdApiError as error:
+            raise FatalError(('''Launching image '{}' failed with the following message:\n{}'''
+                              ).format(image, error.message))
+        return
+
     cmd = [lxc_exec(), "launch", "local:{}".format(image), name]
     for profile in profiles:
         cmd.extend(["-p", profile])
@@ -164,49 +504,390 @@ def launch_container(image, name, profiles):
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def copy_container(source, name):
+    """
+    Copy a container without its snapshots (a cheap copy on write clone if the storage pool supports it).
+    The new container does not get started.
+    """
+    lxd = LxdApi.get()
+    if lxd:
+        # like 'lxc copy' take over the configuration of the source container
+        container = lxd.get('/1.0/containers/{}'.format(quote_name(source)))
+        config = {key: value for key, value in (container.get('config') or {}).items()
+                  if not key.startswith('volatile.')}
+        try:
+            lxd.request('POST', '/1.0/containers', {'name': name, 'architecture': container.get('architecture'),
+                                                    'config': config, 'devices': container.get('devices') or {},
+                                                    'profiles': container.get('profiles') or [],
+                                                    'ephemeral': container.get('ephemeral', False),
+                                                    'source': {'type': 'copy', 'source': source,
+                                                               'instance_only': True, 'container_only': True}})
+        except LxdApiError as error:
+            raise FatalError(('''Copying container '{}' failed with the following message:\n{}'''
+                              ).format(source, error.message))
+        return
+
+    # lxd 3.19 renamed --container-only to --instance-only
+    if Version(get_stripped_version(get_lxd_version())) >= Version('3.19'):
+        cmd = [lxc_exec(), "copy", source, name, "--instance-only"]
+    else:
+        cmd = [lxc_exec(), "copy", source, name, "--container-only"]
+    result = run(cmd, check=False, stderr=subprocess.PIPE, log_threshold=logging.INFO)
+    if result.returncode != 0:
+        raise FatalError(('''Copying container '{}' failed with the following message:\n{}'''
+                          ).format(source, result.stderr))
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
 def start_container(name):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('PUT', '/1.0/containers/{}/state'.format(quote_name(name)), {'action': 'start'})
+        return
+
     cmd = [lxc_exec(), "start", name]
 
     run(cmd, log_threshold=logging.INFO)
 
 
+def get_container_state(name):
+    """
+    Get the runtime state (status, processes, network, ...) of a container.
+    Hint: The state is volatile and therefore not cached.
+    """
+    path = '/1.0/containers/{}/state'.format(quote_name(name))
+    lxd = LxdApi.get()
+    if lxd:
+        return lxd.get(path) or {}
+    else:
+        return _run_json_query([lxc_exec(), "query", path]) or {}
+
+
+def get_container_addresses(state):
+    """
+    :param state: The state of a container.
+    :return: The global addresses of the container (except the ones of the loopback interface).
+    """
+    return [address.get('address') for interface, network in sorted((state.get('network') or {}).items())
+            if interface != 'lo'
+            for address in network.get('addresses') or []
+            if address.get('family') in ('inet', 'inet6') and address.get('scope') == 'global']
+
+
+def _wait_for_address_within_container(name, timeout):
+    """
+    Wait within the container until it got a global network address.
+    :return: The exit code of the wait (0: address available, 124: timeout) or None.
+    """
+    cmd = ["timeout", "{:.1f}".format(max(timeout, 0.1)), "sh", "-c", _network_wait_script]
+    lxd = LxdApi.get()
+    if lxd:
+        try:
+            operation = lxd.request('POST', '/1.0/containers/{}/exec'.format(quote_name(name)),
+                                    {'command': cmd, 'environment': {}, 'interactive': False,
+                                     'wait-for-websocket': False, 'record-output': False})
+        except LxdApiError as error:
+            logging.debug("Unable to wait within container {} ({}).".format(name, error))
+            return None
+        return ((operation or {}).get('metadata') or {}).get('return')
+
+    cmd = [lxc_exec(), "exec", name, "--"] + cmd
+    return run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode
+
+
 @require('lxc', lxd_install_hint, LxdVersion.check)
-def stop_container(name, timeout=120):
-    cmd = [lxc_exec(), "stop", name]
+def wait_for_container_network(name, timeout=60):
+    """
+    Wait until a running container got a network address.
+    Containers without a network device do not get waited for.
+    The address changes get followed within the container. If this is not possible (e.g. there is no 'ip'
+    tool within the container), the state of the container gets polled.
+    :param name: The name of the container.
+    :param timeout: The maximum waiting time in seconds.
+    :return: The first global address of the container or None.
+    """
+    if not get_inventory().has_network_device(name):
+        return None
+
+    deadline = time.monotonic() + timeout
+    wait_within_container = True
+    with LxdEventMonitor() as monitor:
+        while True:
+            state = get_container_state(name)
+            if state.get('status') != 'Running':
+                raise FatalError("The container '{}' stopped unexpectedly.".format(name))
+
+            addresses = get_container_addresses(state)
+            if addresses:
+                return addresses[0]
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.warning("Timeout ({} seconds) expired while waiting for the network of container {}."
+                                .format(timeout, name))
+                return None
+
+            if wait_within_container:
+                returncode = _wait_for_address_within_container(name, min(_network_check_interval, remaining))
+                # keep on waiting within the container only if its timeout expired (124), fall back to polling
+                # if the tools are missing or if lxd does not yet see the reported address (no busy loop)
+                wait_within_container = returncode == 124
+            else:
+                # wake up early if the container stops
+                monitor.wait(lambda event: is_lifecycle_event(event, name, ('stopped',)),
+                             timeout=min(_state_poll_interval, remaining))
 
-    try:
-        run(cmd, log_threshold=logging.INFO, timeout=timeout)
-    except subprocess.TimeoutExpired:
-        logging.warning(("Timeout ({} seconds) expired while stopping container {}.\n"
-                         "Forcing container shutdown!").format(timeout, name))
-        cmd = [lxc_exec(), "stop", "-f", name]
-        run(cmd, log_threshold=logging.INFO)
+
+def _request_graceful_stop(name, timeout):
+    """
+    Ask the container to shut down without waiting for it.
+    :return: A thread that needs to be joined or None.
+    """
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('PUT', '/1.0/containers/{}/state'.format(quote_name(name)),
+                    {'action': 'stop', 'timeout': timeout}, wait=False)
+        return None
+
+    cmd = [lxc_exec(), "stop", name, "--timeout", str(timeout)]
+    thread = threading.Thread(target=run, args=(cmd,),
+                              kwargs={'check': False, 'stderr': subprocess.PIPE, 'log_threshold': logging.INFO},
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_for_stop(monitor, name, timeout, hang_timeout):
+    """
+    Wait until the container stopped. The stop gets detected by means of the lifecycle events,
+    the state of the container only gets checked as a fallback and to track the progress of the shutdown.
+    A shutdown where the number of processes does not change for hang_timeout seconds is considered as hung.
+    :return: True if the container stopped, False if the shutdown timed out or hung.
+    """
+    check_interval = _stop_check_interval if monitor.is_monitoring() else _state_poll_interval
+    if hang_timeout is not None:
+        check_interval = min(check_interval, hang_timeout / 2)
+
+    deadline = time.monotonic() + timeout
+    processes = None
+    last_progress = time.monotonic()
+    while True:
+        state = get_container_state(name)
+        if state.get('status') != 'Running':
+            return True
+
+        now = time.monotonic()
+        if hang_timeout is not None:
+            if state.get('processes') != processes:
+                processes = state.get('processes')
+                last_progress = now
+            elif now - last_progress >= hang_timeout:
+                logging.warning(("The shutdown of container {} does not make any progress.\n"
+                                 "Forcing container shutdown!").format(name))
+                return False
+
+        if now >= deadline:
+            logging.warning(("Timeout ({} seconds) expired while stopping container {}.\n"
+                             "Forcing container shutdown!").format(timeout, name))
+            return False
+
+        if monitor.wait(lambda event: is_lifecycle_event(event, name, ('stopped',)),
+                        timeout=min(check_interval, deadline - now)):
+            return True
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def stop_container(name, timeout=120, hang_timeout=None):
+    """
+    Stop a container gracefully and force the stop if the shutdown times out or hangs.
+    :param name: The name of the container.
+    :param timeout: The maximum time in seconds for a graceful shutdown.
+    :param hang_timeout: The time in seconds after which a shutdown without any progress is considered as hung.
+                         None disables the hang detection.
+    """
+    with LxdEventMonitor() as monitor:
+        graceful_stop = _request_graceful_stop(name, timeout)
+        stopped = _wait_for_stop(monitor, name, timeout, hang_timeout)
+
+    if not stopped:
+        lxd = LxdApi.get()
+        if lxd:
+            lxd.request('PUT', '/1.0/containers/{}/state'.format(quote_name(name)), {'action': 'stop', 'force': True})
+        else:
+            cmd = [lxc_exec(), "stop", "-f", name]
+            run(cmd, log_threshold=logging.INFO)
+
+    if graceful_stop:
+        graceful_stop.join()
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
 def delete_container(name):
     # needs to be stopped first!
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('DELETE', '/1.0/containers/{}'.format(quote_name(name)))
+        return
+
     cmd = [lxc_exec(), "delete", name]
 
     run(cmd, log_threshold=logging.INFO)
 
 
+@LxcQueryCache.modification
+def _force_delete_container(name):
+    lxd = LxdApi.get()
+    if lxd:
+        path = '/1.0/containers/{}'.format(quote_name(name))
+        try:
+            if get_container_state(name).get('status') == 'Running':
+                lxd.request('PUT', '{}/state'.format(path), {'action': 'stop', 'force': True})
+            lxd.request('DELETE', path)
+        except LxdApiError as error:
+            logging.warning("Deleting container '{}' failed with the following message:\n{}"
+                            .format(name, error.message))
+        return
+
+    cmd = [lxc_exec(), "delete", "--force", name]
+    result = run(cmd, check=False, stderr=subprocess.PIPE, log_threshold=logging.INFO)
+    if result.returncode != 0:
+        logging.warning("Deleting container '{}' failed with the following message:\n{}"
+                        .format(name, result.stderr))
+
+
 @require('lxc', lxd_install_hint, LxdVersion.check)
+def delete_container_in_background(name):
+    """
+    Force the deletion of a container (even if it is running) without waiting for it.
+    The interpreter waits for the deletion before it exits.
+    :param name: The name of the container.
+    :return: The thread that deletes the container.
+    """
+    thread = threading.Thread(target=_force_delete_container, args=(name,))
+    thread.start()
+    return thread
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
 def apply_profiles(name, profiles):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('PATCH', '/1.0/containers/{}'.format(quote_name(name)), {'profiles': list(profiles)})
+        return
+
     cmd = [lxc_exec(), 'profile', 'apply', name, ','.join(profiles)]
     run(cmd)
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
-def is_profile_existing(name):
-    cmd = [lxc_exec(), "profile", "show", name]
-    result = run(cmd, check=False, stderr=subprocess.PIPE)
-    return result.returncode == 0
+@LxcQueryCache.query
+def get_container_snapshots(name):
+    """
+    Get the snapshots of a container.
+    :param name: The name of the container.
+    :return: The names of the snapshots ordered by their creation time (oldest first).
+    """
+    path = '/1.0/containers/{}/snapshots?recursion=1'.format(quote_name(name))
+    lxd = LxdApi.get()
+    if lxd:
+        snapshots = lxd.get(path)
+    else:
+        snapshots = _run_json_query([lxc_exec(), "query", path])
+
+    # depending on the lxd version the name is either "snapshot" or "container/snapshot"
+    return [snapshot.get('name').split('/')[-1]
+            for snapshot in sorted(snapshots or [], key=lambda snapshot: snapshot.get('created_at') or '')]
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
-def write_lxc_profile(profile_text):
-    new_profile = False
+def sync_container(name):
+    """
+    Flush the file system buffers of a running container (e.g. prior to a snapshot).
+    """
+    lxd = LxdApi.get()
+    if lxd:
+        operation = lxd.request('POST', '/1.0/containers/{}/exec'.format(quote_name(name)),
+                                {'command': ['sync'], 'environment': {}, 'interactive': False,
+                                 'wait-for-websocket': False, 'record-output': False})
+        if ((operation or {}).get('metadata') or {}).get('return', 0) != 0:
+            raise FatalError("Syncing the file system of container '{}' failed.".format(name))
+        return
+
+    cmd = [lxc_exec(), "exec", name, "--", "sync"]
+    run(cmd, log_threshold=logging.INFO)
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def create_container_snapshot(name, snapshot):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('POST', '/1.0/containers/{}/snapshots'.format(quote_name(name)),
+                    {'name': snapshot, 'stateful': False})
+        return
+
+    cmd = [lxc_exec(), "snapshot", name, snapshot]
+    run(cmd, log_threshold=logging.INFO)
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def restore_container_snapshot(name, snapshot):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('PUT', '/1.0/containers/{}'.format(quote_name(name)), {'restore': snapshot})
+        return
+
+    cmd = [lxc_exec(), "restore", name, snapshot]
+    run(cmd, log_threshold=logging.INFO)
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def delete_container_snapshot(name, snapshot):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('DELETE', '/1.0/containers/{}/snapshots/{}'.format(quote_name(name), quote_name(snapshot)))
+        return
+
+    cmd = [lxc_exec(), "delete", "{}/{}".format(name, snapshot)]
+    run(cmd, log_threshold=logging.INFO)
+
+
+def find_containers(key, value):
+    return get_inventory().find_containers(key, value)
+
+
+def get_container_config_item(name, key):
+    """
+    Get a configuration item (e.g. 'user.edi.foo') of a container.
+    :return: The value of the configuration item or None if it is not set.
+    """
+    return get_inventory().get_container_config(name).get(key)
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def set_container_config_item(name, key, value):
+    lxd = LxdApi.get()
+    if lxd:
+        lxd.request('PATCH', '/1.0/containers/{}'.format(quote_name(name)), {'config': {key: value}})
+        return
+
+    cmd = [lxc_exec(), "config", "set", name, key, value]
+    run(cmd)
+
+
+def is_profile_existing(name):
+    return name in get_lxc_profiles()
+
+
+def _get_hashed_profile(profile_text):
     profile_yaml = yaml.safe_load(profile_text)
     profile_hash = hashlib.sha256(profile_text.encode()
                                   ).hexdigest()[:20]
@@ -214,24 +895,111 @@ def write_lxc_profile(profile_text):
     ext_profile_name = "{}_{}".format(profile_name,
                                       profile_hash)
     profile_yaml["name"] = ext_profile_name
-    profile_content = yaml.dump(profile_yaml,
-                                default_flow_style=False)
+    return ext_profile_name, profile_yaml
 
-    if not is_profile_existing(ext_profile_name):
-        create_cmd = [lxc_exec(), "profile", "create", ext_profile_name]
-        run(create_cmd)
-        new_profile = True
 
-    edit_cmd = [lxc_exec(), "profile", "edit", ext_profile_name]
-    run(edit_cmd, input=profile_content)
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.query
+def get_lxc_profiles():
+    """
+    Get the existing profiles.
+    :return: A dictionary that maps the profile names to the containers that use the profile.
+    """
+    lxd = LxdApi.get()
+    if lxd:
+        profiles = lxd.get('/1.0/profiles?recursion=1')
+    else:
+        profiles = _run_json_query([lxc_exec(), "query", "/1.0/profiles?recursion=1"])
 
-    return ext_profile_name, new_profile
+    return {profile.get('name'): list(profile.get('used_by') or []) for profile in profiles or []}
+
+
+def _create_lxc_profiles(profiles, limit):
+    lxd = LxdApi.get()
+    if lxd:
+        for profile_yaml in profiles:
+            lxd.request('POST', '/1.0/profiles', profile_yaml)
+        return
+
+    async def create_profile(profile_yaml):
+        name = profile_yaml["name"]
+        await run_async([lxc_exec(), "profile", "create", name])
+        await run_async([lxc_exec(), "profile", "edit", name],
+                        input=yaml.dump(profile_yaml, default_flow_style=False))
+
+    run_bounded([create_profile(profile_yaml) for profile_yaml in profiles], limit=limit)
 
 
 @require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def remove_unused_lxc_profiles(keep=(), limit=4):
+    """
+    Remove the profiles that got created by edi (named <name>_<hash>) and that are not used by any container.
+    :param keep: Profiles that shall be kept even if they are unused.
+    :param limit: The maximum number of profiles that get removed concurrently.
+    :return: The names of the removed profiles.
+    """
+    unused_profiles = [name for name, used_by in sorted(get_lxc_profiles().items())
+                       if not used_by and name not in keep and re.match(r'^.+_[0-9a-f]{20}$', name)]
+
+    lxd = LxdApi.get()
+    if lxd:
+        for name in unused_profiles:
+            lxd.request('DELETE', '/1.0/profiles/{}'.format(quote_name(name)))
+    else:
+        run_concurrently([[lxc_exec(), "profile", "delete", name] for name in unused_profiles], limit=limit)
+
+    return unused_profiles
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.modification
+def reconcile_lxc_profiles(profile_texts, remove_unused=False, limit=4):
+    """
+    Make sure that the given profiles exist.
+    The profile names contain a hash of the profile content, therefore existing profiles are up to date.
+    :param profile_texts: The rendered profiles.
+    :param remove_unused: Also remove the unused profiles that got created by edi.
+    :param limit: The maximum number of profiles that get created concurrently.
+    :return: A list of (profile_name, new_profile) tuples in the order of the given profiles.
+    """
+    profiles = [_get_hashed_profile(profile_text) for profile_text in profile_texts]
+    existing_profiles = get_lxc_profiles()
+
+    missing_profiles = OrderedDict((name, profile_yaml) for name, profile_yaml in profiles
+                                   if name not in existing_profiles)
+    _create_lxc_profiles(list(missing_profiles.values()), limit)
+
+    if remove_unused:
+        LxcQueryCache.invalidate()
+        removed_profiles = remove_unused_lxc_profiles(keep=[name for name, _ in profiles], limit=limit)
+        if removed_profiles:
+            logging.info("Removed unused profiles: {}".format(', '.join(removed_profiles)))
+
+    return [(name, name in missing_profiles) for name, _ in profiles]
+
+
+def get_lxc_profile_name(profile_text):
+    """
+    Get the name under which a rendered profile gets stored.
+    """
+    return _get_hashed_profile(profile_text)[0]
+
+
+def write_lxc_profile(profile_text):
+    return reconcile_lxc_profiles([profile_text])[0]
+
+
+@require('lxc', lxd_install_hint, LxdVersion.check)
+@LxcQueryCache.query
 def get_server_image_compression_algorithm():
-    cmd = [lxc_exec(), 'config', 'get', 'images.compression_algorithm']
-    algorithm = run(cmd, stdout=subprocess.PIPE).stdout.strip('\n')
+    lxd = LxdApi.get()
+    if lxd:
+        algorithm = (lxd.get('/1.0').get('config') or {}).get('images.compression_algorithm')
+    else:
+        cmd = [lxc_exec(), 'config', 'get', 'images.compression_algorithm']
+        algorithm = run(cmd, stdout=subprocess.PIPE).stdout.strip('\n')
+
     if not algorithm:
         return 'gzip'
     else:
@@ -255,23 +1023,21 @@ def get_file_extension_from_image_compression_algorithm(algorithm):
     return extension
 
 
-@require('lxc', lxd_install_hint, LxdVersion.check)
 def get_container_profiles(name):
-    cmd = [lxc_exec(), 'config', 'show', name]
-    result = run(cmd, stdout=subprocess.PIPE)
-    return yaml.safe_load(result.stdout).get('profiles', [])
+    return get_inventory().get_container_profiles(name)
 
 
-def try_delete_container(container_name, timeout):
+def try_delete_container(container_name, timeout, hang_timeout=None):
     """
     Try to delete a container.
     :param container_name: The name of the container.
     :param timeout: Stop timeout in seconds.
+    :param hang_timeout: Stop hang timeout in seconds (see stop_container).
     :return: True if container got deleted, False if container does not exist.
     """
     if is_container_existing(container_name):
         if is_container_running(container_name):
-            stop_container(container_name, timeout=timeout)
+            stop_container(container_name, timeout=timeout, hang_timeout=hang_timeout)
 
         delete_container(container_name)
         return True
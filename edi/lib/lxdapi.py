@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import base64
+import socket
+import struct
+import hashlib
+import logging
+import threading
+import http.client
+from urllib.parse import quote
+from edi.lib.helpers import FatalError
+
+
+class LxdApiError(FatalError):
+    """
+    Exception raised if the LXD REST API reports an error.
+
+    Attributes:
+        status_code -- the http status code (e.g. 404)
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    A http connection over a unix socket.
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('lxd', timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class LxdEventStream:
+    """
+    Receives the events of lxd over a websocket (e.g. '/1.0/events?type=lifecycle').
+    Only the minimal subset of RFC 6455 that is needed to read text messages is implemented.
+    """
+    _websocket_guid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+    _opcode_continuation = 0x0
+    _opcode_close = 0x8
+    _opcode_ping = 0x9
+    _opcode_pong = 0xA
+
+    def __init__(self, socket_path, path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(socket_path)
+            self._file = self._socket.makefile('rb')
+            self._handshake(path)
+        except (OSError, LxdApiError):
+            self._socket.close()
+            raise
+
+    def _handshake(self, path):
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = ('GET {} HTTP/1.1\r\n'
+                   'Host: lxd\r\n'
+                   'Upgrade: websocket\r\n'
+                   'Connection: Upgrade\r\n'
+                   'Sec-WebSocket-Key: {}\r\n'
+                   'Sec-WebSocket-Version: 13\r\n\r\n').format(path, key)
+        self._socket.sendall(request.encode())
+
+        status_line = self._file.readline().decode(errors='replace')
+        headers = dict()
+        while True:
+            line = self._file.readline().decode(errors='replace')
+            if not line.strip():
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1((key + LxdEventStream._websocket_guid).encode()).digest()).decode()
+        if status_line.split()[1:2] != ['101'] or headers.get('sec-websocket-accept') != accept:
+            raise LxdApiError('Unable to follow the LXD events {} ({}).'.format(path, status_line.strip()))
+
+    def _read_exactly(self, length):
+        data = self._file.read(length)
+        if len(data) != length:
+            raise EOFError()
+        return data
+
+    def _read_frame(self):
+        first, second = self._read_exactly(2)
+        length = second & 0x7f
+        if length == 126:
+            length = struct.unpack('!H', self._read_exactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._read_exactly(8))[0]
+        mask = self._read_exactly(4) if second & 0x80 else None
+        payload = self._read_exactly(length)
+        if mask:
+            payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+        return bool(first & 0x80), first & 0x0f, payload
+
+    def _send_frame(self, opcode, payload):
+        # the frames of a client need to be masked
+        mask = os.urandom(4)
+        masked_payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+        self._socket.sendall(struct.pack('!BB', 0x80 | opcode, 0x80 | len(payload)) + mask + masked_payload)
+
+    def messages(self):
+        """
+        Read the messages until the stream gets closed.
+        :return: A generator that yields the messages as text.
+        """
+        fragments = []
+        try:
+            while True:
+                final, opcode, payload = self._read_frame()
+                if opcode == LxdEventStream._opcode_close:
+                    return
+                elif opcode == LxdEventStream._opcode_ping:
+                    self._send_frame(LxdEventStream._opcode_pong, payload[:125])
+                elif opcode == LxdEventStream._opcode_pong:
+                    continue
+                else:
+                    if opcode != LxdEventStream._opcode_continuation:
+                        fragments = []
+                    fragments.append(payload)
+                    if final:
+                        yield b''.join(fragments).decode(errors='replace')
+                        fragments = []
+        except (OSError, EOFError, ValueError):
+            # ValueError: the stream got closed by another thread
+            return
+        finally:
+            self._file.close()
+
+    def close(self):
+        """
+        Close the stream. A thread that is reading the messages will return.
+        """
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+
+def quote_name(name):
+    return quote(name, safe='')
+
+
+class LxdApiClient:
+    """
+    A minimal client for the LXD REST API that keeps its connection alive across requests.
+    """
+    _timeout = 300
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _request(self, method, path, body):
+        headers = {'Accept': 'application/json'}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        with self._lock:
+            while True:
+                reused_connection = self._connection is not None
+                if not reused_connection:
+                    self._connection = _UnixHTTPConnection(self.socket_path, timeout=LxdApiClient._timeout)
+                try:
+                    self._connection.request(method, path, body=data, headers=headers)
+                    response = self._connection.getresponse()
+                    content = response.read()
+                    break
+                except (http.client.HTTPException, OSError) as error:
+                    self._connection.close()
+                    self._connection = None
+                    if not (reused_connection and isinstance(error, (http.client.RemoteDisconnected,
+                                                                     ConnectionError))):
+                        raise LxdApiError('Unable to talk to LXD ({}): {}'.format(self.socket_path, error))
+                    # the server has closed the idle connection, retry with a new one
+
+        try:
+            return response.status, json.loads(content.decode())
+        except ValueError as error:
+            raise LxdApiError('Unable to parse the LXD response to {} {} ({}).'.format(method, path, error),
+                              status_code=response.status)
+
+    def request(self, method, path, body=None, wait=True):
+        """
+        Send a request and wait for the completion of the resulting operation (if any).
+        :param method: The http method (e.g. 'GET').
+        :param path: The path of the resource (e.g. '/1.0/containers/foo').
+        :param body: An optional json serializable body.
+        :param wait: Wait for the completion of the resulting operation.
+        :return: The metadata of the response.
+        """
+        logging.debug('LXD request: {} {}'.format(method, path))
+        status, response = self._request(method, path, body)
+        response_type = response.get('type')
+        if response_type == 'error' or status >= 400:
+            raise LxdApiError('LXD request {} {} failed: {}'.format(method, path, response.get('error', status)),
+                              status_code=response.get('error_code', status))
+        elif response_type == 'async' and wait:
+            return self.wait_for_operation(response.get('operation'))
+        else:
+            return response.get('metadata')
+
+    def wait_for_operation(self, operation, timeout=None):
+        """
+        Wait for the completion of a background operation.
+        :param operation: The path of the operation (e.g. '/1.0/operations/<uuid>').
+        :param timeout: An optional timeout in seconds.
+        :return: The metadata of the completed operation.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            wait_time = 30 if deadline is None else max(1, min(30, int(deadline - time.monotonic())))
+            status, response = self._request('GET', '{}/wait?timeout={}'.format(operation, wait_time), None)
+            if response.get('type') == 'error' or status >= 400:
+                raise LxdApiError('Waiting for LXD operation {} failed: {}'.format(
+                    operation, response.get('error', status)), status_code=response.get('error_code', status))
+
+            metadata = response.get('metadata') or {}
+            if metadata.get('status_code', 0) >= 400:
+                raise LxdApiError('LXD operation {} failed: {}'.format(operation, metadata.get('err', '')),
+                                  status_code=metadata.get('status_code'))
+            if metadata.get('status') == 'Success':
+                return metadata
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LxdApiError('Timeout while waiting for LXD operation {}.'.format(operation))
+
+    def exists(self, path):
+        """
+        Check if a resource exists.
+        :param path: The path of the resource (e.g. '/1.0/profiles/default').
+        """
+        try:
+            self.request('GET', path)
+            return True
+        except LxdApiError as error:
+            if error.status_code == 404:
+                return False
+            raise
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def get_events(self, types):
+        """
+        Follow the events of lxd.
+        :param types: The types of interest (e.g. ['lifecycle']).
+        :return: A LxdEventStream that needs to be closed.
+        """
+        path = '/1.0/events?type={}'.format(','.join(types))
+        logging.debug('LXD events: {}'.format(path))
+        try:
+            return LxdEventStream(self.socket_path, path)
+        except OSError as error:
+            raise LxdApiError('Unable to talk to LXD ({}): {}'.format(self.socket_path, error))
+
+
+class LxdApi:
+    """
+    Provides a client for the LXD REST API if the LXD unix socket is accessible.
+    The environment variable EDI_LXD_BACKEND selects the backend: auto (default), rest or cli.
+    The lxc command line tool serves as fallback.
+    """
+    _client = None
+    _initialized = False
+
+    def __init__(self, clear_cache=False):
+        if clear_cache:
+            if LxdApi._client is not None:
+                LxdApi._client.close()
+            LxdApi._client = None
+            LxdApi._initialized = False
+
+    @staticmethod
+    def get_socket_candidates():
+        candidates = []
+        if os.environ.get('LXD_SOCKET'):
+            candidates.append(os.environ.get('LXD_SOCKET'))
+        if os.environ.get('LXD_DIR'):
+            candidates.append(os.path.join(os.environ.get('LXD_DIR'), 'unix.socket'))
+        candidates.append('/var/snap/lxd/common/lxd/unix.socket')
+        candidates.append('/var/lib/lxd/unix.socket')
+        return candidates
+
+    @staticmethod
+    def get():
+        """
+        Get the REST client.
+        :return: A LxdApiClient or None if the lxc command line tool shall be used.
+        """
+        if not LxdApi._initialized:
+            LxdApi._initialized = True
+            backend = os.environ.get('EDI_LXD_BACKEND', 'auto')
+            if backend not in ['auto', 'rest', 'cli']:
+                raise FatalError("Invalid value '{}' for EDI_LXD_BACKEND (use auto, rest or cli).".format(backend))
+
+            if backend != 'cli':
+                for candidate in LxdApi.get_socket_candidates():
+                    if os.path.exists(candidate) and os.access(candidate, os.R_OK | os.W_OK):
+                        logging.debug("Using the LXD REST API ({}).".format(candidate))
+                        LxdApi._client = LxdApiClient(candidate)
+                        break
+
+                if LxdApi._client is None and backend == 'rest':
+                    raise FatalError("Unable to access the LXD socket (tried {}).".format(
+                        ', '.join(LxdApi.get_socket_candidates())))
+
+        return LxdApi._client
@@ -19,7 +19,13 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import signal
+import asyncio
+import locale
 import subprocess
+from edi.lib.subprocesstrace import SubprocessTrace, run_with_rusage
+from edi.lib.privilegedhelper import is_privileged_command, run_privileged
 
 
 def run_mockable(*popenargs, **kwargs):
@@ -29,4 +35,86 @@ def run_mockable(*popenargs, **kwargs):
     :param kwargs: pass through to subprocess.run
     :return: passes back the result of subprocess.run()
     """
+    if len(popenargs) == 1 and is_privileged_command(popenargs[0], kwargs):
+        # avoid the startup cost of sudo
+        return run_privileged(*popenargs, **kwargs)
+    if SubprocessTrace.is_enabled():
+        # collect the resource usage of the child process for the trace
+        return run_with_rusage(*popenargs, **kwargs)
     return subprocess.run(*popenargs, **kwargs)
+
+
+def popen_mockable(*popenargs, **kwargs):
+    """
+    This pass through method allows to selectively intercept edi.lib.shellhelpers.popen() commands.
+    The command gets started within its own process group.
+    :param popenargs: pass through to subprocess.Popen
+    :param kwargs: pass through to subprocess.Popen
+    :return: passes back the subprocess.Popen object
+    """
+    return subprocess.Popen(*popenargs, start_new_session=True, **kwargs)
+
+
+def terminate_process_group(process, grace_period=5):
+    """
+    Terminate a command that got started using popen_mockable.
+    """
+    # sudo forwards SIGTERM to the command, SIGKILL is the last resort
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+        try:
+            process.wait(grace_period)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+async def run_mockable_async(popenargs, input=None, timeout=None, check=False, universal_newlines=False,
+                             stdout=None, stderr=None, **kwargs):
+    """
+    This pass through method allows to selectively intercept edi.lib.shellhelpers.run_async() commands.
+    It behaves like subprocess.run() but runs the command asynchronously within its own process group.
+    :return: a subprocess.CompletedProcess
+    """
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+        if universal_newlines:
+            input = input.encode(locale.getpreferredencoding(False))
+
+    process = await asyncio.create_subprocess_exec(*popenargs, stdout=stdout, stderr=stderr,
+                                                   start_new_session=True, **kwargs)
+    try:
+        output, error_output = await asyncio.wait_for(process.communicate(input), timeout)
+    except asyncio.TimeoutError:
+        await _kill_process_group(process)
+        raise subprocess.TimeoutExpired(popenargs, timeout)
+    except asyncio.CancelledError:
+        await _kill_process_group(process)
+        raise
+
+    if universal_newlines:
+        encoding = locale.getpreferredencoding(False)
+        output = output.decode(encoding) if output is not None else None
+        error_output = error_output.decode(encoding) if error_output is not None else None
+
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, popenargs, output=output, stderr=error_output)
+
+    return subprocess.CompletedProcess(popenargs, process.returncode, output, error_output)
+
+
+async def _kill_process_group(process, grace_period=5):
+    # sudo forwards SIGTERM to the command, SIGKILL is the last resort
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), grace_period)
+            return
+        except asyncio.TimeoutError:
+            pass
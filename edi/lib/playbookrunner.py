@@ -20,39 +20,76 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
+import json
 import logging
+import hashlib
 import tempfile
 import yaml
+import subprocess
 from codecs import open
 from edi.lib.helpers import chown_to_user
 from edi.lib.helpers import get_user, get_workdir
 from edi.lib.shellhelpers import run, require
 from edi.lib.sharedfoldercoordinator import SharedFolderCoordinator
 from edi.lib.configurationparser import remove_passwords
+from edi.lib.cachehelpers import get_content_hash
+from edi.lib.lxchelpers import (get_container_snapshots, create_container_snapshot, restore_container_snapshot,
+                                delete_container_snapshot, get_container_config_item, set_container_config_item,
+                                get_container_profiles)
 
 
 class PlaybookRunner():
 
-    def __init__(self, config, target, connection):
+    def __init__(self, config, target, connection, force=False):
+        """
+        :param force: Apply all playbooks even if they did not change since the last run.
+        """
         self.config = config
         self.target = target
         self.connection = connection
+        self.force = force
         self.config_section = 'playbooks'
 
+    _snapshot_pattern = r'^edi-[0-9]{2,}-[0-9a-f]{20}$'
+    # diagnostic or volatile extra vars that do not influence the outcome of a playbook
+    _volatile_vars = ('edi_log_level', 'edi_work_directory')
+    # extra vars that are specific to the project checkout
+    # Hint: the user specific vars (e.g. the account, the ssh keys or the shared folders) end up in the container
+    _local_vars = _volatile_vars + ('edi_current_display', 'edi_project_directory', 'edi_project_plugin_directory')
+    _ledger_key = 'user.edi.playbooks'
+    _ledger_file = '.edi/playbooks.json'
+
     def run_all(self):
         workdir = get_workdir()
 
+        playbooks = self._get_playbooks()
+        fingerprints = [self._get_fingerprint(name, path, extra_vars) for name, path, extra_vars in playbooks]
+        snapshots = self._get_snapshot_names(fingerprints)
+        if self.force:
+            first_playbook = 0
+            ledger = {}
+        else:
+            first_playbook = self._restore_snapshot(playbooks, snapshots)
+            ledger = self._read_ledger(playbooks)
+
         applied_playbooks = []
         with tempfile.TemporaryDirectory(dir=workdir) as tempdir:
             chown_to_user(tempdir)
             inventory = self._write_inventory_file(tempdir)
 
-            for name, path, extra_vars, in self._get_playbooks():
-                logging.info(("Running playbook {} located in "
-                              "{} with extra vars:\n{}"
-                              ).format(name, path,
-                                       yaml.dump(remove_passwords(extra_vars),
-                                                 default_flow_style=False)))
+            for index, (name, path, extra_vars) in enumerate(playbooks[first_playbook:], first_playbook):
+                if ledger.get(name) == fingerprints[index]:
+                    logging.info("Skipping playbook {} since it did not change since the last run.".format(name))
+                    self._take_snapshot(snapshots, index)
+                    continue
+
+                if logging.getLogger().isEnabledFor(logging.INFO):
+                    logging.info(("Running playbook {} located in "
+                                  "{} with extra vars:\n{}"
+                                  ).format(name, path,
+                                           yaml.dump(remove_passwords(extra_vars),
+                                                     default_flow_style=False)))
 
                 extra_vars_file = os.path.join(tempdir, ("extra_vars_{}"
                                                          ).format(name))
@@ -63,8 +100,170 @@ class PlaybookRunner():
                 self._run_playbook(path, inventory, extra_vars_file, ansible_user)
                 applied_playbooks.append(name)
 
+                ledger[name] = fingerprints[index]
+                self._write_ledger(ledger, ansible_user)
+                self._take_snapshot(snapshots, index)
+
+        if snapshots:
+            self._prune_snapshots(snapshots)
+
         return applied_playbooks
 
+    def get_fingerprints(self, portable=False):
+        """
+        :param portable: Ignore the extra vars that are specific to the project checkout.
+        :return: The fingerprints of the playbooks in the order of the playbooks.
+        """
+        excluded_vars = PlaybookRunner._local_vars if portable else PlaybookRunner._volatile_vars
+        return [self._get_fingerprint(name, path, extra_vars, excluded_vars=excluded_vars)
+                for name, path, extra_vars in self._get_playbooks()]
+
+    def _get_fingerprint(self, name, path, extra_vars, excluded_vars=_volatile_vars):
+        """
+        The fingerprint of a playbook covers the content of the playbook folder and the extra vars.
+        :param excluded_vars: The extra vars (or prefixes of them) that do not get fingerprinted.
+        """
+        relevant_vars = {key: value for key, value in extra_vars.items() if not key.startswith(excluded_vars)}
+        return get_content_hash(name, self._get_playbook_hash(path), yaml.dump(relevant_vars))
+
+    def _get_snapshot_names(self, fingerprints):
+        """
+        Snapshots are only taken for lxd containers and only if the configuration asks for them.
+        The name of the snapshot that gets taken after a playbook contains a fingerprint of
+        the profiles of the container, this playbook and all the preceding playbooks.
+        Hint: Restoring a snapshot also restores the profiles of the container.
+        :return: The snapshot names in the order of the playbooks or None if snapshots are disabled.
+        """
+        if self.connection != 'lxd' or self.config.get_lxc_playbook_snapshots() == 0:
+            return None
+
+        snapshots = []
+        # the pre config profiles got applied to the container just before the playbooks
+        cumulative_fingerprint = get_content_hash(*get_container_profiles(self.target))
+        for index, fingerprint in enumerate(fingerprints):
+            cumulative_fingerprint = get_content_hash(cumulative_fingerprint, fingerprint)
+            snapshots.append('edi-{:02d}-{}'.format(index, cumulative_fingerprint[:20]))
+        return snapshots
+
+    def _take_snapshot(self, snapshots, index):
+        if not snapshots:
+            return
+
+        if snapshots[index] in get_container_snapshots(self.target):
+            # e.g. the playbooks got applied by force
+            delete_container_snapshot(self.target, snapshots[index])
+
+        logging.info("Taking snapshot {} of container {}.".format(snapshots[index], self.target))
+        create_container_snapshot(self.target, snapshots[index])
+
+    @staticmethod
+    def _get_playbook_hash(playbook):
+        """
+        The playbook, its roles and its other resources are expected to live in the folder of the playbook.
+        """
+        playbook_hash = hashlib.sha256()
+        playbook_folder = os.path.dirname(os.path.abspath(playbook))
+        for root, dirs, files in os.walk(playbook_folder):
+            dirs.sort()
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                playbook_hash.update(os.path.relpath(file_path, playbook_folder).encode())
+                playbook_hash.update(b'\0')
+                with open(file_path, mode='rb') as f:
+                    playbook_hash.update(hashlib.sha256(f.read()).digest())
+        return playbook_hash.hexdigest()
+
+    def _restore_snapshot(self, playbooks, snapshots):
+        """
+        Restore the newest snapshot that still matches the playbooks.
+        :return: The index of the first playbook that needs to be applied.
+        """
+        if not snapshots:
+            return 0
+
+        existing_snapshots = get_container_snapshots(self.target)
+        for index in reversed(range(len(snapshots))):
+            if snapshots[index] in existing_snapshots:
+                logging.info(("Restoring snapshot {} of container {}: skipping playbooks {}."
+                              ).format(snapshots[index], self.target,
+                                       ', '.join(name for name, _, _ in playbooks[:index + 1])))
+                restore_container_snapshot(self.target, snapshots[index])
+                return index + 1
+
+        return 0
+
+    def _read_ledger(self, playbooks):
+        """
+        The ledger maps the names of the applied playbooks to their fingerprints.
+        It is stored in the configuration of a lxd container or in a file on a ssh target.
+        """
+        if self.connection == 'lxd':
+            ledger = get_container_config_item(self.target, PlaybookRunner._ledger_key)
+        elif self.connection == 'ssh' and playbooks:
+            _, _, extra_vars = playbooks[0]
+            ledger = self._read_remote_ledger(extra_vars.get("edi_config_management_user_name"))
+        else:
+            ledger = None
+
+        try:
+            ledger = json.loads(ledger) if ledger else {}
+        except ValueError:
+            logging.warning("Ignoring the invalid playbook ledger of {}.".format(self.target))
+            return {}
+
+        if not isinstance(ledger, dict):
+            return {}
+
+        # forget about playbooks that are no longer in use
+        names = [name for name, _, _ in playbooks]
+        return {name: fingerprint for name, fingerprint in ledger.items() if name in names}
+
+    def _write_ledger(self, ledger, ansible_user):
+        content = json.dumps(ledger, sort_keys=True)
+        if self.connection == 'lxd':
+            set_container_config_item(self.target, PlaybookRunner._ledger_key, content)
+        elif self.connection == 'ssh':
+            self._write_remote_ledger(content, ansible_user)
+
+    def _get_ssh_command(self, ansible_user, remote_command):
+        destination = '{}@{}'.format(ansible_user, self.target) if ansible_user else self.target
+        return ['ssh', '-o', 'BatchMode=yes', destination, remote_command]
+
+    @require("ssh", "'sudo apt install openssh-client'")
+    def _read_remote_ledger(self, ansible_user):
+        cmd = self._get_ssh_command(ansible_user, 'cat {} 2>/dev/null || true'.format(PlaybookRunner._ledger_file))
+        result = run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            logging.warning(("Unable to read the playbook ledger of {} ({}), applying all playbooks."
+                             ).format(self.target, result.stderr.strip()))
+            return None
+        return result.stdout
+
+    @require("ssh", "'sudo apt install openssh-client'")
+    def _write_remote_ledger(self, content, ansible_user):
+        ledger_file = PlaybookRunner._ledger_file
+        remote_command = 'mkdir -p {} && cat > {}'.format(os.path.dirname(ledger_file), ledger_file)
+        cmd = self._get_ssh_command(ansible_user, remote_command)
+        result = run(cmd, input=content, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            logging.warning(("Unable to write the playbook ledger of {} ({})."
+                             ).format(self.target, result.stderr.strip()))
+
+    def _prune_snapshots(self, snapshots):
+        """
+        Keep the configured number of snapshots.
+        The snapshots of the current playbooks are preferred over outdated snapshots,
+        newer snapshots are preferred over older ones.
+        """
+        retention = self.config.get_lxc_playbook_snapshots()
+        edi_snapshots = [snapshot for snapshot in get_container_snapshots(self.target)
+                         if re.match(PlaybookRunner._snapshot_pattern, snapshot)]
+        ranked_snapshots = sorted(edi_snapshots, key=lambda snapshot: (snapshot in snapshots,
+                                                                       edi_snapshots.index(snapshot)))
+        for snapshot in ranked_snapshots[:max(len(ranked_snapshots) - retention, 0)]:
+            logging.info("Deleting snapshot {} of container {}.".format(snapshot, self.target))
+            delete_container_snapshot(self.target, snapshot)
+
     def _get_playbooks(self):
         augmented_list = []
         playbook_list = self.config.get_ordered_path_items(self.config_section)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import difflib
+import logging
+from edi.lib.cachehelpers import get_content_hash, load_cache_entry, store_cache_entry
+from edi.lib.helpers import is_cache_dir_available
+
+
+class PluginIndex:
+    """
+    An index of all files below a plugin directory.
+    The index gets persisted within the edi cache and stays valid as long as the
+    modification times of the indexed directories do not change.
+    """
+
+    # increment this value if the structure of the persistent cache entries changes
+    _cache_format = 1
+
+    _indexes = dict()
+
+    def __init__(self, root, directories, files):
+        self.root = root
+        self._directories = directories
+        self._files = frozenset(files)
+
+    @staticmethod
+    def clear_cache():
+        PluginIndex._indexes = dict()
+
+    @staticmethod
+    def get(root):
+        """
+        Get the index of a plugin directory.
+        :param root: The plugin directory.
+        :return: A PluginIndex.
+        """
+        root = os.path.abspath(root)
+        index = PluginIndex._indexes.get(root)
+        if index is None:
+            index = PluginIndex._load(root)
+            if index is None:
+                index = PluginIndex._build(root)
+                index._store()
+            PluginIndex._indexes[root] = index
+
+        return index
+
+    def resolve(self, path):
+        """
+        Resolve a relative plugin path.
+        An index that is out of date gets rebuilt before a path is reported as missing.
+        :param path: The relative path of the plugin.
+        :return: The absolute path of the plugin or None if the plugin does not exist.
+        """
+        normalized_path = os.path.normpath(path)
+        if normalized_path not in self._files and not self.is_valid():
+            logging.debug("Rebuilding outdated plugin index of '{}'.".format(self.root))
+            index = PluginIndex._build(self.root)
+            self._directories = index._directories
+            self._files = index._files
+            self._store()
+
+        if normalized_path in self._files:
+            return os.path.join(self.root, normalized_path)
+        else:
+            return None
+
+    def get_files(self):
+        return self._files
+
+    def is_valid(self):
+        return all(self._get_stamp(os.path.join(self.root, directory)) == stamp
+                   for directory, stamp in self._directories.items())
+
+    @staticmethod
+    def get_close_matches(path, indexes):
+        """
+        Get plugin paths that are similar to a missing plugin path.
+        :param path: The path that could not be resolved.
+        :param indexes: The indexes that shall be searched for similar plugins.
+        :return: A list of similar plugin paths.
+        """
+        candidates = set()
+        for index in indexes:
+            candidates |= index.get_files()
+        return difflib.get_close_matches(os.path.normpath(path), sorted(candidates), n=3)
+
+    @staticmethod
+    def _get_stamp(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _build(root):
+        directories = {'.': PluginIndex._get_stamp(root)}
+        files = []
+        visited = set()
+        pending = ['.']
+        while pending:
+            directory = pending.pop()
+            real_directory = os.path.realpath(os.path.join(root, directory))
+            if real_directory in visited:
+                continue
+            visited.add(real_directory)
+            try:
+                # Hint: os.scandir is not a context manager on Python 3.5
+                for entry in os.scandir(os.path.join(root, directory)):
+                    relative_path = os.path.normpath(os.path.join(directory, entry.name))
+                    if entry.is_dir():
+                        directories[relative_path] = PluginIndex._get_stamp(entry.path)
+                        pending.append(relative_path)
+                    elif entry.is_file():
+                        files.append(relative_path)
+            except OSError as e:
+                logging.debug("Unable to index plugin directory '{}': {}".format(real_directory, e))
+
+        return PluginIndex(root, directories, files)
+
+    @staticmethod
+    def _get_cache_key(root):
+        return get_content_hash(PluginIndex._cache_format, root)
+
+    @staticmethod
+    def _load(root):
+        cache_entry = load_cache_entry('plugin_indexes', PluginIndex._get_cache_key(root))
+        if not cache_entry:
+            return None
+
+        index = PluginIndex(root, cache_entry.get('directories', {}), cache_entry.get('files', []))
+        if index.is_valid():
+            return index
+        else:
+            return None
+
+    def _store(self):
+        if not is_cache_dir_available():
+            # plugin introspection shall not create an artifact directory
+            return
+
+        cache_entry = {'directories': self._directories, 'files': sorted(self._files)}
+        store_cache_entry('plugin_indexes', PluginIndex._get_cache_key(self.root), cache_entry)
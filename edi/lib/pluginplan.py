@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from edi.lib.jinja2helpers import render_template_file
+
+
+class PluginPlan:
+    """
+    The resolved plugins of a configuration section together with their node dictionaries.
+    The plan stays valid as long as none of the watched plugin files gets modified, added or removed.
+    """
+
+    def __init__(self, items, watched_paths):
+        """
+        :param items: A list of (name, resolved_path, node_dictionary, raw_node) tuples.
+        :param watched_paths: The paths whose modification invalidates the plan.
+        """
+        self._items = items
+        self._stamps = {path: self._get_stamp(path) for path in watched_paths}
+        self._rendered_plugins = dict()
+
+    @staticmethod
+    def _get_stamp(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def is_valid(self):
+        return all(self._get_stamp(path) == stamp for path, stamp in self._stamps.items())
+
+    def get_items(self):
+        """
+        Get the plugins of the plan.
+        The consumers get their own copy of the node dictionaries and can therefore modify them.
+        :return: A list of (name, resolved_path, node_dictionary, raw_node) tuples.
+        """
+        return [(name, path, node_dict.copy(), raw_node) for name, path, node_dict, raw_node in self._items]
+
+    def get_rendered_plugins(self):
+        """
+        Get the plugins of the plan rendered with their node dictionaries.
+        The rendering of each plugin happens at most once.
+        :return: A list of (rendered_plugin, name, resolved_path, node_dictionary) tuples.
+        """
+        rendered_plugins = []
+        for name, path, node_dict, _ in self.get_items():
+            if name not in self._rendered_plugins:
+                self._rendered_plugins[name] = render_template_file(path, node_dict)
+            rendered_plugins.append((self._rendered_plugins[name], name, path, node_dict))
+
+        return rendered_plugins
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import atexit
+import locale
+import shutil
+import socket
+import struct
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import namedtuple
+from edi.lib import privilegedhelperserver
+from edi.lib.helpers import FatalError
+from edi.lib.privilegedhelperserver import send_message, receive_message, get_user_setup
+from edi.lib.subprocesstrace import run_with_rusage
+
+# the keyword arguments of subprocess.run() that the privileged helper supports
+_supported_kwargs = frozenset(['input', 'timeout', 'check', 'universal_newlines', 'stdin', 'stdout', 'stderr', 'cwd'])
+
+_Rusage = namedtuple('_Rusage', ['ru_utime', 'ru_stime', 'ru_maxrss'])
+
+
+def _write_input(fd, data):
+    try:
+        with os.fdopen(fd, mode='wb') as stream:
+            stream.write(data)
+    except BrokenPipeError:
+        pass
+
+
+def _read_output(fd, outputs, name):
+    with os.fdopen(fd, mode='rb') as stream:
+        outputs[name] = stream.read()
+
+
+class _Streams:
+    """
+    The standard streams of a command that gets executed by the privileged helper.
+    """
+
+    def __init__(self, input, stdin, stdout, stderr, universal_newlines):
+        self._universal_newlines = universal_newlines
+        self._child_fds = []
+        self._threads = []
+        self._pending_fds = []
+        self._outputs = dict()
+
+        if input is None and stdin == subprocess.PIPE:
+            input = b''
+
+        if input is not None:
+            read_fd, write_fd = os.pipe()
+            self._child_fds.append(read_fd)
+            self._pending_fds.append(write_fd)
+            if universal_newlines and isinstance(input, str):
+                input = input.encode(locale.getpreferredencoding(False))
+            self._threads.append(threading.Thread(target=_write_input, args=(write_fd, input)))
+            stdin_fd = read_fd
+        else:
+            stdin_fd = self._get_fd(stdin, 0, 'stdin')
+
+        stdout_fd = self._get_fd(stdout, 1, 'stdout')
+        if stderr == subprocess.STDOUT:
+            stderr_fd = stdout_fd
+        else:
+            stderr_fd = self._get_fd(stderr, 2, 'stderr')
+
+        self.fds = [stdin_fd, stdout_fd, stderr_fd]
+
+    def _get_fd(self, spec, default_fd, name):
+        if spec is None:
+            return default_fd
+        elif spec == subprocess.DEVNULL:
+            fd = os.open(os.devnull, os.O_RDWR)
+            self._child_fds.append(fd)
+            return fd
+        elif spec == subprocess.PIPE:
+            read_fd, write_fd = os.pipe()
+            self._child_fds.append(write_fd)
+            self._pending_fds.append(read_fd)
+            self._threads.append(threading.Thread(target=_read_output, args=(read_fd, self._outputs, name)))
+            return write_fd
+        elif isinstance(spec, int):
+            return spec
+        else:
+            return spec.fileno()
+
+    def start(self):
+        """
+        Start the communication with the command once the helper has received the file descriptors.
+        """
+        self._close(self._child_fds)
+        self._pending_fds = []
+        for thread in self._threads:
+            thread.start()
+
+    def finish(self):
+        """
+        Wait until the command has closed its streams.
+        :return: A tuple (stdout, stderr) containing the captured output.
+        """
+        self._close(self._child_fds + self._pending_fds)
+        for thread in self._threads:
+            if thread.ident is not None:
+                thread.join()
+
+        return self._decode(self._outputs.get('stdout')), self._decode(self._outputs.get('stderr'))
+
+    @staticmethod
+    def _close(fds):
+        while fds:
+            os.close(fds.pop())
+
+    def _decode(self, output):
+        if output is None or not self._universal_newlines:
+            return output
+        # same behavior as subprocess.run()
+        return output.decode(locale.getpreferredencoding(False)).replace('\r\n', '\n').replace('\r', '\n')
+
+
+class PrivilegedHelper:
+    """
+    A long-lived helper that gets started through sudo once per edi invocation and executes the
+    privileged commands of edi. This saves the sudo/PAM startup cost of every single privileged command.
+    The helper can be disabled by setting the environment variable EDI_PRIVILEGED_HELPER to 0.
+    """
+    _connection = None
+    _process = None
+    _unavailable = False
+    _stop_registered = False
+    _lock = threading.RLock()
+    _startup_timeout = 300
+
+    def __init__(self, clear_cache=False):
+        if clear_cache:
+            PrivilegedHelper.stop()
+            PrivilegedHelper._unavailable = False
+
+    @staticmethod
+    def is_enabled():
+        return os.environ.get('EDI_PRIVILEGED_HELPER', '1') != '0'
+
+    @staticmethod
+    def is_running():
+        return PrivilegedHelper._connection is not None
+
+    @staticmethod
+    def get_pid():
+        return PrivilegedHelper._process.pid if PrivilegedHelper._process else None
+
+    @staticmethod
+    def _get_launch_command(socket_path):
+        command = [sys.executable, '-I', privilegedhelperserver.__file__, socket_path]
+        if os.getuid() != 0:
+            command = ['sudo'] + command
+        return command
+
+    @staticmethod
+    def start():
+        """
+        Start the helper unless it is already running.
+        :return: True if the helper is running, False if edi has to fall back to sudo.
+        """
+        with PrivilegedHelper._lock:
+            if PrivilegedHelper.is_running():
+                return True
+            if not PrivilegedHelper.is_enabled() or PrivilegedHelper._unavailable:
+                return False
+
+            try:
+                PrivilegedHelper._start()
+            except OSError as error:
+                logging.warning('Unable to start the privileged helper, falling back to sudo: {}'.format(error))
+                PrivilegedHelper._unavailable = True
+                return False
+
+            if not PrivilegedHelper._stop_registered:
+                atexit.register(PrivilegedHelper.stop)
+                PrivilegedHelper._stop_registered = True
+            return True
+
+    @staticmethod
+    def _start():
+        socket_directory = tempfile.mkdtemp(prefix='edi-helper-')
+        try:
+            socket_path = os.path.join(socket_directory, 'socket')
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+                listener.bind(socket_path)
+                listener.listen(1)
+                listener.settimeout(0.5)
+                process = subprocess.Popen(PrivilegedHelper._get_launch_command(socket_path),
+                                           stdin=subprocess.DEVNULL)
+                logging.debug('Started privileged helper (pid {}).'.format(process.pid))
+                connection = PrivilegedHelper._accept(listener, process)
+        finally:
+            shutil.rmtree(socket_directory, ignore_errors=True)
+
+        connection.settimeout(None)
+        credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', credentials)
+        if uid != 0:
+            connection.close()
+            PrivilegedHelper._terminate(process)
+            raise ConnectionError('The privileged helper is not running as root.')
+
+        PrivilegedHelper._connection = connection
+        PrivilegedHelper._process = process
+
+    @staticmethod
+    def _accept(listener, process):
+        deadline = time.monotonic() + PrivilegedHelper._startup_timeout
+        while True:
+            try:
+                connection, _ = listener.accept()
+                return connection
+            except socket.timeout:
+                if process.poll() is not None:
+                    raise ConnectionError('The privileged helper terminated with exit code {}.'.format(
+                        process.returncode))
+                if time.monotonic() > deadline:
+                    PrivilegedHelper._terminate(process)
+                    raise ConnectionError('The privileged helper did not connect within {} seconds.'.format(
+                        PrivilegedHelper._startup_timeout))
+
+    @staticmethod
+    def _terminate(process, timeout=5):
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            try:
+                process.kill()
+            except PermissionError:
+                pass
+            process.wait()
+
+    @staticmethod
+    def stop():
+        """
+        Stop the helper. It terminates as soon as its connection gets closed.
+        """
+        with PrivilegedHelper._lock:
+            if PrivilegedHelper._connection is not None:
+                PrivilegedHelper._connection.close()
+                PrivilegedHelper._connection = None
+            if PrivilegedHelper._process is not None:
+                PrivilegedHelper._terminate(PrivilegedHelper._process)
+                PrivilegedHelper._process = None
+
+    @staticmethod
+    def run(args, user=None, input=None, timeout=None, check=False, universal_newlines=False,
+            stdin=None, stdout=None, stderr=None, cwd=None):
+        """
+        Execute a command within the privileged helper using the same semantics as subprocess.run().
+        :param user: If provided, the command will get executed on behalf of this user.
+        :return: A subprocess.CompletedProcess that additionally carries the resource usage as attribute rusage.
+        """
+        request = {'args': args, 'user': user, 'cwd': cwd, 'timeout': timeout}
+        streams = _Streams(input, stdin, stdout, stderr, universal_newlines)
+        try:
+            with PrivilegedHelper._lock:
+                if not PrivilegedHelper.start():
+                    raise FatalError('The privileged helper is not available.')
+                try:
+                    send_message(PrivilegedHelper._connection, request, streams.fds)
+                    streams.start()
+                    reply, _ = receive_message(PrivilegedHelper._connection)
+                except OSError as error:
+                    reply = None
+                    logging.debug('Lost connection to privileged helper: {}'.format(error))
+
+                if reply is None:
+                    PrivilegedHelper.stop()
+                    PrivilegedHelper._unavailable = True
+                    raise FatalError('The privileged helper terminated unexpectedly while running {}.'.format(args))
+        finally:
+            output, error_output = streams.finish()
+
+        if 'errno' in reply:
+            raise OSError(reply['errno'], reply['strerror'], reply['filename'])
+
+        if reply['timed_out']:
+            raise subprocess.TimeoutExpired(args, timeout, output=output, stderr=error_output)
+
+        rusage = _Rusage(*reply['rusage'])
+        if check and reply['returncode']:
+            error = subprocess.CalledProcessError(reply['returncode'], args, output=output, stderr=error_output)
+            error.rusage = rusage
+            raise error
+
+        result = subprocess.CompletedProcess(args, reply['returncode'], output, error_output)
+        result.rusage = rusage
+        return result
+
+
+def is_privileged_command(args, kwargs):
+    """
+    Check if a command that got prefixed with sudo by edi.lib.shellhelpers.run() can be executed without forking sudo.
+    :param args: The command including the sudo prefix.
+    :param kwargs: The keyword arguments for subprocess.run().
+    """
+    if args[:1] != ['sudo'] or not set(kwargs) <= _supported_kwargs or not PrivilegedHelper.is_enabled():
+        return False
+
+    if args[1:2] == ['-u']:
+        # edi is running as root and drops the privileges on its own
+        return os.getuid() == 0
+    else:
+        return PrivilegedHelper.start()
+
+
+def run_privileged(args, **kwargs):
+    """
+    Execute a command that got prefixed with sudo by edi.lib.shellhelpers.run() without forking sudo.
+    Privileged commands get executed by the privileged helper. If edi is running as root,
+    the privileges get dropped when the child process gets started (see get_user_setup).
+    :param args: The command including the sudo prefix.
+    :param kwargs: The keyword arguments for subprocess.run().
+    :return: A subprocess.CompletedProcess.
+    """
+    if args[1:2] == ['-u']:
+        user_args, popen_kwargs = get_user_setup(args[2], args[3:], os.environ)
+        kwargs.update(popen_kwargs)
+        return run_with_rusage(user_args, **kwargs)
+    else:
+        return PrivilegedHelper.run(args[1:], **kwargs)
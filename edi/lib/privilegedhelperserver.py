@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The server side of the privileged helper (see edi.lib.privilegedhelper).
+This module gets executed as a standalone script through sudo and must therefore only depend on the standard library.
+"""
+
+import os
+import sys
+import pwd
+import shutil
+import errno
+import json
+import array
+import signal
+import socket
+import struct
+import threading
+import subprocess
+
+_header = struct.Struct('!I')
+_fd_count = 3
+
+# like sudo (env_reset) only a few variables of the environment get passed on to a less privileged user
+_kept_variables = frozenset(['TERM', 'DISPLAY', 'XAUTHORITY', 'COLORS', 'LS_COLORS', 'LANG', 'LANGUAGE', 'TZ'])
+_secure_path = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+
+
+def send_message(connection, message, fds=()):
+    """
+    Send a json serializable message together with optional file descriptors.
+    """
+    payload = json.dumps(message).encode()
+    data = _header.pack(len(payload)) + payload
+    ancillary_data = []
+    if fds:
+        ancillary_data.append((socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds)))
+    sent = connection.sendmsg([data], ancillary_data)
+    if sent < len(data):
+        connection.sendall(data[sent:])
+
+
+def receive_message(connection):
+    """
+    Receive a message together with the file descriptors that have been sent along.
+    :return: A tuple (message, fds) or (None, []) if the peer has closed the connection.
+    """
+    fds = array.array('i')
+    data, ancillary_data, _, _ = connection.recvmsg(_header.size, socket.CMSG_LEN(_fd_count * fds.itemsize))
+    for level, kind, fd_data in ancillary_data:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(fd_data[:len(fd_data) - (len(fd_data) % fds.itemsize)])
+
+    if not data:
+        return None, list(fds)
+
+    data = _receive_exactly(connection, data, _header.size)
+    length, = _header.unpack(data)
+    payload = _receive_exactly(connection, b'', length)
+    return json.loads(payload.decode()), list(fds)
+
+
+def _receive_exactly(connection, data, size):
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed while receiving a message.')
+        data += chunk
+    return data
+
+
+def get_user_environment(user_entry, environment):
+    """
+    Build the environment of a less privileged user the way sudo does it (env_reset).
+    :param user_entry: The password database entry of the user.
+    :param environment: The environment of the privileged caller.
+    """
+    user_environment = {key: value for key, value in environment.items()
+                        if key in _kept_variables or key.startswith('LC_')}
+    caller = pwd.getpwuid(os.getuid())
+    user_environment.update({'HOME': user_entry.pw_dir, 'USER': user_entry.pw_name,
+                             'LOGNAME': user_entry.pw_name, 'SHELL': user_entry.pw_shell or '/bin/sh',
+                             'MAIL': '/var/mail/{}'.format(user_entry.pw_name), 'PATH': _secure_path,
+                             'SUDO_USER': caller.pw_name, 'SUDO_UID': str(caller.pw_uid),
+                             'SUDO_GID': str(caller.pw_gid)})
+    return user_environment
+
+
+def get_user_setup(user, args, environment):
+    """
+    Prepare the execution of a command on behalf of a less privileged user.
+    :param user: The name of the user.
+    :param args: The command.
+    :param environment: The environment of the privileged caller.
+    :return: A tuple (args, popen_kwargs).
+    """
+    user_entry = pwd.getpwnam(user)
+    groups = os.getgrouplist(user, user_entry.pw_gid)
+    popen_kwargs = {'env': get_user_environment(user_entry, environment)}
+    if sys.version_info >= (3, 9):
+        # privileges get dropped by the subprocess module right before exec
+        popen_kwargs.update({'user': user_entry.pw_uid, 'group': user_entry.pw_gid, 'extra_groups': groups})
+        return list(args), popen_kwargs
+
+    # a preexec_fn is not safe in the presence of threads: let a tool drop the privileges
+    if shutil.which('setpriv', path=_secure_path):
+        prefix = ['setpriv', '--reuid={}'.format(user_entry.pw_uid), '--regid={}'.format(user_entry.pw_gid),
+                  '--groups={}'.format(','.join(str(group) for group in groups)), '--']
+    elif shutil.which('runuser', path=_secure_path):
+        prefix = ['runuser', '-u', user, '--']
+    else:
+        prefix = ['sudo', '-u', user, '--']
+
+    return [shutil.which(prefix[0], path=_secure_path) or prefix[0]] + prefix[1:] + list(args), popen_kwargs
+
+
+def get_returncode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    else:
+        return os.WEXITSTATUS(status)
+
+
+def _execute(request, fds):
+    stdin, stdout, stderr = fds
+    args = request['args']
+    kwargs = dict()
+    if request.get('user'):
+        args, kwargs = get_user_setup(request['user'], args, os.environ)
+
+    process = subprocess.Popen(args, stdin=stdin, stdout=stdout, stderr=stderr, cwd=request.get('cwd'), **kwargs)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = None
+    if request.get('timeout') is not None:
+        timer = threading.Timer(request['timeout'], kill)
+        timer.start()
+
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = get_returncode(status)
+    if timer is not None:
+        timer.cancel()
+
+    return {'returncode': process.returncode, 'timed_out': timed_out.is_set(),
+            'rusage': [rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss]}
+
+
+def serve(connection):
+    """
+    Execute the requested commands until the peer closes the connection.
+    """
+    while True:
+        request, fds = receive_message(connection)
+        try:
+            if request is None:
+                return
+            if len(fds) != _fd_count:
+                raise ValueError('Expected {} file descriptors.'.format(_fd_count))
+            reply = _execute(request, fds)
+        except OSError as error:
+            reply = {'errno': error.errno, 'strerror': error.strerror, 'filename': error.filename}
+        except (KeyError, TypeError, ValueError) as error:
+            reply = {'errno': errno.EINVAL, 'strerror': 'Invalid request: {}'.format(error), 'filename': None}
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        send_message(connection, reply)
+
+
+def main(socket_path):
+    # the commands shall receive a keyboard interrupt but the helper shall survive it
+    signal.signal(signal.SIGINT, lambda signum, frame: None)
+
+    # the commands get their standard streams passed along with each request
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 0)
+    os.dup2(2, 1)
+    os.close(null_fd)
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    try:
+        serve(connection)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
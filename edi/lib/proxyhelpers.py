@@ -24,6 +24,7 @@ import os
 import ast
 import logging
 import subprocess
+import threading
 from functools import partial
 
 import edi.lib.helpers
@@ -43,9 +44,33 @@ def get_gsettings_value(schema, key, default=None):
         return default
 
 
+def get_gsettings_values(schema):
+    """
+    Get the values of a schema including its child schemas using a single gsettings call.
+    :param schema: The schema (e.g. org.gnome.system.proxy).
+    :return: A dictionary that maps (schema, key) to the value or None if the schema is not available.
+    """
+    cmd = ['gsettings', 'list-recursively', schema]
+    result = run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        logging.debug('''The command '{}' failed: {}'''.format(cmd, result.stderr))
+        return None
+
+    values = dict()
+    for line in result.stdout.splitlines():
+        items = line.split(' ', 2)
+        if len(items) >= 2:
+            value = items[2] if len(items) == 3 else ''
+            values[(items[0], items[1])] = value.strip("'")
+
+    return values or None
+
+
 class ProxySetup:
     _cache = dict()
     _warn_if_auto_mode = True
+    # the host facts might get probed concurrently
+    _lock = threading.Lock()
 
     def __init__(self, clear_cache=False):
         if clear_cache:
@@ -65,11 +90,12 @@ class ProxySetup:
     def get(self, environment_variable, default=None):
         assert environment_variable in self._env_to_getter
 
-        if environment_variable in ProxySetup._cache:
-            result = ProxySetup._cache.get(environment_variable)
-        else:
-            result = self._env_to_getter[environment_variable]()
-            ProxySetup._cache[environment_variable] = result
+        with ProxySetup._lock:
+            if environment_variable in ProxySetup._cache:
+                result = ProxySetup._cache.get(environment_variable)
+            else:
+                result = self._env_to_getter[environment_variable]()
+                ProxySetup._cache[environment_variable] = result
 
         if result:
             return result
@@ -114,10 +140,23 @@ class ProxySetup:
         else:
             return None
 
+    @staticmethod
+    def _gsettings_get(schema, key):
+        cache_key = 'gsettings-proxy-values'
+        if cache_key not in ProxySetup._cache:
+            ProxySetup._cache[cache_key] = get_gsettings_values('org.gnome.system.proxy')
+
+        values = ProxySetup._cache.get(cache_key)
+        if values is None:
+            # fallback for hosts where the schema can not be listed
+            return get_gsettings_value(schema, key)
+        else:
+            return values.get((schema, key))
+
     @staticmethod
     def _gsettings_get_proxy(schema, prefix):
-        host = get_gsettings_value(schema, 'host')
-        port = get_gsettings_value(schema, 'port')
+        host = ProxySetup._gsettings_get(schema, 'host')
+        port = ProxySetup._gsettings_get(schema, 'port')
 
         if host and port and port != '0':
             return '{}://{}:{}/'.format(prefix, host, port)
@@ -126,7 +165,7 @@ class ProxySetup:
 
     @staticmethod
     def _gsettings_get_ignore_hosts():
-        no_proxy = get_gsettings_value('org.gnome.system.proxy', 'ignore-hosts')
+        no_proxy = ProxySetup._gsettings_get('org.gnome.system.proxy', 'ignore-hosts')
 
         if no_proxy and no_proxy != '@as []':
             return ','.join(ast.literal_eval(no_proxy))
@@ -146,7 +185,7 @@ class ProxySetup:
     def _proxy_mode():
         key = 'gsettings-proxy-mode'
         if key not in ProxySetup._cache:
-            result = get_gsettings_value('org.gnome.system.proxy', 'mode')
+            result = ProxySetup._gsettings_get('org.gnome.system.proxy', 'mode')
             ProxySetup._cache[key] = result
 
         return ProxySetup._cache.get(key)
@@ -20,7 +20,6 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from jinja2 import Template
 from edi.lib.helpers import FatalError
 from edi.lib.shellhelpers import run, require
 from edi.lib.lxchelpers import lxc_exec, lxd_install_hint, LxdVersion
@@ -28,6 +27,7 @@ import os
 import logging
 import subprocess
 from edi.lib.yamlhelpers import normalize_yaml
+from edi.lib.jinja2helpers import render_template
 
 
 profile_privileged = """
@@ -90,26 +90,29 @@ class SharedFolderCoordinator():
     def verify_container_mountpoints(self, container_name):
         """
         Verify that all mount points exist within the target system.
-        If a target mount point is missing, raise a fatal error.
+        If target mount points are missing, raise a fatal error that lists all of them.
         Hint: It is assumed that the mount points within the target get created during the configuration phase.
         """
         if self._suppress_shared_folders():
             return
 
-        test_cmd = [lxc_exec(), 'exec', container_name, '--', 'true']
-        result = run(test_cmd, check=False, stderr=subprocess.PIPE)
+        # a single exec checks all mount points (and the communication with the container)
+        script = 'for mountpoint in "$@"; do [ -d "$mountpoint" ] || echo "$mountpoint"; done'
+        cmd = [lxc_exec(), 'exec', container_name, '--', 'sh', '-c', script, 'sh']
+        cmd.extend(self.get_mountpoints())
+        result = run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         if result.returncode != 0:
             raise FatalError(('''The communication with the container '{}' failed with the message '{}'.'''
                               ).format(container_name, result.stderr))
 
-        mountpoints = self.get_mountpoints()
-        for mountpoint in mountpoints:
-            cmd = [lxc_exec(), 'exec', container_name, '--', 'test', '-d', mountpoint]
-            if run(cmd, check=False).returncode != 0:
-                raise FatalError(('''Please make sure that '{}' is valid mount point in the container '{}'.\n'''
-                                  '''Hint: Use an appropriate playbook that generates those mount points\n'''
-                                  '''      by using the variable 'edi_shared_folder_mountpoints'.''')
-                                 .format(mountpoint, container_name))
+        missing_mountpoints = [line for line in result.stdout.splitlines() if line]
+        if missing_mountpoints:
+            raise FatalError(('''Please make sure that the following mount points are valid in the container '{}':\n'''
+                              '''{}\n'''
+                              '''Hint: Use an appropriate playbook that generates those mount points\n'''
+                              '''      by using the variable 'edi_shared_folder_mountpoints'.''')
+                             .format(container_name, '\n'.join(['  - {}'.format(mountpoint)
+                                                                for mountpoint in missing_mountpoints])))
 
     def get_mountpoints(self):
         """
@@ -130,7 +133,7 @@ class SharedFolderCoordinator():
             return []
 
         if self._config.get_ordered_raw_items('shared_folders'):
-            return [(normalize_yaml(Template(profile_privileged).render({})), 'zzz_privileged', 'builtin', {})]
+            return [(normalize_yaml(render_template(profile_privileged, {})), 'zzz_privileged', 'builtin', {})]
         else:
             return []
 
@@ -145,12 +148,11 @@ class SharedFolderCoordinator():
         shared_folders = self._config.get_ordered_raw_items('shared_folders')
         if shared_folders:
             profiles = self.get_pre_config_profiles()
-            template = Template(profile_shared_folder)
             for name, content, node_dict in shared_folders:
                 for item in ['folder', 'mountpoint']:
                     node_dict['shared_folder_{}'.format(item)] = self._get_mandatory_item(name, content, item)
                 node_dict['shared_folder_name'] = name
-                profiles.append((normalize_yaml(template.render(node_dict)),
+                profiles.append((normalize_yaml(render_template(profile_shared_folder, node_dict)),
                                  'zzz_{}'.format(name), 'builtin', node_dict))
 
             return profiles
@@ -19,36 +19,300 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import logging
 import subprocess
 import os
 import re
+import select
+import sys
+import threading
+import time
+import collections
 from shutil import rmtree
 from tempfile import mkdtemp
 from contextlib import contextmanager
 from edi.lib.helpers import get_user, get_artifact_dir, FatalError, which
 from edi.lib import mockablerun
+from edi.lib.subprocesstrace import SubprocessTrace
 
 _ADAPTIVE = -42
 
+# read the output incrementally, forward it to logging and only keep its tail
+STREAM = -43
+
+
+class _OutputStream:
+    """
+    Consumes the output of a command line by line.
+    Only a bounded number of trailing lines is kept (e.g. for error messages).
+    """
+    _max_tail_lines = 200
+    _max_line_length = 64 * 1024
+    _max_drain_size = 1024 * 1024
+
+    def __init__(self, log_threshold, universal_newlines):
+        self._log_threshold = log_threshold
+        self._log_enabled = logging.getLogger().isEnabledFor(log_threshold)
+        self._universal_newlines = universal_newlines
+        self._tail = collections.deque(maxlen=_OutputStream._max_tail_lines)
+        self._pending = b''
+        self._read_fd, self.write_fd = os.pipe()
+        self._wakeup_read_fd, self._wakeup_write_fd = os.pipe()
+        self._closed = False
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        drained = None
+        try:
+            while drained is None or drained < _OutputStream._max_drain_size:
+                if drained is None:
+                    readable, _, _ = select.select([self._read_fd, self._wakeup_read_fd], [], [])
+                    if self._wakeup_read_fd in readable:
+                        # The command has terminated but a daemon started by it might keep the pipe open:
+                        # Only consume the output that is already available.
+                        os.set_blocking(self._read_fd, False)
+                        drained = 0
+                try:
+                    chunk = os.read(self._read_fd, _OutputStream._max_line_length)
+                except BlockingIOError:
+                    break
+                if not chunk:
+                    break
+                if drained is not None:
+                    drained += len(chunk)
+                self._add_output(chunk)
+        finally:
+            if self._pending:
+                self._add_line(self._pending)
+            os.close(self._read_fd)
+            os.close(self._wakeup_read_fd)
+
+    def _add_output(self, chunk):
+        self._pending += chunk
+        while True:
+            end = self._pending.find(b'\n', 0, _OutputStream._max_line_length)
+            if end >= 0:
+                length = end + 1
+            elif len(self._pending) >= _OutputStream._max_line_length:
+                length = _OutputStream._max_line_length
+            else:
+                return
+            self._add_line(self._pending[:length])
+            self._pending = self._pending[length:]
+
+    def _add_line(self, line):
+        self._tail.append(line)
+        if self._log_enabled:
+            logging.log(self._log_threshold, line.decode(errors='replace').rstrip('\n'))
+
+    def close(self):
+        """
+        Close the stream after the command has terminated.
+        :return: The tail of the output.
+        """
+        if not self._closed:
+            self._closed = True
+            os.close(self.write_fd)
+            os.close(self._wakeup_write_fd)
+            self._thread.join()
+
+        tail = b''.join(list(self._tail))
+        if self._universal_newlines:
+            return tail.decode(errors='replace')
+        else:
+            return tail
+
 
 def run(popenargs, sudo=False, input=None, timeout=None, check=True, universal_newlines=True,
         stdout=_ADAPTIVE, log_threshold=logging.DEBUG,
         **kwargs):
     """
     Small wrapper around subprocess.run().
+    With stdout=STREAM the output gets forwarded line by line to logging and only its tail gets kept
+    (as stdout of the result or of the CalledProcessError).
+    """
+
+    assert type(popenargs) is list
+
+    subprocess_stdout = _get_subprocess_stdout(stdout, log_threshold)
+    all_args = _get_all_args(popenargs, sudo)
+
+    logging.log(log_threshold, "Running command: {0}".format(all_args))
+
+    if subprocess_stdout == STREAM:
+        output_stream = _OutputStream(log_threshold, universal_newlines)
+        try:
+            result = run(popenargs, sudo=sudo, input=input, timeout=timeout, check=check,
+                         universal_newlines=universal_newlines, stdout=output_stream.write_fd,
+                         log_threshold=logging.NOTSET, **kwargs)
+        except subprocess.CalledProcessError as error:
+            error.output = output_stream.close()
+            raise
+        finally:
+            tail = output_stream.close()
+
+        if result.stdout is None:
+            result.stdout = tail
+        return result
+
+    if SubprocessTrace.is_enabled():
+        result = _run_traced(all_args, input=input, timeout=timeout, check=check,
+                             universal_newlines=universal_newlines, stdout=subprocess_stdout, **kwargs)
+    else:
+        result = mockablerun.run_mockable(all_args, input=input, timeout=timeout, check=check,
+                                          universal_newlines=universal_newlines,
+                                          stdout=subprocess_stdout, **kwargs)
+
+    _log_output(result, subprocess_stdout, log_threshold)
+    return result
+
+
+async def run_async(popenargs, sudo=False, input=None, timeout=None, check=True, universal_newlines=True,
+                    stdout=_ADAPTIVE, log_threshold=logging.DEBUG,
+                    **kwargs):
+    """
+    Asynchronous counterpart of run() with the same semantics.
+    Upon a timeout or a cancellation the whole process group of the command gets killed.
     """
 
     assert type(popenargs) is list
 
-    subprocess_stdout = stdout
+    subprocess_stdout = _get_subprocess_stdout(stdout, log_threshold)
+    all_args = _get_all_args(popenargs, sudo)
+
+    logging.log(log_threshold, "Running command: {0}".format(all_args))
+
+    if subprocess_stdout == STREAM:
+        output_stream = _OutputStream(log_threshold, universal_newlines)
+        try:
+            result = await run_async(popenargs, sudo=sudo, input=input, timeout=timeout, check=check,
+                                     universal_newlines=universal_newlines, stdout=output_stream.write_fd,
+                                     log_threshold=logging.NOTSET, **kwargs)
+        except subprocess.CalledProcessError as error:
+            error.output = output_stream.close()
+            raise
+        finally:
+            tail = output_stream.close()
+
+        if result.stdout is None:
+            result.stdout = tail
+        return result
+
+    start = time.monotonic()
+    try:
+        result = await mockablerun.run_mockable_async(all_args, input=input, timeout=timeout, check=check,
+                                                      universal_newlines=universal_newlines,
+                                                      stdout=subprocess_stdout, **kwargs)
+    except subprocess.CalledProcessError as error:
+        _trace(all_args, start, error.returncode, error.stdout, error.stderr)
+        raise
+    except (subprocess.TimeoutExpired, asyncio.CancelledError):
+        _trace(all_args, start, None)
+        raise
+
+    _trace(all_args, start, result.returncode, result.stdout, result.stderr)
+    _log_output(result, subprocess_stdout, log_threshold)
+    return result
+
+
+def popen(popenargs, sudo=False, log_threshold=logging.DEBUG, **kwargs):
+    """
+    Small wrapper around subprocess.Popen() for long running commands (e.g. monitors)
+    that get stopped using terminate().
+    The privileges get handled like within run().
+    """
+
+    assert type(popenargs) is list
+
+    all_args = _get_all_args(popenargs, sudo)
+    logging.log(log_threshold, "Starting command: {0}".format(all_args))
+    return mockablerun.popen_mockable(all_args, **kwargs)
+
+
+def terminate(process):
+    """
+    Stop a command that got started using popen() including all its child processes.
+    """
+    mockablerun.terminate_process_group(process)
+
+
+async def gather_bounded(coroutines, limit=4, return_exceptions=False):
+    """
+    Await many coroutines while running at most limit of them at the same time.
+    :param coroutines: The coroutines (e.g. run_async(...) calls).
+    :param limit: The maximum number of coroutines that run concurrently.
+    :param return_exceptions: Passed through to asyncio.gather.
+    :return: The results in the order of the coroutines.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*[bounded(coroutine) for coroutine in coroutines],
+                                return_exceptions=return_exceptions)
+
+
+def run_concurrently(commands, limit=4, **kwargs):
+    """
+    Run many commands with bounded concurrency from synchronous code.
+    Hint: Call this function from the main thread only (child process watching of asyncio).
+    :param commands: A list of commands (see popenargs of run()).
+    :param limit: The maximum number of commands that run concurrently.
+    :param kwargs: Arguments that get applied to all commands (see run()).
+    :return: The results in the order of the commands.
+    """
+    return run_bounded([run_async(command, **kwargs) for command in commands], limit=limit)
+
+
+def run_bounded(coroutines, limit=4):
+    """
+    Await many coroutines with bounded concurrency from synchronous code.
+    Hint: Call this function from the main thread only (child process watching of asyncio).
+    :param coroutines: The coroutines (e.g. run_async(...) calls).
+    :param limit: The maximum number of coroutines that run concurrently.
+    :return: The results in the order of the coroutines.
+    """
+    with _event_loop() as loop:
+        return loop.run_until_complete(gather_bounded(coroutines, limit=limit))
+
 
-    if subprocess_stdout == _ADAPTIVE:
+@contextmanager
+def _event_loop():
+    """
+    Provide a fresh event loop that is able to watch child processes.
+    Hint: Prior to Python 3.8 the child watcher only works if the loop is attached to it.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    watcher = None
+    if sys.version_info < (3, 8):
+        watcher = asyncio.get_child_watcher()
+        watcher.attach_loop(loop)
+    try:
+        yield loop
+    finally:
+        if watcher is not None:
+            watcher.attach_loop(None)
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def _get_subprocess_stdout(stdout, log_threshold):
+    if stdout == _ADAPTIVE:
         if logging.getLogger().isEnabledFor(log_threshold):
-            subprocess_stdout = None
+            return None
         else:
-            subprocess_stdout = subprocess.PIPE
+            # do not buffer the whole output of long running commands
+            return STREAM
+    else:
+        return stdout
+
 
+def _get_all_args(popenargs, sudo):
     all_args = list()
     if not sudo and os.getuid() == 0:
         current_user = get_user()
@@ -59,17 +323,32 @@ def run(popenargs, sudo=False, input=None, timeout=None, check=True, universal_n
         all_args.append('sudo')
 
     all_args.extend(popenargs)
+    return all_args
 
-    logging.log(log_threshold, "Running command: {0}".format(all_args))
-
-    result = mockablerun.run_mockable(all_args, input=input, timeout=timeout, check=check,
-                                      universal_newlines=universal_newlines,
-                                      stdout=subprocess_stdout, **kwargs)
 
+def _log_output(result, subprocess_stdout, log_threshold):
     if (logging.getLogger().isEnabledFor(log_threshold) and
             subprocess_stdout is subprocess.PIPE):
         logging.log(log_threshold, result.stdout)
 
+
+def _trace(all_args, start, returncode, stdout=None, stderr=None, rusage=None):
+    if SubprocessTrace.is_enabled():
+        SubprocessTrace.record(all_args, start, time.monotonic(), returncode, stdout, stderr, rusage)
+
+
+def _run_traced(all_args, **kwargs):
+    start = time.monotonic()
+    try:
+        result = mockablerun.run_mockable(all_args, **kwargs)
+    except subprocess.CalledProcessError as error:
+        _trace(all_args, start, error.returncode, error.stdout, error.stderr, getattr(error, 'rusage', None))
+        raise
+    except subprocess.TimeoutExpired:
+        _trace(all_args, start, None)
+        raise
+
+    _trace(all_args, start, result.returncode, result.stdout, result.stderr, getattr(result, 'rusage', None))
     return result
 
 
@@ -80,18 +359,50 @@ def get_chroot_cmd(rootfs):
     return cmd
 
 
+class UserEnvironment:
+    """
+    Snapshot of the environment variables as seen by the user that runs edi.
+    The snapshot gets taken with a single 'env -0' call upon first use.
+    """
+    _variables = None
+    _lock = threading.Lock()
+
+    def __init__(self, clear_cache=False):
+        if clear_cache:
+            with UserEnvironment._lock:
+                UserEnvironment._variables = None
+
+    @staticmethod
+    def get():
+        with UserEnvironment._lock:
+            if UserEnvironment._variables is None:
+                UserEnvironment._variables = UserEnvironment._read_environment()
+
+            return UserEnvironment._variables
+
+    @staticmethod
+    def _read_environment():
+        cmd = ["env", "-0"]
+        # in order to keep environment variables do not drop privileges with sudo -u ...
+        keep_sudo = os.getuid() == 0
+        result = run(cmd, stdout=subprocess.PIPE, check=False, sudo=keep_sudo)
+        variables = dict()
+        if result.returncode == 0:
+            for item in result.stdout.split('\0'):
+                name, separator, value = item.partition('=')
+                if separator:
+                    variables[name] = value
+        else:
+            logging.debug('''The command '{}' failed.'''.format(cmd))
+
+        return variables
+
+
 def get_environment_variable(name, default=None):
     # the environment variable HOME is treated differently on Ubuntu and Debian
     # use get_user_home_directory instead
     assert name != 'HOME'
-    cmd = ["printenv", name]
-    # in order to keep environment variables do not drop privileges with sudo -u ...
-    keep_sudo = os.getuid() == 0
-    result = run(cmd, stdout=subprocess.PIPE, check=False, sudo=keep_sudo)
-    if result.returncode == 0:
-        return result.stdout.strip('\n')
-    else:
-        return default
+    return UserEnvironment.get().get(name, default)
 
 
 def get_current_display():
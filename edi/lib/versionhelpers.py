@@ -20,8 +20,9 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import pkg_resources
 import re
+import logging
+from functools import lru_cache
 from edi.lib.helpers import FatalError
 
 # The do_release script will update this version!
@@ -29,23 +30,43 @@ from edi.lib.helpers import FatalError
 edi_fallback_version = '1.7.4'
 
 
+def _get_installed_version():
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Python < 3.8: do import locally since importing pkg_resources is slow
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution('edi').version
+        except pkg_resources.DistributionNotFound:
+            return None
+
+    try:
+        return metadata.version('edi')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=None)
 def get_edi_version():
     """
-    Get the version of the current edi installation or the version derived from git.
+    Get the version of the current edi installation or - if explicitly requested using the
+    environment variable EDI_GIT_VERSION=1 - the version derived from git.
+    The version gets resolved once per process.
 
     :return: full edi version string
     """
-    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
-    git_dir = os.path.join(project_root, ".git")
-    if os.path.isdir(git_dir):
-        # do import locally so that we do not depend on setuptools_scm for the released version
-        from setuptools_scm import get_version
-        return get_version(root=project_root)
-    else:
-        try:
-            return pkg_resources.get_distribution('edi').version
-        except pkg_resources.DistributionNotFound:
-            return edi_fallback_version
+    if os.environ.get('EDI_GIT_VERSION') == '1':
+        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+        if os.path.isdir(os.path.join(project_root, ".git")):
+            # do import locally so that we do not depend on setuptools_scm for the released version
+            from setuptools_scm import get_version
+            return get_version(root=project_root)
+        else:
+            logging.warning("EDI_GIT_VERSION is set but edi is not running from a git checkout.")
+
+    # the installed version might carry a suffix that got stamped into setup.py only (e.g. 1.7.4+u1804)
+    return _get_installed_version() or edi_fallback_version
 
 
 def get_stripped_version(version):
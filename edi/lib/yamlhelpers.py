@@ -21,6 +21,7 @@
 
 import yaml
 from edi.lib.helpers import FatalError
+from edi.lib.lazydictionary import LazyDictionary
 
 
 class LiteralString(str):
@@ -34,6 +35,13 @@ def literal_string_representer(dumper, data):
 yaml.add_representer(LiteralString, literal_string_representer)
 
 
+def lazy_dictionary_representer(dumper, data):
+    return dumper.represent_dict(dict(data.items()))
+
+
+yaml.add_representer(LazyDictionary, lazy_dictionary_representer)
+
+
 def normalize_yaml(yaml_string):
     """
     Feeds a yaml string through pyyaml to normalize its representation.
@@ -20,7 +20,8 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 from edi.commands.imagecommands.bootstrap import Bootstrap
-from tests.libtesting.helpers import get_command, get_command_parameter, get_sub_command
+from tests.libtesting.helpers import (get_command, get_command_parameter, get_sub_command, is_environment_query,
+                                      fake_environment)
 import os
 import shutil
 import subprocess
@@ -63,8 +64,8 @@ def test_bootstrap(config_files, monkeypatch):
                 return subprocess.CompletedProcess("fakerun", 0, '2.18')
             elif get_command(popenargs) == "ssh" and get_sub_command(popenargs) == "-G":
                 return subprocess.CompletedProcess("fakerun", 0, 'ssh config')
-            elif get_command(popenargs) == "printenv":
-                return subprocess.CompletedProcess("fakerun", 0, '')
+            elif is_environment_query(popenargs):
+                return fake_environment({})
             elif get_command(popenargs) == 'getent' and get_sub_command(popenargs) == 'passwd':
                 return subprocess.CompletedProcess("fakerun", 0,
                                                    stdout='john:x:1000:1000:John Doe,,,:/no/such/directory:/bin/bash\n')
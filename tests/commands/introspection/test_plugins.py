@@ -33,6 +33,7 @@ from edi.commands.lxccommands.lxcprepare import Prepare
 from edi.commands.lxccommands.importcmd import Import
 from edi.commands.lxccommands.launch import Launch
 from edi.commands.lxccommands.lxcconfigure import Configure
+from edi.commands.lxccommands.clone import Clone
 from edi.commands.lxccommands.profile import Profile
 from edi.commands.lxccommands.publish import Publish
 from edi.commands.lxccommands.stop import Stop
@@ -52,6 +53,7 @@ from tests.libtesting.contextmanagers.mocked_executable import mocked_executable
     (Import, ['lxc', 'import', '--plugins'], True, False, False, False),
     (Launch, ['lxc', 'launch', '--plugins', 'cname'], True, True, False, False),
     (Configure, ['lxc', 'configure', '--plugins', 'cname'], True, True, True, False),
+    (Clone, ['lxc', 'clone', '--plugins', 'cname'], True, True, True, False),
     (Profile, ['lxc', 'profile', '--plugins'], False, True, False, False),
     (Publish, ['lxc', 'publish', '--plugins'], True, True, True, False),
     (Stop, ['lxc', 'stop', '--plugins'], True, True, True, False),
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2017 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+import subprocess
+from codecs import open
+from edi.commands.lxccommands.clone import Clone
+from edi.commands.lxccommands.lxcconfigure import Configure, configuration_fingerprint_key
+from edi.lib import hostfacts
+from edi.lib.helpers import FatalError
+from edi.lib.hostfacts import HostFacts
+from edi.lib.shellhelpers import mockablerun
+from edi.lib.sharedfoldercoordinator import SharedFolderCoordinator
+
+
+config_file_content = """
+general:
+    edi_lxc_stop_timeout:   10
+
+lxc_profiles:
+    10_foo:
+        path:               profiles/foo.yml
+
+playbooks:
+    10_foo:
+        path:               playbooks/foo/main.yml
+        parameters:
+            message:        {}
+"""
+
+
+def write_config(directory, message='hello'):
+    directory.join('plugins', 'profiles').ensure(dir=True).join('foo.yml').write('name: foo\nconfig: {}\ndevices: {}\n')
+    directory.join('plugins', 'playbooks', 'foo').ensure(dir=True).join('main.yml').write('- hosts: all\n')
+    config_file = directory.join('clone-test.yml')
+    config_file.write(config_file_content.format(message))
+    return str(config_file)
+
+
+@pytest.fixture
+def clone_environment(fake_lxd, monkeypatch):
+    def passthrough(*popenargs, **kwargs):
+        return subprocess.run(*popenargs, **kwargs)
+
+    monkeypatch.setattr(mockablerun, 'run_mockable', passthrough)
+    monkeypatch.setattr(SharedFolderCoordinator, 'create_host_folders', lambda _: None)
+    verified_containers = []
+    monkeypatch.setattr(SharedFolderCoordinator, 'verify_container_mountpoints',
+                        lambda _, container_name: verified_containers.append(container_name))
+    return fake_lxd, verified_containers
+
+
+def test_clone_golden_container(tmpdir, clone_environment):
+    fake_lxd, verified_containers = clone_environment
+    config_files = write_config(tmpdir)
+
+    with open(config_files, "r") as main_file:
+        fingerprint = Configure().get_fingerprint('golden', main_file)
+
+    with open(config_files, "r") as main_file:
+        assert fingerprint == Configure().get_fingerprint('other', main_file)
+
+    with open(write_config(tmpdir.mkdir('modified'), message='modified'), "r") as main_file:
+        assert fingerprint != Configure().get_fingerprint('golden', main_file)
+
+    fake_lxd.containers['golden'] = {'name': 'golden', 'status': 'Running', 'profiles': ['default', 'golden_user'],
+                                     'config': {configuration_fingerprint_key: fingerprint}}
+    fake_lxd.snapshots['golden'] = ['edi-00-0123456789abcdef0123']
+    fake_lxd.containers['outdated'] = {'name': 'outdated', 'status': 'Stopped', 'profiles': ['default'],
+                                       'config': {configuration_fingerprint_key: 'outdated'}}
+
+    with open(config_files, "r") as main_file:
+        assert Clone().run('cloned', main_file) == 'cloned'
+
+    assert fake_lxd.copied_containers == [('golden', 'cloned')]
+    # the playbook snapshots of the golden container do not get copied
+    assert not fake_lxd.snapshots.get('cloned')
+    cloned = fake_lxd.containers['cloned']
+    assert cloned['status'] == 'Running'
+    assert cloned['config'][configuration_fingerprint_key] == fingerprint
+    # the post config profiles of the current user replace the ones of the golden container
+    assert 'golden_user' not in cloned['profiles']
+    assert verified_containers == ['cloned']
+
+    with pytest.raises(FatalError) as error:
+        with open(config_files, "r") as main_file:
+            Clone().run('cloned', main_file)
+    assert 'already existing' in error.value.message
+
+
+def test_clone_without_golden_container(tmpdir, clone_environment, monkeypatch):
+    fake_lxd, _ = clone_environment
+    config_files = write_config(tmpdir)
+    fake_lxd.containers['outdated'] = {'name': 'outdated', 'status': 'Stopped', 'profiles': ['default'],
+                                       'config': {configuration_fingerprint_key: 'outdated'}}
+
+    configured_containers = []
+    monkeypatch.setattr(Configure, 'run',
+                        lambda _, container_name, config_file: configured_containers.append(container_name))
+
+    with open(config_files, "r") as main_file:
+        Clone().run('cloned', main_file)
+
+    assert configured_containers == ['cloned']
+    assert fake_lxd.copied_containers == []
+
+
+def test_clone_golden_container_of_other_user(tmpdir, clone_environment, monkeypatch):
+    fake_lxd, _ = clone_environment
+    config_files = write_config(tmpdir)
+
+    with open(config_files, "r") as main_file:
+        fingerprint = Configure().get_fingerprint('golden', main_file)
+
+    fake_lxd.containers['golden'] = {'name': 'golden', 'status': 'Running', 'profiles': ['default'],
+                                     'config': {configuration_fingerprint_key: fingerprint}}
+
+    get_host_fact_getters = hostfacts.get_host_fact_getters
+
+    def get_teammate_fact_getters():
+        getters = get_host_fact_getters()
+        getters.update({'edi_current_user_name': lambda: 'teammate',
+                        'edi_current_user_uid': lambda: 4242,
+                        'edi_current_user_ssh_pub_keys': lambda: ['ssh-rsa teammate']})
+        return getters
+
+    configured_containers = []
+    monkeypatch.setattr(Configure, 'run',
+                        lambda _, container_name, config_file: configured_containers.append(container_name))
+    monkeypatch.setattr(hostfacts, 'get_host_fact_getters', get_teammate_fact_getters)
+    HostFacts(clear_cache=True)
+    try:
+        with open(config_files, "r") as main_file:
+            assert fingerprint != Configure().get_fingerprint('cloned', main_file)
+
+        with open(config_files, "r") as main_file:
+            Clone().run('cloned', main_file)
+    finally:
+        HostFacts(clear_cache=True)
+
+    # the container of the teammate does not get handed over to the current user
+    assert fake_lxd.copied_containers == []
+    assert configured_containers == ['cloned']
@@ -24,12 +24,15 @@ import pytest
 from tests.libtesting.contextmanagers.workspace import workspace
 import os
 from tests.libtesting.helpers import get_random_string, get_project_root
-from edi.lib.shellhelpers import run, get_debian_architecture
+from edi.lib.shellhelpers import run, get_debian_architecture, mockablerun
 from edi.lib.helpers import get_artifact_dir
 from edi.lib.configurationparser import get_base_dictionary
 from edi.commands.lxccommands.lxcconfigure import Configure
+from edi.commands.lxccommands.launch import Launch
 from edi.commands.clean import Clean
 from edi.lib.lxchelpers import lxc_exec
+from edi.lib.playbookrunner import PlaybookRunner
+from edi.lib.sharedfoldercoordinator import SharedFolderCoordinator
 import edi
 import yaml
 import re
@@ -155,3 +158,39 @@ def test_build_stretch_container(capsys, datadir):
 
         delete_command = [lxc_exec(), 'delete', container_name]
         run(delete_command)
+
+
+def test_configure_waits_for_network(tmpdir, fake_lxd, monkeypatch):
+    tmpdir.join('plugins', 'playbooks', 'foo').ensure(dir=True).join('main.yml').write('- hosts: all\n')
+    config_file = tmpdir.join('configure-test.yml')
+    config_file.write('playbooks:\n    10_foo:\n        path: playbooks/foo/main.yml\n')
+    steps = []
+
+    def launch(_, container_name, config_file):
+        steps.append('launch')
+        nic = {'eth0': {'type': 'nic', 'nictype': 'bridged', 'parent': 'lxdbr0'}}
+        fake_lxd.containers[container_name] = {'name': container_name, 'status': 'Running',
+                                               'profiles': ['default'], 'expanded_devices': nic}
+        return container_name
+
+    def address_shows_up(name, command):
+        steps.append('network')
+        fake_lxd.containers[name]['network'] = {'eth0': {'addresses': [{'family': 'inet', 'address': '10.0.3.17',
+                                                                        'scope': 'global'}]}}
+        return 0
+
+    def passthrough(*popenargs, **kwargs):
+        return subprocess.run(*popenargs, **kwargs)
+
+    fake_lxd.exec_handler = address_shows_up
+    monkeypatch.setattr(mockablerun, 'run_mockable', passthrough)
+    monkeypatch.setattr(Launch, 'run', launch)
+    monkeypatch.setattr(PlaybookRunner, 'run_all', lambda _: steps.append('playbooks'))
+    monkeypatch.setattr(SharedFolderCoordinator, 'create_host_folders', lambda _: None)
+    monkeypatch.setattr(SharedFolderCoordinator, 'verify_container_mountpoints', lambda _, container_name: None)
+
+    with open(str(config_file), "r") as main_file:
+        assert Configure().run('cname', main_file) == 'cname'
+
+    # the playbooks only get applied once the container got an address
+    assert steps == ['launch', 'network', 'playbooks']
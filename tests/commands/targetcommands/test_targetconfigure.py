@@ -32,7 +32,7 @@ import edi
 
 def test_target_configure(config_files, monkeypatch, capsys):
     def fakerun(*popenargs, **kwargs):
-        if get_command(popenargs) == "ansible-playbook":
+        if get_command(popenargs) in ("ansible-playbook", "ssh"):
             return subprocess.CompletedProcess("fakerun", 0, '')
         else:
             print('Passthrough: {}'.format(get_command(popenargs)))
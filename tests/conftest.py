@@ -23,6 +23,11 @@ import pytest
 from pytest import fixture
 import os
 from edi.lib.helpers import copy_tree, get_user, get_hostname
+from edi.lib.lxchelpers import LxcQueryCache
+from edi.lib.lxdapi import LxdApi
+from edi.lib.shellhelpers import mockablerun
+from tests.libtesting.fakelxd import fake_lxd_server
+from tests.libtesting.contextmanagers.mocked_executable import mocked_executable, mocked_lxd_version_check
 
 
 def pytest_addoption(parser):
@@ -61,6 +66,86 @@ def pytest_collection_modifyitems(config, items):
             item.add_marker(pytest.mark.skip(reason="requires sudo privileges to run"))
 
 
+@fixture(scope='session', autouse=True)
+def cache_dir(tmpdir_factory):
+    '''
+    Keep the persistent edi caches away from the current working directory.
+    '''
+    directory = str(tmpdir_factory.mktemp('edi_cache'))
+    backup = os.environ.get('EDI_CACHE_DIR')
+    os.environ['EDI_CACHE_DIR'] = directory
+    try:
+        yield directory
+    finally:
+        if backup is None:
+            del os.environ['EDI_CACHE_DIR']
+        else:
+            os.environ['EDI_CACHE_DIR'] = backup
+
+
+@fixture(scope='session', autouse=True)
+def volatile_host_facts():
+    '''
+    Probe the (mocked) host facts within each test instead of reusing persisted ones.
+    '''
+    backup = os.environ.get('EDI_HOST_FACTS_TTL')
+    os.environ['EDI_HOST_FACTS_TTL'] = '0'
+    try:
+        yield
+    finally:
+        if backup is None:
+            del os.environ['EDI_HOST_FACTS_TTL']
+        else:
+            os.environ['EDI_HOST_FACTS_TTL'] = backup
+
+
+@fixture(scope='session', autouse=True)
+def lxc_command_line_backend():
+    '''
+    Talk to lxd using the (mockable) lxc command line tool instead of the REST API.
+    '''
+    backup = os.environ.get('EDI_LXD_BACKEND')
+    os.environ['EDI_LXD_BACKEND'] = 'cli'
+    try:
+        yield
+    finally:
+        if backup is None:
+            del os.environ['EDI_LXD_BACKEND']
+        else:
+            os.environ['EDI_LXD_BACKEND'] = backup
+
+
+@fixture(autouse=True)
+def volatile_lxc_queries():
+    '''
+    Do not leak the (mocked) results of lxc queries from one test to another.
+    '''
+    LxcQueryCache(clear_cache=True)
+    yield
+    LxcQueryCache(clear_cache=True)
+
+
+@fixture
+def fake_lxd(tmpdir, monkeypatch):
+    '''
+    Talk to an in memory lxd using the REST API, lxc commands are not expected.
+    '''
+    socket_path = str(tmpdir.join('unix.socket'))
+    with fake_lxd_server(socket_path) as lxd:
+        monkeypatch.setenv('EDI_LXD_BACKEND', 'rest')
+        monkeypatch.setenv('LXD_SOCKET', socket_path)
+
+        def no_lxc_command(*popenargs, **kwargs):
+            assert False, 'Unexpected command {}.'.format(popenargs)
+
+        monkeypatch.setattr(mockablerun, 'run_mockable', no_lxc_command)
+        LxdApi(clear_cache=True)
+        with mocked_executable('lxc', '/here/is/no/lxc'):
+            with mocked_lxd_version_check():
+                yield lxd
+        LxdApi(clear_cache=True)
+
+
 @fixture
 def datadir(tmpdir, request):
     '''
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from edi.lib import cachehelpers
+from edi.lib.cachehelpers import get_content_hash, load_cache_entry, store_cache_entry
+
+
+def test_content_hash():
+    assert get_content_hash('a', 'b') == get_content_hash('a', 'b')
+    assert get_content_hash('a', 'b') != get_content_hash('b', 'a')
+    assert get_content_hash('ab', '') != get_content_hash('a', 'b')
+
+
+def test_store_and_load(monkeypatch, tmpdir):
+    monkeypatch.setenv('EDI_CACHE_DIR', str(tmpdir))
+    key = get_content_hash('bingo')
+    assert load_cache_entry('test', key) is None
+    data = {'foo': [1, 2, 3], 'bar': {'baz': None}}
+    store_cache_entry('test', key, data)
+    assert load_cache_entry('test', key) == data
+
+    with open(os.path.join(str(tmpdir), 'test', '{}.yml'.format(key)), mode='w') as f:
+        f.write('{[invalid')
+    assert load_cache_entry('test', key) is None
+
+
+def test_prune(monkeypatch, tmpdir):
+    monkeypatch.setenv('EDI_CACHE_DIR', str(tmpdir))
+    monkeypatch.setattr(cachehelpers, '_max_entries_per_namespace', 3)
+    for i in range(5):
+        store_cache_entry('test', get_content_hash(i), i)
+    assert len(os.listdir(os.path.join(str(tmpdir), 'test'))) == 3
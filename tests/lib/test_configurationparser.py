@@ -19,10 +19,14 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import pytest
+from collections import OrderedDict
+from contextlib import contextmanager
 from edi.lib.helpers import FatalError
 from aptsources.sourceslist import SourceEntry
 from edi.lib.configurationparser import ConfigurationParser, command_context
+from edi.lib.hostfacts import HostFacts
 
 
 def test_project_name(config_files, config_name):
@@ -36,6 +40,8 @@ def test_global_configuration_overlay(config_files):
         parser = ConfigurationParser(main_file)
         assert parser.get_compression() == "gz"
         assert parser.get_lxc_stop_timeout() == 130
+        assert parser.get_lxc_stop_hang_timeout() is None
+        assert not parser.get_lxc_publish_snapshot()
 
 
 def test_general_parameters(config_files):
@@ -159,3 +165,149 @@ def test_config_nodes_absence(empty_config_file):
         with pytest.raises(FatalError) as error:
             parser.get_bootstrap_architecture()
         assert "architecture" in error.value.message
+
+
+@contextmanager
+def clear_configurations():
+    backup = ConfigurationParser._configurations
+    try:
+        ConfigurationParser._configurations = OrderedDict()
+        yield
+    finally:
+        ConfigurationParser._configurations = backup
+
+
+def fail_merge(*_):
+    assert False, "The merged configuration should have been loaded from the cache."
+
+
+def test_persistent_configuration_cache(config_files, monkeypatch):
+    with clear_configurations():
+        with open(config_files, "r") as main_file:
+            cold_parser = ConfigurationParser(main_file)
+            cold_config = cold_parser.get_config()
+
+    with monkeypatch.context() as m:
+        m.setattr(ConfigurationParser, '_merge_configurations', fail_merge)
+        with clear_configurations():
+            with open(config_files, "r") as main_file:
+                warm_parser = ConfigurationParser(main_file)
+                assert warm_parser.get_config() == cold_config
+                playbooks = warm_parser.get_ordered_path_items("playbooks")
+                assert playbooks[1][1].endswith("playbooks/foo.yml")
+
+    global_overlay = os.path.join(os.path.dirname(config_files), "configuration", "overlay", "sample.global.yml")
+    with open(global_overlay, "a") as overlay:
+        overlay.write("\nqemu:\n    package: qemu-changed\n")
+
+    with clear_configurations():
+        with open(config_files, "r") as main_file:
+            parser = ConfigurationParser(main_file)
+            assert parser.get_qemu_package_name() == "qemu-changed"
+
+
+def test_no_configuration_cache_without_artifact_dir(config_files, tmpdir, monkeypatch):
+    workdir = tmpdir.mkdir('workdir')
+    monkeypatch.delenv('EDI_CACHE_DIR')
+    monkeypatch.chdir(str(workdir))
+    with clear_configurations():
+        with open(config_files, "r") as main_file:
+            assert ConfigurationParser(main_file).get_qemu_package_name() == "qemu-user-static"
+
+    assert workdir.listdir() == []
+
+
+def test_lazy_load_time_dictionary(config_files):
+    with clear_configurations():
+        HostFacts(clear_cache=True)
+        with open(config_files, "r") as main_file:
+            parser = ConfigurationParser(main_file)
+            name, content, node_dict = parser.get_ordered_raw_items('shared_folders')[0]
+            assert node_dict.get('edi_current_user_host_home_directory')
+            assert 'edi_lxd_version' in node_dict
+            assert not node_dict.is_evaluated('edi_lxd_version')
+            assert 'edi_lxd_version' not in HostFacts._facts
+
+            load_time_dictionary = dict(parser.get_load_time_dictionary())
+            assert load_time_dictionary.get('edi_lxd_version')
+            assert 'edi_lxd_version' in HostFacts._facts
+
+
+def test_registry_keeps_configurations_apart(tmpdir):
+    config_files = []
+    for project, package in [('first', 'qemu-first'), ('second', 'qemu-second')]:
+        directory = tmpdir.mkdir(project)
+        config_file = str(directory.join('sample.yml'))
+        with open(config_file, "w") as file:
+            file.write("qemu:\n    package: {}\n".format(package))
+        config_files.append(config_file)
+
+    with clear_configurations():
+        with open(config_files[0], "r") as first_file, open(config_files[1], "r") as second_file:
+            assert ConfigurationParser(first_file).get_qemu_package_name() == 'qemu-first'
+            assert ConfigurationParser(second_file).get_qemu_package_name() == 'qemu-second'
+            assert ConfigurationParser(first_file).get_qemu_package_name() == 'qemu-first'
+            assert len(ConfigurationParser._configurations) == 2
+
+
+def test_registry_is_context_aware(tmpdir):
+    config_file = str(tmpdir.join('sample.yml'))
+    with open(config_file, "w") as file:
+        file.write("qemu:\n"
+                   "    package: {% if edi_create_distributable_image %}qemu-di{% else %}qemu-dev{% endif %}\n")
+
+    with clear_configurations():
+        with open(config_file, "r") as main_file:
+            assert ConfigurationParser(main_file).get_qemu_package_name() == 'qemu-dev'
+            with command_context({'edi_create_distributable_image': True}):
+                assert ConfigurationParser(main_file).get_qemu_package_name() == 'qemu-di'
+            assert ConfigurationParser(main_file).get_qemu_package_name() == 'qemu-dev'
+            assert len(ConfigurationParser._configurations) == 2
+
+
+def test_registry_eviction(tmpdir, monkeypatch):
+    monkeypatch.setattr(ConfigurationParser, '_max_configurations', 2)
+    with clear_configurations():
+        parsers = []
+        for index in range(3):
+            config_file = str(tmpdir.join('config{}.yml'.format(index)))
+            with open(config_file, "w") as file:
+                file.write("qemu:\n    package: qemu-{}\n".format(index))
+            with open(config_file, "r") as main_file:
+                parsers.append(ConfigurationParser(main_file))
+
+        assert len(ConfigurationParser._configurations) == 2
+        assert [parser.get_qemu_package_name() for parser in parsers] == ['qemu-0', 'qemu-1', 'qemu-2']
+
+
+def test_plugin_plan_gets_shared(config_files):
+    with open(config_files, "r") as main_file:
+        parser = ConfigurationParser(main_file)
+        plan = parser.get_plugin_plan("playbooks")
+        assert ConfigurationParser(main_file).get_plugin_plan("playbooks") is plan
+
+        first_items = parser.get_ordered_path_items("playbooks")
+        first_items[0][2]['edi_shared_folder_mountpoints'] = ['/foo']
+        assert 'edi_shared_folder_mountpoints' not in parser.get_ordered_path_items("playbooks")[0][2]
+
+        with command_context({'edi_create_distributable_image': True}):
+            assert ConfigurationParser(main_file).get_plugin_plan("playbooks") is not plan
+
+
+def test_plugin_plan_invalidation(config_files):
+    with open(config_files, "r") as main_file:
+        parser = ConfigurationParser(main_file)
+        plan = parser.get_plugin_plan("documentation_steps")
+        rendered_steps = plan.get_rendered_plugins()
+        assert rendered_steps[0][0] == 't1'
+        assert parser.get_plugin_plan("documentation_steps") is plan
+
+        first_step = rendered_steps[0][2]
+        with open(first_step, "a") as step_file:
+            step_file.write(" modified")
+        os.utime(first_step, ns=(0, 0))
+
+        assert not plan.is_valid()
+        new_plan = parser.get_plugin_plan("documentation_steps")
+        assert new_plan is not plan
+        assert new_plan.get_rendered_plugins()[0][0] == 't1 modified'
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from edi.lib.lazydictionary import LazyDictionary
+from edi.lib.jinja2helpers import (Jinja2Environments, get_referenced_variables, render_template,
+                                   render_template_file)
+
+
+def expensive():
+    raise AssertionError("The expensive value should not get evaluated.")
+
+
+def test_render_template():
+    source = "{{ cheap }} {% for item in items %}{{ item }}{% endfor %}{% set local = 1 %}{{ local }}"
+    assert get_referenced_variables(source) == {'cheap', 'items'}
+    lazy = LazyDictionary(getters={'cheap': lambda: 'cheap', 'expensive': expensive}, values={'items': [1, 2]})
+    assert render_template(source, lazy) == "cheap 121"
+
+
+def test_compiled_template_gets_reused(monkeypatch):
+    Jinja2Environments(clear_cache=True)
+    source = "{% for item in items %}\n{{ item }}\n{% endfor %}\n"
+    first, _ = Jinja2Environments.get_template(source)
+    second, _ = Jinja2Environments.get_template(source)
+    assert first is second
+
+    trimmed, _ = Jinja2Environments.get_template(source, trim_blocks=True)
+    assert trimmed is not first
+    assert trimmed.render(items=[1, 2]) == "1\n2\n"
+    assert first.render(items=[1, 2]) == "\n1\n\n2\n"
+
+
+def test_bytecode_cache(cache_dir):
+    Jinja2Environments(clear_cache=True)
+    source = "{{ bytecode }} cache test"
+    assert render_template(source, {'bytecode': 'persistent'}) == "persistent cache test"
+    bytecode_files = os.listdir(os.path.join(cache_dir, 'jinja2'))
+    assert bytecode_files
+
+    Jinja2Environments(clear_cache=True)
+    assert render_template(source, {'bytecode': 'cached'}) == "cached cache test"
+    assert sorted(os.listdir(os.path.join(cache_dir, 'jinja2'))) == sorted(bytecode_files)
+
+
+def test_no_bytecode_cache_without_artifact_dir(tmpdir, monkeypatch):
+    Jinja2Environments(clear_cache=True)
+    monkeypatch.delenv('EDI_CACHE_DIR')
+    monkeypatch.chdir(str(tmpdir))
+    assert render_template("{{ foo }}", {'foo': 'bar'}) == "bar"
+    assert os.listdir(str(tmpdir)) == []
+
+    tmpdir.mkdir('artifacts')
+    Jinja2Environments(clear_cache=True)
+    assert render_template("{{ foo }}", {'foo': 'baz'}) == "baz"
+    assert os.listdir(str(tmpdir.join('artifacts', '.cache'))) == ['jinja2']
+    Jinja2Environments(clear_cache=True)
+
+
+def test_render_template_file(tmpdir):
+    template_file = os.path.join(str(tmpdir), 'template.j2')
+    with open(template_file, mode='w') as f:
+        f.write("{% if value %}\n  {{ value }}\n{% endif %}\n")
+
+    assert render_template_file(template_file, {'value': 'foo'}) == "\n  foo\n"
+    assert render_template_file(template_file, {'value': 'foo'}, trim_blocks=True, lstrip_blocks=True) == "  foo\n"
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import yaml
+import pytest
+from edi.lib.lazydictionary import LazyDictionary
+import edi.lib.yamlhelpers  # noqa: ignore=F401
+
+
+def expensive():
+    raise AssertionError("The expensive value should not get evaluated.")
+
+
+def test_lazy_dictionary():
+    calls = []
+
+    def cheap():
+        calls.append(1)
+        return 'cheap'
+
+    lazy = LazyDictionary(getters={'cheap': cheap, 'expensive': expensive}, values={'plain': 42})
+    assert len(lazy) == 3
+    assert 'expensive' in lazy
+    assert lazy['cheap'] == 'cheap'
+    assert lazy.get('cheap') == 'cheap'
+    assert len(calls) == 1
+    assert lazy.is_evaluated('cheap')
+    assert not lazy.is_evaluated('expensive')
+
+    lazy['expensive'] = 'overwritten'
+    assert dict(lazy) == {'cheap': 'cheap', 'expensive': 'overwritten', 'plain': 42}
+
+    del lazy['plain']
+    with pytest.raises(KeyError):
+        lazy['plain']
+
+
+def test_lazy_dictionary_copy():
+    lazy = LazyDictionary(getters={'expensive': expensive}, values={'plain': 42})
+    lazy_copy = lazy.copy()
+    lazy_copy['plain'] = 43
+    lazy_copy.update({'new': 1})
+    assert lazy['plain'] == 42
+    assert 'new' not in lazy
+    assert 'expensive' in lazy_copy
+
+
+def test_lazy_dictionary_yaml():
+    lazy = LazyDictionary(getters={'foo': lambda: 'bar'}, values={'baz': [1, 2]})
+    assert yaml.safe_load(yaml.dump(lazy)) == {'foo': 'bar', 'baz': [1, 2]}
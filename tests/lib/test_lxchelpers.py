@@ -20,15 +20,22 @@
 # along with edi.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import json
+import time
 import subprocess
 import pytest
 from subprocess import CalledProcessError
 from contextlib import contextmanager
 from edi.lib.helpers import FatalError
 from edi.lib.lxchelpers import (get_server_image_compression_algorithm,
-                                get_file_extension_from_image_compression_algorithm, lxc_exec,
-                                get_lxd_version, LxdVersion, is_bridge_available, create_bridge)
-from edi.lib.shellhelpers import mockablerun, run
+                                get_file_extension_from_image_compression_algorithm,
+                                get_lxd_version, LxdVersion, is_bridge_available, create_bridge,
+                                delete_bridge, LxcQueryCache, is_container_running, start_container,
+                                is_container_existing, is_in_image_store, LxdInventory,
+                                reconcile_lxc_profiles, LxdEventMonitor, is_lifecycle_event, stop_container,
+                                publish_container, delete_container_in_background)
+from edi.lib import lxchelpers
+from edi.lib.shellhelpers import mockablerun
 from tests.libtesting.helpers import get_command, get_sub_command
 from tests.libtesting.contextmanagers.mocked_executable import mocked_executable, mocked_lxd_version_check
 
@@ -134,6 +141,288 @@ def test_is_bridge_available():
     with pytest.raises(CalledProcessError) as e:
         create_bridge(bridge_name)
     assert 'non-zero exit status' in str(e)
-    cmd = [lxc_exec(), "network", "delete", bridge_name]
-    run(cmd)
+    delete_bridge(bridge_name)
     assert not is_bridge_available(bridge_name)
+
+
+def test_lxc_query_cache(monkeypatch):
+    with mocked_executable('lxc', '/here/is/no/lxc'):
+        with mocked_lxd_version_check():
+            calls = []
+            status = ['Stopped']
+
+            def fake_lxc_command(*popenargs, **kwargs):
+                calls.append(get_sub_command(popenargs))
+                if get_sub_command(popenargs) == 'list':
+                    return subprocess.CompletedProcess("fakerun", 0,
+                                                       stdout='[{{"name": "foo", "status": "{}"}}]'.format(status[0]))
+                elif get_sub_command(popenargs) == 'image':
+                    return subprocess.CompletedProcess("fakerun", 0, stdout='[]')
+                elif get_sub_command(popenargs) == 'start':
+                    status[0] = 'Running'
+                    return subprocess.CompletedProcess("fakerun", 0)
+                else:
+                    return subprocess.run(*popenargs, **kwargs)
+
+            monkeypatch.setattr(mockablerun, 'run_mockable', fake_lxc_command)
+            assert not is_container_running('foo')
+            assert is_container_existing('foo')
+            assert not is_in_image_store('foo')
+            assert calls == ['list', 'image']
+            start_container('foo')
+            assert is_container_running('foo')
+            assert calls == ['list', 'image', 'start', 'list', 'image']
+            LxcQueryCache(clear_cache=True)
+            assert is_container_running('foo')
+            assert calls == ['list', 'image', 'start', 'list', 'image', 'list', 'image']
+
+
+def test_lxc_query_cache_concurrent_modification():
+    LxcQueryCache(clear_cache=True)
+    results = iter(['before', 'after'])
+
+    def query_during_modification():
+        result = next(results)
+        # e.g. a container that gets deleted in the background
+        LxcQueryCache.invalidate()
+        return result
+
+    assert LxcQueryCache.get(('foo',), query_during_modification) == 'before'
+    # the overlapping result did not get cached
+    assert LxcQueryCache.get(('foo',), lambda: next(results)) == 'after'
+    assert LxcQueryCache.get(('foo',), lambda: next(results)) == 'after'
+
+
+def test_lxd_inventory():
+    containers = [{'name': 'foo', 'status': 'Running', 'profiles': ['default', 'bar']},
+                  {'name': 'baz', 'status': 'Stopped', 'profiles': None}]
+    images = [{'fingerprint': 'abc123', 'aliases': [{'name': 'base'}]},
+              {'fingerprint': 'abd456', 'aliases': []}]
+    inventory = LxdInventory(containers, images)
+    assert inventory.has_container('foo')
+    assert not inventory.has_container('bar')
+    assert inventory.get_container_status('foo') == 'Running'
+    assert inventory.get_container_status('bar') is None
+    assert inventory.get_container_profiles('foo') == ['default', 'bar']
+    assert inventory.get_container_profiles('baz') == []
+    with pytest.raises(FatalError):
+        inventory.get_container_profiles('bar')
+    assert inventory.get_image_fingerprint('base') == 'abc123'
+    assert inventory.get_image_fingerprint('abd') == 'abd456'
+    assert inventory.get_image_fingerprint('ab') is None
+    assert inventory.get_image_fingerprint('other') is None
+
+
+def test_reconcile_lxc_profiles(monkeypatch):
+    with mocked_executable('lxc', '/here/is/no/lxc'):
+        with mocked_lxd_version_check():
+            profile_text = 'name: foo\nconfig: {}\n'
+            profiles = [{"name": "default", "used_by": ["/1.0/containers/foo"]},
+                        {"name": "old_0123456789abcdef0123", "used_by": []},
+                        {"name": "used_0123456789abcdef0123", "used_by": ["/1.0/containers/foo"]},
+                        {"name": "manual", "used_by": []}]
+            commands = []
+
+            def fake_lxc_query(*popenargs, **kwargs):
+                assert get_sub_command(popenargs) == 'query'
+                return subprocess.CompletedProcess("fakerun", 0, stdout=json.dumps(profiles))
+
+            async def fake_lxc_profile_command(popenargs, **kwargs):
+                commands.append(popenargs[-3:] if popenargs[-2:-1] == ['edit'] else popenargs[-2:])
+                if popenargs[-2] == 'create':
+                    profiles.append({"name": popenargs[-1], "used_by": []})
+                return subprocess.CompletedProcess("fakerun", 0)
+
+            monkeypatch.setattr(mockablerun, 'run_mockable', fake_lxc_query)
+            monkeypatch.setattr(mockablerun, 'run_mockable_async', fake_lxc_profile_command)
+
+            result = reconcile_lxc_profiles([profile_text])
+            name, new_profile = result[0]
+            assert name.startswith('foo_')
+            assert new_profile
+            assert commands == [['create', name], ['profile', 'edit', name]]
+
+            commands.clear()
+            LxcQueryCache(clear_cache=True)
+            assert reconcile_lxc_profiles([profile_text], remove_unused=True) == [(name, False)]
+            assert commands == [['delete', 'old_0123456789abcdef0123']]
+
+
+fake_lxc_profiles = '''#!/bin/sh
+if [ "$1" = "query" ]; then
+    echo '[{"name": "default", "used_by": []}, {"name": "old_0123456789abcdef0123", "used_by": []}]'
+    exit 0
+fi
+echo "$@" >> {log}
+if [ "$2" = "edit" ]; then
+    cat > {log}.$3
+fi
+'''
+
+
+def test_reconcile_lxc_profiles_with_processes(tmpdir):
+    # the profiles get created and removed by real (concurrent) child processes
+    log = str(tmpdir.join('log'))
+    fake_lxc = tmpdir.join('lxc')
+    fake_lxc.write(fake_lxc_profiles.replace('{log}', log))
+    fake_lxc.chmod(0o755)
+
+    with mocked_executable('lxc', str(fake_lxc)):
+        with mocked_lxd_version_check():
+            result = reconcile_lxc_profiles(['name: foo\nconfig: {}\n', 'name: bar\nconfig: {}\n'],
+                                            remove_unused=True)
+
+    names = [name for name, new_profile in result if new_profile]
+    assert len(names) == 2
+    with open(log) as log_file:
+        commands = sorted(log_file.read().splitlines())
+    assert commands == sorted(['profile create {}'.format(name) for name in names] +
+                              ['profile edit {}'.format(name) for name in names] +
+                              ['profile delete old_0123456789abcdef0123'])
+    with open('{}.{}'.format(log, names[0])) as profile_file:
+        assert 'name: {}'.format(names[0]) in profile_file.read()
+
+
+fake_lxc_monitor = '''#!/bin/sh
+cat <<EOF
+location: none
+metadata:
+  action: container-shutdown
+  source: /1.0/containers/foo
+timestamp: "2020-01-01T00:00:00Z"
+type: lifecycle
+
+{"type": "lifecycle", "metadata": {"action": "instance-stopped", "source": "/1.0/instances/bar?project=default"}}
+location: none
+metadata:
+  action: container-stopped
+  source: /1.0/containers/foo
+type: lifecycle
+
+EOF
+exec sleep 10
+'''
+
+
+def test_lxd_event_monitor(tmpdir, monkeypatch):
+    fake_lxc = tmpdir.join('lxc')
+    fake_lxc.write(fake_lxc_monitor)
+    fake_lxc.chmod(0o755)
+    commands = []
+    popen_mockable = mockablerun.popen_mockable
+
+    def intercept_popen(*popenargs, **kwargs):
+        commands.append(popenargs[0])
+        return popen_mockable(*popenargs, **kwargs)
+
+    monkeypatch.setattr(mockablerun, 'popen_mockable', intercept_popen)
+    with mocked_executable('lxc', str(fake_lxc)):
+        with LxdEventMonitor() as monitor:
+            assert monitor.wait(lambda event: is_lifecycle_event(event, 'bar', ('stopped',)), timeout=5)
+            assert monitor.wait(lambda event: is_lifecycle_event(event, 'foo', ('stopped',)), timeout=5)
+            assert not monitor.wait(lambda event: True, timeout=0.1)
+
+    assert [command[-3:] for command in commands] == [[str(fake_lxc), 'monitor', '--type=lifecycle']]
+
+    # without lxc the monitor just waits
+    with mocked_executable('lxc', '/here/is/no/lxc'):
+        with LxdEventMonitor() as monitor:
+            assert not monitor.wait(lambda event: True, timeout=0.1)
+
+
+def test_stop_hung_container(monkeypatch):
+    monkeypatch.setattr(lxchelpers, '_state_poll_interval', 0.05)
+    container = {'status': 'Running', 'processes': 12}
+    commands = []
+
+    def fake_lxc_command(*popenargs, **kwargs):
+        if get_command(popenargs).endswith('lxc') and get_sub_command(popenargs) == 'query':
+            return subprocess.CompletedProcess("fakerun", 0, stdout=json.dumps(container))
+        elif get_command(popenargs).endswith('lxc') and get_sub_command(popenargs) == 'stop':
+            commands.append(popenargs[0][2:])
+            if '-f' in popenargs[0]:
+                container['status'] = 'Stopped'
+            return subprocess.CompletedProcess("fakerun", 0, stdout='', stderr='')
+        else:
+            return subprocess.run(*popenargs, **kwargs)
+
+    monkeypatch.setattr(mockablerun, 'run_mockable', fake_lxc_command)
+    with mocked_executable('lxc', '/here/is/no/lxc'):
+        with mocked_lxd_version_check():
+            # the number of processes does not change: the shutdown hangs
+            stop_container('foo', timeout=60, hang_timeout=0.2)
+            assert container['status'] == 'Stopped'
+            assert sorted(commands) == [['-f', 'foo'], ['foo', '--timeout', '60']]
+
+
+def test_publish_snapshot(monkeypatch):
+    commands = []
+
+    def fake_lxc_command(*popenargs, **kwargs):
+        if get_command(popenargs).endswith('lxc'):
+            commands.append(popenargs[0][1:])
+            returncode = 1 if get_sub_command(popenargs) == 'delete' else 0
+            return subprocess.CompletedProcess("fakerun", returncode, stdout='', stderr='not found')
+        else:
+            return subprocess.run(*popenargs, **kwargs)
+
+    monkeypatch.setattr(mockablerun, 'run_mockable', fake_lxc_command)
+    with mocked_executable('lxc', '/here/is/no/lxc'):
+        with mocked_lxd_version_check():
+            publish_container('foo', 'foo-image', snapshot='edi-publish')
+            # a failing deletion does not raise within the background thread
+            delete_container_in_background('foo').join()
+
+    assert commands == [['publish', 'foo/edi-publish', '--alias', 'foo-image'],
+                        ['delete', '--force', 'foo']]
+
+
+def test_stop_container_respects_timeout(monkeypatch):
+    monkeypatch.setattr(lxchelpers, '_state_poll_interval', 0.05)
+    container = {'status': 'Running', 'processes': 12}
+    commands = []
+
+    def fake_lxc_command(*popenargs, **kwargs):
+        if get_command(popenargs).endswith('lxc') and get_sub_command(popenargs) == 'query':
+            return subprocess.CompletedProcess("fakerun", 0, stdout=json.dumps(container))
+        elif get_command(popenargs).endswith('lxc') and get_sub_command(popenargs) == 'stop':
+            commands.append(popenargs[0][2:])
+            if '-f' in popenargs[0]:
+                container['status'] = 'Stopped'
+            return subprocess.CompletedProcess("fakerun", 0, stdout='', stderr='')
+        else:
+            return subprocess.run(*popenargs, **kwargs)
+
+    monkeypatch.setattr(mockablerun, 'run_mockable', fake_lxc_command)
+    with mocked_executable('lxc', '/here/is/no/lxc'):
+        with mocked_lxd_version_check():
+            # without a hang timeout a slow shutdown does not get forced before the timeout expires
+            start = time.monotonic()
+            stop_container('foo', timeout=1)
+            assert time.monotonic() - start >= 1
+            assert ['-f', 'foo'] in commands
+
+
+fake_lxc_stop = '''#!/bin/sh
+case "$1" in
+    monitor)
+        sleep 0.5
+        printf '{"type": "lifecycle", "metadata": {"action": "instance-stopped", "source": "/1.0/instances/foo"}}\\n'
+        exec sleep 10;;
+    query)
+        echo '{"status": "Running", "processes": 12}';;
+esac
+'''
+
+
+def test_stop_container_by_event(tmpdir):
+    fake_lxc = tmpdir.join('lxc')
+    fake_lxc.write(fake_lxc_stop)
+    fake_lxc.chmod(0o755)
+
+    with mocked_executable('lxc', str(fake_lxc)):
+        with mocked_lxd_version_check():
+            # the lifecycle event reports the stop long before the next check of the container state
+            start = time.monotonic()
+            stop_container('foo', timeout=60)
+            assert time.monotonic() - start < lxchelpers._stop_check_interval
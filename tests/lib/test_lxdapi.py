@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from edi.lib.helpers import FatalError
+from edi.lib.lxdapi import LxdApi, LxdApiError
+from edi.lib.lxchelpers import (is_in_image_store, delete_image, is_container_existing, is_container_running,
+                                launch_container, stop_container, delete_container, start_container,
+                                apply_profiles, get_container_profiles, is_bridge_available, create_bridge,
+                                delete_bridge, write_lxc_profile, is_profile_existing,
+                                get_server_image_compression_algorithm, LxcQueryCache,
+                                reconcile_lxc_profiles, get_container_snapshots, create_container_snapshot,
+                                restore_container_snapshot, delete_container_snapshot, wait_for_container_network,
+                                sync_container, delete_container_in_background, LxdEventMonitor,
+                                is_lifecycle_event)
+from edi.lib import lxchelpers
+
+
+def test_container_lifecycle(fake_lxd):
+    fake_lxd.add_image('base')
+    assert not is_container_existing('foo')
+    assert not is_container_running('foo')
+
+    launch_container('base', 'foo', ['default', 'bar'])
+    assert is_container_existing('foo')
+    assert is_container_running('foo')
+    assert get_container_profiles('foo') == ['default', 'bar']
+
+    apply_profiles('foo', ['default'])
+    assert get_container_profiles('foo') == ['default']
+
+    stop_container('foo')
+    assert not is_container_running('foo')
+    start_container('foo')
+    assert is_container_running('foo')
+    fake_lxd.stuck_containers.add('foo')
+    stop_container('foo', timeout=1)
+    assert not is_container_running('foo')
+
+    delete_container('foo')
+    assert not is_container_existing('foo')
+
+    # all requests went through a single connection (the stops follow the lifecycle events)
+    assert fake_lxd.event_streams == 2
+    assert fake_lxd.connections == 1 + fake_lxd.event_streams
+
+
+def test_launch_failure(fake_lxd):
+    with pytest.raises(FatalError) as error:
+        launch_container('missing', 'foo', ['default'])
+    assert "Launching image 'missing' failed" in error.value.message
+
+
+def test_running_container_can_not_be_deleted(fake_lxd):
+    fake_lxd.add_image('base')
+    launch_container('base', 'foo', ['default'])
+    with pytest.raises(LxdApiError) as error:
+        delete_container('foo')
+    assert 'stop it first' in error.value.message
+
+
+def test_images(fake_lxd):
+    fingerprint = fake_lxd.add_image('base')
+    assert is_in_image_store('base')
+    assert is_in_image_store(fingerprint)
+    assert not is_in_image_store('other')
+    delete_image('base')
+    assert not is_in_image_store('base')
+    assert not is_in_image_store(fingerprint)
+
+
+def test_bridges_and_profiles(fake_lxd):
+    assert is_bridge_available('lxdbr0')
+    assert not is_bridge_available('edibr0')
+    create_bridge('edibr0')
+    assert is_bridge_available('edibr0')
+    with pytest.raises(LxdApiError) as error:
+        create_bridge('edibr0')
+    assert error.value.status_code == 409
+    delete_bridge('edibr0')
+    assert not is_bridge_available('edibr0')
+
+    profile_text = 'name: foo\nconfig:\n  security.privileged: "true"\ndevices: {}\n'
+    name, new_profile = write_lxc_profile(profile_text)
+    assert name.startswith('foo_')
+    assert new_profile
+    assert is_profile_existing(name)
+    assert fake_lxd.profiles[name]['config'] == {'security.privileged': 'true'}
+    assert write_lxc_profile(profile_text) == (name, False)
+
+
+def test_reconcile_profiles(fake_lxd):
+    fake_lxd.add_image('base')
+    first = 'name: first\nconfig: {}\ndevices: {}\n'
+    second = 'name: second\nconfig: {}\ndevices: {}\n'
+    result = reconcile_lxc_profiles([first, second])
+    assert [new_profile for _, new_profile in result] == [True, True]
+    first_name, second_name = [name for name, _ in result]
+    launch_container('base', 'foo', ['default', first_name])
+
+    profile_requests = len(fake_lxd.requests)
+    assert reconcile_lxc_profiles([first, second]) == [(first_name, False), (second_name, False)]
+    assert len(fake_lxd.requests) == profile_requests + 1
+
+    third = 'name: third\nconfig: {}\ndevices: {}\n'
+    result = reconcile_lxc_profiles([third], remove_unused=True)
+    third_name = result[0][0]
+    assert sorted(fake_lxd.profiles) == sorted(['default', first_name, third_name])
+
+
+def test_server_image_compression_algorithm(fake_lxd):
+    assert get_server_image_compression_algorithm() == 'gzip'
+    fake_lxd.config['images.compression_algorithm'] = 'xz'
+    LxcQueryCache(clear_cache=True)
+    assert get_server_image_compression_algorithm() == 'xz'
+
+
+def test_backend_selection(monkeypatch, tmpdir):
+    monkeypatch.setenv('EDI_LXD_BACKEND', 'cli')
+    LxdApi(clear_cache=True)
+    assert LxdApi.get() is None
+
+    monkeypatch.setenv('EDI_LXD_BACKEND', 'rest')
+    monkeypatch.setenv('LXD_SOCKET', str(tmpdir.join('missing.socket')))
+    monkeypatch.setattr(LxdApi, 'get_socket_candidates',
+                        staticmethod(lambda: [str(tmpdir.join('missing.socket'))]))
+    LxdApi(clear_cache=True)
+    with pytest.raises(FatalError):
+        LxdApi.get()
+
+    monkeypatch.setenv('EDI_LXD_BACKEND', 'auto')
+    LxdApi(clear_cache=True)
+    assert LxdApi.get() is None
+
+    monkeypatch.setenv('EDI_LXD_BACKEND', 'bogus')
+    LxdApi(clear_cache=True)
+    with pytest.raises(FatalError):
+        LxdApi.get()
+    LxdApi(clear_cache=True)
+
+
+def test_container_snapshots(fake_lxd):
+    fake_lxd.add_image('base')
+    launch_container('base', 'foo', ['default'])
+    assert get_container_snapshots('foo') == []
+
+    create_container_snapshot('foo', 'first')
+    create_container_snapshot('foo', 'second')
+    assert get_container_snapshots('foo') == ['first', 'second']
+
+    restore_container_snapshot('foo', 'first')
+    assert fake_lxd.restored_snapshots == [('foo', 'first')]
+
+    delete_container_snapshot('foo', 'first')
+    assert get_container_snapshots('foo') == ['second']
+
+
+def test_stop_hung_container(fake_lxd, monkeypatch):
+    monkeypatch.setattr(lxchelpers, '_state_poll_interval', 0.05)
+    fake_lxd.add_image('base')
+    launch_container('base', 'foo', ['default'])
+    fake_lxd.stuck_containers.add('foo')
+    stop_container('foo', timeout=60, hang_timeout=0.2)
+    assert not is_container_running('foo')
+    assert fake_lxd.requests.count(('PUT', '/1.0/containers/foo/state')) == 3
+
+
+def test_lxd_event_monitor(fake_lxd):
+    with LxdEventMonitor() as monitor:
+        assert monitor.is_monitoring()
+        fake_lxd.emit_lifecycle_event('bar', 'started')
+        fake_lxd.emit_lifecycle_event('foo', 'stopped')
+        assert monitor.wait(lambda event: is_lifecycle_event(event, 'foo', ('stopped',)), timeout=5)
+        assert not monitor.wait(lambda event: True, timeout=0.1)
+
+    assert ('GET', '/1.0/events?type=lifecycle') in fake_lxd.requests
+
+
+def test_wait_for_container_network(fake_lxd, monkeypatch):
+    monkeypatch.setattr(lxchelpers, '_state_poll_interval', 0.05)
+
+    nic = {'eth0': {'type': 'nic', 'nictype': 'bridged', 'parent': 'lxdbr0'}}
+    loopback = {'addresses': [{'family': 'inet', 'address': '127.0.0.1', 'scope': 'local'}]}
+    fake_lxd.containers['foo'] = {'name': 'foo', 'status': 'Running', 'profiles': ['default'],
+                                  'expanded_devices': nic,
+                                  'network': {'lo': loopback,
+                                              'eth0': {'addresses': [{'family': 'inet6', 'address': 'fe80::1',
+                                                                      'scope': 'link'},
+                                                                     {'family': 'inet', 'address': '10.0.3.17',
+                                                                      'scope': 'global'}]}}}
+    fake_lxd.containers['plain'] = {'name': 'plain', 'status': 'Running', 'profiles': ['default']}
+    assert wait_for_container_network('plain') is None
+    assert wait_for_container_network('foo') == '10.0.3.17'
+    assert not fake_lxd.executed_commands
+
+    # the address does not show up and the container does not report address changes
+    fake_lxd.containers['foo']['network'] = {'lo': loopback}
+    fake_lxd.exec_handler = lambda name, command: 127
+    assert wait_for_container_network('foo', timeout=0.2) is None
+    assert len(fake_lxd.executed_commands) == 1
+    assert fake_lxd.requests.count(('GET', '/1.0/containers/foo/state')) > 3
+
+    # the container reports the address as soon as it shows up
+    def address_shows_up(name, command):
+        assert command[:3] == ['timeout', '10.0', 'sh']
+        fake_lxd.containers[name]['network'] = network
+        return 0
+
+    network = {'lo': loopback, 'eth0': {'addresses': [{'family': 'inet', 'address': '10.0.3.18', 'scope': 'global'}]}}
+    fake_lxd.exec_handler = address_shows_up
+    fake_lxd.requests.clear()
+    assert wait_for_container_network('foo') == '10.0.3.18'
+    assert fake_lxd.requests.count(('GET', '/1.0/containers/foo/state')) == 2
+
+    fake_lxd.containers['foo']['status'] = 'Stopped'
+    with pytest.raises(FatalError):
+        wait_for_container_network('foo')
+
+
+def test_snapshot_and_delete_in_background(fake_lxd):
+    fake_lxd.add_image('base')
+    launch_container('base', 'foo', ['default'])
+    sync_container('foo')
+    assert fake_lxd.executed_commands == [('foo', ['sync'])]
+
+    create_container_snapshot('foo', 'edi-publish')
+    delete_container_in_background('foo').join()
+    assert not is_container_existing('foo')
+    assert ('DELETE', '/1.0/containers/foo') in fake_lxd.requests
@@ -21,9 +21,13 @@
 
 from edi.lib.configurationparser import ConfigurationParser
 from edi.lib.playbookrunner import PlaybookRunner
+from edi.lib.lxchelpers import LxcQueryCache
 from tests.libtesting.helpers import get_command, get_command_parameter
+from tests.libtesting.contextmanagers.mocked_executable import mocked_executable
 from edi.lib import mockablerun
 import shutil
+import logging
+import json
 import subprocess
 from codecs import open
 import yaml
@@ -44,7 +48,9 @@ def verify_extra_vars(file):
         assert mountpoints[0] == '/foo/bar/target_mountpoint'
 
 
-def test_lxd_connection(config_files, monkeypatch):
+def test_lxd_connection(config_files, fake_lxd, monkeypatch):
+    fake_lxd.containers['fake-container'] = {'name': 'fake-container', 'status': 'Running', 'profiles': ['default']}
+
     def fake_ansible_playbook_run(*popenargs, **kwargs):
         if get_command(popenargs) == 'ansible-playbook':
             assert 'lxd' == get_command_parameter(popenargs, '--connection')
@@ -70,3 +76,189 @@ def test_lxd_connection(config_files, monkeypatch):
 
         expected_playbooks = ['10_base_system', '20_networking', '30_foo']
         assert playbooks == expected_playbooks
+
+        ledger = json.loads(fake_lxd.containers['fake-container']['config']['user.edi.playbooks'])
+        assert sorted(ledger) == expected_playbooks
+
+
+def test_playbook_snapshots(config_files, fake_lxd, monkeypatch):
+    fake_lxd.containers['fake-container'] = {'name': 'fake-container', 'status': 'Running', 'profiles': ['default']}
+    monkeypatch.setattr(ConfigurationParser, 'get_lxc_playbook_snapshots', lambda _: 2)
+
+    applied_playbooks = []
+
+    def fake_ansible_playbook_run(*popenargs, **kwargs):
+        if get_command(popenargs) != 'ansible-playbook':
+            return subprocess.run(*popenargs, **kwargs)
+
+        with open(get_command_parameter(popenargs, '--extra-vars').lstrip('@'), encoding='utf-8') as f:
+            applied_playbooks.append(yaml.safe_load(f)['playbook_name'])
+        return subprocess.CompletedProcess("fakerun", 0, '')
+
+    monkeypatch.setattr(mockablerun, 'run_mockable', fake_ansible_playbook_run)
+    monkeypatch.setattr(shutil, 'chown', lambda *_: None)
+
+    # simulate modified playbooks by modifying their extra vars
+    modifications = {}
+    get_playbooks = PlaybookRunner._get_playbooks
+
+    def get_modified_playbooks(self):
+        return [(name, path, dict(extra_vars, playbook_name=name, modification=modifications.get(name, 0)))
+                for name, path, extra_vars in get_playbooks(self)]
+
+    monkeypatch.setattr(PlaybookRunner, '_get_playbooks', get_modified_playbooks)
+
+    def run_all(force=False):
+        del applied_playbooks[:]
+        with open(config_files, "r") as main_file:
+            parser = ConfigurationParser(main_file)
+            runner = PlaybookRunner(parser, "fake-container", "lxd", force=force)
+            with mocked_executable('ansible-playbook'):
+                assert runner.run_all() == applied_playbooks
+        return applied_playbooks
+
+    assert run_all() == ['10_base_system', '20_networking', '30_foo']
+    assert fake_lxd.restored_snapshots == []
+    snapshots = list(fake_lxd.snapshots['fake-container'])
+    # the retention limit applies
+    assert len(snapshots) == 2
+    assert snapshots[0].startswith('edi-01-')
+    assert snapshots[1].startswith('edi-02-')
+
+    # nothing changed: resume after the last playbook
+    assert run_all() == []
+    assert fake_lxd.restored_snapshots[-1] == ('fake-container', snapshots[1])
+
+    # the last playbook changed: resume after the second playbook
+    modifications['30_foo'] = 1
+    assert run_all() == ['30_foo']
+    assert fake_lxd.restored_snapshots[-1] == ('fake-container', snapshots[0])
+    assert len(fake_lxd.snapshots['fake-container']) == 2
+    # the outdated snapshot got pruned
+    assert snapshots[1] not in fake_lxd.snapshots['fake-container']
+    assert snapshots[0] in fake_lxd.snapshots['fake-container']
+
+    # the first playbook changed: no snapshot matches, the ledger skips the unchanged playbooks
+    restored_snapshots = len(fake_lxd.restored_snapshots)
+    modifications['10_base_system'] = 1
+    assert run_all() == ['10_base_system']
+    assert len(fake_lxd.restored_snapshots) == restored_snapshots
+    assert len(fake_lxd.snapshots['fake-container']) == 2
+
+    # force the application of all playbooks
+    restored_snapshots = len(fake_lxd.restored_snapshots)
+    assert run_all(force=True) == ['10_base_system', '20_networking', '30_foo']
+    assert len(fake_lxd.restored_snapshots) == restored_snapshots
+
+    # the snapshots do not match other profiles: restoring them would revert the profiles
+    restored_snapshots = len(fake_lxd.restored_snapshots)
+    fake_lxd.containers['fake-container']['profiles'] = ['default', 'foo_0123456789abcdef0123']
+    LxcQueryCache(clear_cache=True)
+    assert run_all() == []
+    assert len(fake_lxd.restored_snapshots) == restored_snapshots
+    assert run_all() == []
+    assert len(fake_lxd.restored_snapshots) == restored_snapshots + 1
+
+
+def test_no_snapshots_for_ssh(config_files, monkeypatch):
+    monkeypatch.setattr(ConfigurationParser, 'get_lxc_playbook_snapshots', lambda _: 2)
+    with open(config_files, "r") as main_file:
+        parser = ConfigurationParser(main_file)
+        runner = PlaybookRunner(parser, "fake-target", "ssh")
+        assert runner._get_snapshot_names(['foo', 'bar']) is None
+
+
+def test_portable_fingerprints(config_files, monkeypatch):
+    user = {}
+    get_playbooks = PlaybookRunner._get_playbooks
+
+    def get_user_specific_playbooks(self):
+        return [(name, path, dict(extra_vars, **user)) for name, path, extra_vars in get_playbooks(self)]
+
+    monkeypatch.setattr(PlaybookRunner, '_get_playbooks', get_user_specific_playbooks)
+
+    def get_fingerprints(portable):
+        with open(config_files, "r") as main_file:
+            parser = ConfigurationParser(main_file)
+            return PlaybookRunner(parser, "fake-container", "lxd").get_fingerprints(portable=portable)
+
+    fingerprints = get_fingerprints(portable=False)
+    portable_fingerprints = get_fingerprints(portable=True)
+
+    user.update({'edi_project_directory': '/home/john/other_checkout', 'edi_current_display': '1'})
+    assert get_fingerprints(portable=True) == portable_fingerprints
+    assert get_fingerprints(portable=False) != fingerprints
+
+    # the user specific vars get written into the container
+    for key, value in [('edi_current_user_name', 'teammate'), ('edi_current_user_ssh_pub_keys', ['ssh-rsa foo']),
+                       ('edi_shared_folder_mountpoints', ['/home/teammate/edi-workspace'])]:
+        user[key] = value
+        assert get_fingerprints(portable=True) != portable_fingerprints
+        del user[key]
+
+
+def test_playbook_hash(tmpdir):
+    playbook = tmpdir.join('main.yml')
+    playbook.write('- hosts: all\n')
+    role = tmpdir.mkdir('roles').join('foo.yml')
+    role.write('foo')
+
+    playbook_hash = PlaybookRunner._get_playbook_hash(str(playbook))
+    assert playbook_hash == PlaybookRunner._get_playbook_hash(str(playbook))
+    role.write('bar')
+    assert playbook_hash != PlaybookRunner._get_playbook_hash(str(playbook))
+
+
+def test_ssh_ledger(config_files, monkeypatch):
+    remote_files = {}
+    applied_playbooks = []
+
+    def fake_ssh_run(*popenargs, **kwargs):
+        if get_command(popenargs) == 'ansible-playbook':
+            assert 'ssh' == get_command_parameter(popenargs, '--connection')
+            applied_playbooks.append(popenargs[0][-1])
+            return subprocess.CompletedProcess("fakerun", 0, '')
+        elif get_command(popenargs) == 'ssh' and popenargs[0][1] != '-G':
+            assert popenargs[0][-2] == 'edicfgmgmt@fake-target'
+            remote_command = popenargs[0][-1]
+            if remote_command.startswith('cat .edi/playbooks.json'):
+                return subprocess.CompletedProcess("fakerun", 0, remote_files.get('ledger', ''))
+            else:
+                assert remote_command == 'mkdir -p .edi && cat > .edi/playbooks.json'
+                remote_files['ledger'] = kwargs['input']
+                return subprocess.CompletedProcess("fakerun", 0, '')
+        else:
+            return subprocess.run(*popenargs, **kwargs)
+
+    monkeypatch.setattr(mockablerun, 'run_mockable', fake_ssh_run)
+    monkeypatch.setattr(shutil, 'chown', lambda *_: None)
+
+    def run_all(force=False):
+        del applied_playbooks[:]
+        with open(config_files, "r") as main_file:
+            parser = ConfigurationParser(main_file)
+            runner = PlaybookRunner(parser, "fake-target", "ssh", force=force)
+            with mocked_executable('ansible-playbook'):
+                with mocked_executable('ssh'):
+                    return runner.run_all()
+
+    assert run_all() == ['10_base_system', '20_networking', '30_foo']
+    assert len(applied_playbooks) == 3
+    assert sorted(json.loads(remote_files['ledger'])) == ['10_base_system', '20_networking', '30_foo']
+
+    assert run_all() == []
+    assert applied_playbooks == []
+
+    # a different log level does not change the playbooks
+    log_level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.DEBUG)
+    try:
+        assert run_all() == []
+    finally:
+        logging.getLogger().setLevel(log_level)
+
+    assert run_all(force=True) == ['10_base_system', '20_networking', '30_foo']
+
+    # a corrupt ledger does not hurt
+    remote_files['ledger'] = 'garbage'
+    assert run_all() == ['10_base_system', '20_networking', '30_foo']
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pytest
+from edi.lib.helpers import FatalError
+from edi.lib.pluginindex import PluginIndex
+from edi.lib.configurationparser import ConfigurationParser
+
+
+def create_plugin(root, path):
+    plugin = os.path.join(root, path)
+    os.makedirs(os.path.dirname(plugin), exist_ok=True)
+    with open(plugin, "w") as file:
+        file.write("plugin")
+    return plugin
+
+
+def fail_build(*_):
+    assert False, "The plugin index should have been loaded from the cache."
+
+
+def test_plugin_index(tmpdir, monkeypatch):
+    root = str(tmpdir)
+    plugin = create_plugin(root, os.path.join('playbooks', 'base', 'main.yml'))
+
+    PluginIndex.clear_cache()
+    index = PluginIndex.get(root)
+    assert index.resolve('playbooks/base/main.yml') == plugin
+    assert index.resolve('playbooks/./base/main.yml') == plugin
+    assert index.resolve('playbooks/base/missing.yml') is None
+
+    new_plugin = create_plugin(root, os.path.join('playbooks', 'base', 'new.yml'))
+    assert index.resolve('playbooks/base/new.yml') == new_plugin
+
+    PluginIndex.clear_cache()
+    with monkeypatch.context() as m:
+        m.setattr(PluginIndex, '_build', fail_build)
+        assert PluginIndex.get(root).resolve('playbooks/base/new.yml') == new_plugin
+
+
+def test_no_plugin_index_cache_without_artifact_dir(tmpdir, monkeypatch):
+    root = str(tmpdir.mkdir('project'))
+    plugin = create_plugin(root, os.path.join('playbooks', 'base', 'main.yml'))
+    workdir = tmpdir.mkdir('workdir')
+    monkeypatch.delenv('EDI_CACHE_DIR')
+    monkeypatch.chdir(str(workdir))
+
+    PluginIndex.clear_cache()
+    assert PluginIndex.get(root).resolve('playbooks/base/main.yml') == plugin
+    assert workdir.listdir() == []
+    PluginIndex.clear_cache()
+
+
+def test_close_matches(config_files):
+    PluginIndex.clear_cache()
+    with open(config_files, "r") as main_file:
+        parser = ConfigurationParser(main_file)
+        with pytest.raises(FatalError) as error:
+            parser._resolve_path('playbooks/fooo.yml')
+        assert 'Did you mean: playbooks/foo.yml' in error.value.message
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pwd
+import shutil
+import subprocess
+import pytest
+from types import SimpleNamespace
+from edi.lib import privilegedhelperserver
+from edi.lib.privilegedhelper import PrivilegedHelper, is_privileged_command, run_privileged
+from edi.lib.privilegedhelperserver import get_user_environment
+from edi.lib.shellhelpers import mockablerun
+
+requires_root = pytest.mark.skipif(os.getuid() != 0, reason="the helper would prompt for the sudo password")
+
+
+@pytest.fixture
+def privileged_helper():
+    PrivilegedHelper(clear_cache=True)
+    yield PrivilegedHelper
+    PrivilegedHelper(clear_cache=True)
+
+
+@requires_root
+def test_run(privileged_helper):
+    result = privileged_helper.run(['cat'], input='hello\r\nworld', universal_newlines=True, stdout=subprocess.PIPE)
+    assert result.returncode == 0
+    assert result.stdout == 'hello\nworld'
+    assert result.stderr is None
+    assert result.rusage.ru_maxrss > 0
+
+    result = privileged_helper.run(['sh', '-c', 'echo out; echo err >&2'], stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+    assert result.stdout == b'out\nerr\n'
+
+
+@requires_root
+def test_run_failures(privileged_helper, tmpdir):
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        privileged_helper.run(['sh', '-c', 'echo failure >&2; exit 3'], check=True, universal_newlines=True,
+                              stderr=subprocess.PIPE)
+    assert error.value.returncode == 3
+    assert error.value.stderr == 'failure\n'
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        privileged_helper.run(['sleep', '10'], timeout=0.2)
+
+    with pytest.raises(FileNotFoundError):
+        privileged_helper.run(['edi-command-that-does-not-exist'])
+
+    with pytest.raises(FileNotFoundError):
+        privileged_helper.run(['true'], cwd=str(tmpdir.join('missing')))
+
+    # the helper survives failing commands
+    pid = privileged_helper.get_pid()
+    assert privileged_helper.run(['true']).returncode == 0
+    assert privileged_helper.get_pid() == pid
+
+
+@requires_root
+def test_run_as_user(privileged_helper):
+    nobody = pwd.getpwnam('nobody')
+    result = privileged_helper.run(['sh', '-c', 'id -u; id -g; echo $HOME'], user='nobody',
+                                   universal_newlines=True, stdout=subprocess.PIPE)
+    assert result.stdout.split() == [str(nobody.pw_uid), str(nobody.pw_gid), nobody.pw_dir]
+
+
+@requires_root
+def test_run_mockable_uses_helper(privileged_helper):
+    result = mockablerun.run_mockable(['sudo', 'id', '-u'], universal_newlines=True, stdout=subprocess.PIPE)
+    assert result.stdout == '0\n'
+    pid = privileged_helper.get_pid()
+    assert pid is not None
+    mockablerun.run_mockable(['sudo', 'true'], check=True)
+    assert privileged_helper.get_pid() == pid
+
+    result = mockablerun.run_mockable(['sudo', '-u', 'nobody', 'id', '-u'], universal_newlines=True,
+                                      stdout=subprocess.PIPE)
+    assert result.stdout == '{}\n'.format(pwd.getpwnam('nobody').pw_uid)
+
+
+def test_is_privileged_command(privileged_helper, monkeypatch):
+    assert not is_privileged_command(['ls'], {})
+    assert not is_privileged_command(['sudo', 'ls'], {'env': {}})
+    monkeypatch.setenv('EDI_PRIVILEGED_HELPER', '0')
+    assert not is_privileged_command(['sudo', 'ls'], {})
+    assert not privileged_helper.is_running()
+
+
+def test_user_environment():
+    nobody = pwd.getpwnam('nobody')
+    environment = get_user_environment(nobody, {'PATH': '/home/foo/bin:/usr/bin', 'EDI_SECRET': 'secret',
+                                                'LANG': 'C.UTF-8', 'LC_TIME': 'C', 'HOME': '/root'})
+    assert environment['PATH'] == '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+    assert environment['HOME'] == nobody.pw_dir
+    assert environment['USER'] == environment['LOGNAME'] == 'nobody'
+    assert environment['LANG'] == 'C.UTF-8'
+    assert environment['LC_TIME'] == 'C'
+    assert 'EDI_SECRET' not in environment
+
+
+@requires_root
+@pytest.mark.parametrize("version_info, missing_tool", [
+    ((3, 9), None),
+    ((3, 8), None),
+    ((3, 8), 'setpriv'),
+])
+def test_run_privileged_as_user(monkeypatch, version_info, missing_tool):
+    # prior to Python 3.9 the privileges get dropped by setpriv or runuser instead of a preexec_fn
+    monkeypatch.setattr(privilegedhelperserver, 'sys', SimpleNamespace(version_info=version_info))
+    which = shutil.which
+    monkeypatch.setattr(privilegedhelperserver.shutil, 'which',
+                        lambda cmd, path=None: None if cmd == missing_tool else which(cmd, path=path))
+    monkeypatch.setenv('EDI_SECRET', 'secret')
+
+    nobody = pwd.getpwnam('nobody')
+    result = run_privileged(['sudo', '-u', 'nobody', 'sh', '-c', 'id -u; id -g; echo $HOME; echo ${EDI_SECRET:-none}'],
+                            universal_newlines=True, stdout=subprocess.PIPE)
+    assert result.stdout.split() == [str(nobody.pw_uid), str(nobody.pw_gid), nobody.pw_dir, 'none']
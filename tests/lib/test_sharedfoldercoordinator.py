@@ -160,7 +160,7 @@ def test_verify_container_mountpoints_connection_failure(config_files, monkeypat
             with open(config_files, "r") as main_file:
                 def fake_lxc_exec_command(*popenargs, **kwargs):
                     if get_command(popenargs).endswith('lxc') and get_sub_command(popenargs) == 'exec':
-                        if get_command_parameter(popenargs, '--') == 'true':
+                        if get_command_parameter(popenargs, '--') == 'sh':
                             cmd = ['bash', '-c', '>&2 echo -e "lxc command failed" ; exit 1']
                             return subprocess.run(cmd, **kwargs)
                         else:
@@ -185,8 +185,10 @@ def test_verify_container_mountpoints_failure(config_files, monkeypatch):
             with open(config_files, "r") as main_file:
                 def fake_lxc_exec_command(*popenargs, **kwargs):
                     if get_command(popenargs).endswith('lxc') and get_sub_command(popenargs) == 'exec':
-                        if get_command_parameter(popenargs, '--') == 'test':
-                            return subprocess.CompletedProcess("failure", 1, 'failure')
+                        if get_command_parameter(popenargs, '--') == 'sh':
+                            # report all mount points as missing
+                            mountpoints = popenargs[0][popenargs[0].index('--') + 5:]
+                            return subprocess.CompletedProcess("failure", 0, '\n'.join(mountpoints) + '\n')
                         else:
                             return subprocess.CompletedProcess("fakerun", 0, '')
                     else:
@@ -201,6 +203,7 @@ def test_verify_container_mountpoints_failure(config_files, monkeypatch):
                     coordinator.verify_container_mountpoints('fake-container')
                 assert 'fake-container' in error.value.message
                 assert '/foo/bar/target_mountpoint' in error.value.message
+                assert '/mywork' in error.value.message
 
 
 def test_get_mandatory_item():
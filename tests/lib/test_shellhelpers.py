@@ -21,14 +21,19 @@
 
 
 import os
+import time
+import logging
+import asyncio
 import pytest
 import tempfile
 from edi.lib.shellhelpers import (run, safely_remove_artifacts_folder, gpg_agent, require,
                                   Executables, get_user_home_directory, mockablerun, mount_aware_tempdir,
-                                  get_current_display)
+                                  get_current_display, UserEnvironment, run_async, gather_bounded,
+                                  run_concurrently, run_bounded, STREAM)
 from tests.libtesting.contextmanagers.workspace import workspace
 from tests.libtesting.helpers import (get_random_string, suppress_chown_during_debuild, get_command,
-                                      get_sub_command, get_command_parameter)
+                                      get_sub_command, get_command_parameter, is_environment_query,
+                                      fake_environment)
 from edi.lib.helpers import get_artifact_dir, create_artifact_dir, FatalError
 import subprocess
 
@@ -207,10 +212,114 @@ def test_mount_aware_tempdir_remove_mount():
 ])
 def test_get_current_display(monkeypatch, env_var, result):
     def intercept_command_run(*popenargs, **kwargs):
-        if get_command(popenargs) == 'printenv' and get_sub_command(popenargs) == 'DISPLAY':
-            return subprocess.CompletedProcess("fakerun", 0, stdout=env_var)
+        if is_environment_query(popenargs):
+            return fake_environment({'DISPLAY': env_var})
         else:
             return subprocess.run(*popenargs, **kwargs)
 
     monkeypatch.setattr(mockablerun, 'run_mockable', intercept_command_run)
-    assert get_current_display() == result
+    try:
+        UserEnvironment(clear_cache=True)
+        assert get_current_display() == result
+    finally:
+        UserEnvironment(clear_cache=True)
+
+
+def run_until_complete(coroutine):
+    return run_bounded([coroutine])[0]
+
+
+def test_run_async():
+    result = run_until_complete(run_async(['cat'], input='hello', stdout=subprocess.PIPE))
+    assert result.stdout == 'hello'
+    assert result.returncode == 0
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_until_complete(run_async(['sh', '-c', 'echo failure >&2; exit 2'], stderr=subprocess.PIPE))
+    assert error.value.returncode == 2
+    assert error.value.stderr == 'failure\n'
+
+    result = run_until_complete(run_async(['sh', '-c', 'exit 3'], check=False))
+    assert result.returncode == 3
+
+
+def test_run_async_timeout_kills_process_group(tmpdir):
+    marker = str(tmpdir.join('marker'))
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_until_complete(run_async(['sh', '-c', '(sleep 1; touch {0}) & sleep 10'.format(marker)], timeout=0.2))
+    assert time.monotonic() - start < 5
+    time.sleep(1.5)
+    assert not os.path.exists(marker)
+
+
+def test_gather_bounded():
+    running = []
+    peak = []
+
+    async def task(value):
+        running.append(value)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(value)
+        return value
+
+    assert run_until_complete(gather_bounded([task(i) for i in range(10)], limit=3)) == list(range(10))
+    assert max(peak) == 3
+
+
+def test_run_concurrently_is_mockable(monkeypatch):
+    calls = []
+
+    async def fake_run_mockable_async(popenargs, **kwargs):
+        calls.append(popenargs)
+        return subprocess.CompletedProcess(popenargs, 0, stdout=get_sub_command([popenargs]))
+
+    monkeypatch.setattr(mockablerun, 'run_mockable_async', fake_run_mockable_async)
+    results = run_concurrently([['lxc', 'info', 'foo'], ['lxc', 'info', 'bar']], limit=2, stdout=subprocess.PIPE)
+    assert [result.stdout for result in results] == ['info', 'info']
+    assert len(calls) == 2
+
+
+def test_run_concurrently():
+    # real child processes need a working child watcher (Python < 3.8)
+    for _ in range(2):
+        results = run_concurrently([['true'], ['echo', 'hello'], ['sh', '-c', 'exit 4']], limit=2,
+                                   stdout=subprocess.PIPE, check=False)
+        assert [result.returncode for result in results] == [0, 0, 4]
+        assert results[1].stdout == 'hello\n'
+
+
+def test_run_stream(caplog):
+    script = 'for i in $(seq 1 1000); do echo line$i; done'
+    with caplog.at_level(logging.INFO):
+        result = run(['sh', '-c', script], stdout=STREAM, log_threshold=logging.INFO)
+    assert result.returncode == 0
+    assert result.stdout.startswith('line801\n')
+    assert result.stdout.endswith('line1000\n')
+    assert 'line1' in caplog.messages
+    assert 'line1000' in caplog.messages
+
+
+def test_run_stream_failure_keeps_tail():
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run(['sh', '-c', 'echo first; echo last; exit 4'], log_threshold=logging.DEBUG)
+    assert error.value.returncode == 4
+    assert error.value.output == 'first\nlast\n'
+
+
+def test_run_stream_daemon_keeps_pipe_open():
+    start = time.monotonic()
+    result = run(['sh', '-c', 'sleep 10 & echo started'], stdout=STREAM)
+    assert time.monotonic() - start < 4
+    assert result.stdout == 'started\n'
+
+
+def test_run_stream_long_line():
+    result = run(['sh', '-c', 'head -c 100000 /dev/zero | tr "\\0" x; echo; echo end'], stdout=STREAM)
+    assert result.stdout == 'x' * 100000 + '\nend\n'
+
+
+def test_run_stream_async():
+    result = run_until_complete(run_async(['echo', 'hello'], stdout=STREAM))
+    assert result.stdout == 'hello\n'
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from edi.lib.helpers import FatalError
+from edi.lib import versionhelpers
+from edi.lib.versionhelpers import get_edi_version, get_stripped_version, edi_fallback_version
+
+
+def test_installed_edi_version(monkeypatch):
+    monkeypatch.delenv('EDI_GIT_VERSION', raising=False)
+    monkeypatch.setattr(versionhelpers, '_get_installed_version', lambda: '1.7.4+u1804')
+    get_edi_version.cache_clear()
+    try:
+        assert get_edi_version() == '1.7.4+u1804'
+    finally:
+        get_edi_version.cache_clear()
+
+
+def test_edi_version_gets_resolved_once(monkeypatch):
+    monkeypatch.delenv('EDI_GIT_VERSION', raising=False)
+    monkeypatch.setattr(versionhelpers, '_get_installed_version', lambda: None)
+    get_edi_version.cache_clear()
+    try:
+        assert get_edi_version() == edi_fallback_version
+        monkeypatch.setattr('edi.lib.versionhelpers.edi_fallback_version', '0.0.1')
+        assert get_edi_version() == edi_fallback_version
+    finally:
+        get_edi_version.cache_clear()
+
+
+@pytest.mark.parametrize("version, stripped_version", [
+    ('1.7.4', '1.7.4'),
+    ('1.7.4.dev3+g1234567', '1.7.4'),
+    ('2.0', '2.0'),
+])
+def test_get_stripped_version(version, stripped_version):
+    assert get_stripped_version(version) == stripped_version
+
+
+def test_get_stripped_version_failure():
+    with pytest.raises(FatalError):
+        get_stripped_version('invalid')
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Matthias Luescher
+#
+# Authors:
+#  Matthias Luescher
+#
+# This file is part of edi.
+#
+# edi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# edi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with edi.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import uuid
+import queue
+import base64
+import select
+import struct
+import hashlib
+import threading
+import socketserver
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote
+
+
+class FakeLxdError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeLxd:
+    """
+    A small in memory stand-in for the LXD REST API.
+    """
+
+    def __init__(self):
+        self.config = {}
+        self.images = {}  # alias -> fingerprint
+        self.containers = {}  # name -> {'status': ..., 'profiles': [...]}
+        self.networks = {'lxdbr0': {'name': 'lxdbr0', 'type': 'bridge'}}
+        self.profiles = {'default': {'name': 'default', 'config': {}, 'description': '', 'devices': {}}}
+        self.snapshots = {}  # container name -> [snapshot names (oldest first)]
+        self.restored_snapshots = []
+        self.copied_containers = []
+        self.stuck_containers = set()
+        self.executed_commands = []
+        self.exec_handler = None  # optional callable(name, command) that returns the exit code
+        self.operations = dict()
+        self.requests = []
+        self.connections = 0
+        self.event_streams = 0
+        self.event_listeners = []
+        self.lock = threading.Lock()
+
+    def add_image(self, alias, fingerprint=None):
+        fingerprint = fingerprint or uuid.uuid4().hex
+        self.images[alias] = fingerprint
+        return fingerprint
+
+    def emit_event(self, event):
+        for listener in list(self.event_listeners):
+            listener.put(event)
+
+    def emit_lifecycle_event(self, name, action):
+        self.emit_event({'type': 'lifecycle', 'metadata': {'action': 'instance-{}'.format(action),
+                                                           'source': '/1.0/instances/{}'.format(name)}})
+
+    def handle(self, method, path, body):
+        """
+        :return: A tuple (status_code, metadata, asynchronous).
+        """
+        self.requests.append((method, path))
+        url = urlsplit(path)
+        recursion = 'recursion=1' in url.query.split('&')
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        if parts[:1] != ['1.0']:
+            raise FakeLxdError(404, 'not found')
+        resource = parts[1:]
+
+        if not resource and method == 'GET':
+            return 200, {'api_version': '1.0', 'config': self.config}, False
+        elif resource[:1] == ['operations'] and resource[2:] == ['wait']:
+            return 200, self.operations[resource[1]], False
+        elif resource[:2] == ['images', 'aliases'] and len(resource) == 3:
+            if resource[2] not in self.images:
+                raise FakeLxdError(404, 'not found')
+            return 200, {'name': resource[2], 'target': self.images[resource[2]]}, False
+        elif resource == ['images'] and method == 'GET':
+            fingerprints = sorted(set(self.images.values()))
+            if not recursion:
+                return 200, ['/1.0/images/{}'.format(fingerprint) for fingerprint in fingerprints], False
+            return 200, [{'fingerprint': fingerprint,
+                          'aliases': [{'name': alias, 'description': ''}
+                                      for alias, target in sorted(self.images.items()) if target == fingerprint]}
+                         for fingerprint in fingerprints], False
+        elif resource[:1] == ['images'] and len(resource) == 2:
+            return self._handle_image(method, resource[1])
+        elif resource[:1] == ['containers']:
+            return self._handle_container(method, resource[1:], body, recursion)
+        elif resource[:1] == ['networks']:
+            return self._handle_collection(self.networks, method, resource[1:], body)
+        elif resource == ['profiles'] and method == 'GET' and recursion:
+            return 200, [dict(profile, used_by=self._get_profile_users(name))
+                         for name, profile in sorted(self.profiles.items())], False
+        elif resource[:1] == ['profiles']:
+            return self._handle_collection(self.profiles, method, resource[1:], body)
+        else:
+            raise FakeLxdError(404, 'not found')
+
+    def _handle_image(self, method, fingerprint):
+        if fingerprint not in self.images.values():
+            raise FakeLxdError(404, 'not found')
+        if method == 'DELETE':
+            self.images = {alias: value for alias, value in self.images.items() if value != fingerprint}
+            return 200, {}, True
+        return 200, {'fingerprint': fingerprint}, False
+
+    def _handle_container(self, method, resource, body, recursion):
+        if not resource:
+            if method != 'POST' and recursion:
+                return 200, [dict(container) for container in self.containers.values()], False
+            elif method != 'POST':
+                return 200, ['/1.0/containers/{}'.format(name) for name in self.containers], False
+            if body['name'] in self.containers:
+                raise FakeLxdError(409, 'container already exists')
+            if body['source']['type'] == 'copy':
+                if body['source']['source'] not in self.containers:
+                    raise FakeLxdError(404, 'container not found')
+                self.containers[body['name']] = {'name': body['name'], 'status': 'Stopped',
+                                                 'profiles': body.get('profiles', ['default']),
+                                                 'config': dict(body.get('config') or {})}
+                self.copied_containers.append((body['source']['source'], body['name']))
+                if not body['source'].get('instance_only'):
+                    self.snapshots[body['name']] = list(self.snapshots.get(body['source']['source'], []))
+                return 200, {}, True
+            if body['source']['alias'] not in self.images:
+                raise FakeLxdError(404, 'image not found')
+            self.containers[body['name']] = {'name': body['name'], 'status': 'Stopped',
+                                             'profiles': body.get('profiles', ['default'])}
+            return 200, {}, True
+
+        container = self.containers.get(resource[0])
+        if container is None:
+            raise FakeLxdError(404, 'not found')
+
+        if resource[1:2] == ['snapshots']:
+            return self._handle_snapshot(method, resource[0], resource[2:], body, recursion)
+        elif resource[1:] == ['exec']:
+            if container['status'] != 'Running':
+                return 400, 'Container is not running', True
+            self.executed_commands.append((resource[0], body['command']))
+            returncode = self.exec_handler(resource[0], body['command']) if self.exec_handler else 0
+            return 200, {'return': returncode}, True
+        elif resource[1:] == ['state']:
+            if method == 'GET':
+                return 200, {'status': container['status'], 'processes': container.get('processes', 10),
+                             'network': container.get('network') or {}}, False
+            if body['action'] == 'stop' and resource[0] in self.stuck_containers and not body.get('force'):
+                return 400, 'Failed to stop container', True
+            container['status'] = 'Running' if body['action'] == 'start' else 'Stopped'
+            self.emit_lifecycle_event(resource[0], 'started' if body['action'] == 'start' else 'stopped')
+            return 200, {}, True
+        elif method == 'DELETE':
+            if container['status'] == 'Running':
+                return 400, 'The container is currently running, stop it first', True
+            del self.containers[resource[0]]
+            return 200, {}, True
+        elif method == 'PATCH':
+            config = dict(container.get('config', {}), **body.get('config', {}))
+            container.update(body)
+            container['config'] = config
+            return 200, {}, False
+        elif method == 'PUT' and 'restore' in body:
+            if body['restore'] not in self.snapshots.get(resource[0], []):
+                return 404, 'snapshot not found', True
+            self.restored_snapshots.append((resource[0], body['restore']))
+            return 200, {}, True
+        else:
+            return 200, dict(container), False
+
+    def _handle_snapshot(self, method, container_name, resource, body, recursion):
+        snapshots = self.snapshots.setdefault(container_name, [])
+        if not resource:
+            if method == 'POST':
+                if body['name'] in snapshots:
+                    raise FakeLxdError(409, 'snapshot already exists')
+                snapshots.append(body['name'])
+                return 200, {}, True
+            elif recursion:
+                return 200, [{'name': '{}/{}'.format(container_name, name),
+                              'created_at': '2020-01-01T00:00:{:02d}Z'.format(index)}
+                             for index, name in enumerate(snapshots)], False
+            return 200, ['/1.0/containers/{}/snapshots/{}'.format(container_name, name) for name in snapshots], False
+
+        if resource[0] not in snapshots:
+            raise FakeLxdError(404, 'not found')
+        if method == 'DELETE':
+            snapshots.remove(resource[0])
+            return 200, {}, True
+        return 200, {'name': resource[0]}, False
+
+    def _get_profile_users(self, profile_name):
+        return ['/1.0/containers/{}'.format(name) for name, container in sorted(self.containers.items())
+                if profile_name in container['profiles']]
+
+    @staticmethod
+    def _handle_collection(collection, method, resource, body):
+        if not resource:
+            if method != 'POST':
+                return 200, sorted(collection), False
+            if body['name'] in collection:
+                raise FakeLxdError(409, 'already exists')
+            collection[body['name']] = dict(body)
+            return 200, {}, False
+
+        if resource[0] not in collection:
+            raise FakeLxdError(404, 'not found')
+        if method == 'DELETE':
+            del collection[resource[0]]
+            return 200, {}, False
+        elif method == 'PUT':
+            collection[resource[0]] = dict(body, name=resource[0])
+        return 200, dict(collection[resource[0]]), False
+
+    def create_operation(self, status_code, metadata):
+        operation_id = uuid.uuid4().hex
+        if status_code >= 400:
+            self.operations[operation_id] = {'id': operation_id, 'status': 'Failure', 'status_code': status_code,
+                                             'err': metadata}
+        else:
+            self.operations[operation_id] = {'id': operation_id, 'status': 'Success', 'status_code': 200,
+                                             'metadata': metadata, 'err': ''}
+        return '/1.0/operations/{}'.format(operation_id)
+
+
+class _FakeLxdRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.fake_lxd.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle_websocket(self):
+        fake_lxd = self.server.fake_lxd
+        fake_lxd.requests.append((self.command, self.path))
+        fake_lxd.event_streams += 1
+        events = queue.Queue()
+        fake_lxd.event_listeners.append(events)
+        try:
+            key = self.headers.get('Sec-WebSocket-Key', '') + '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+            self.send_response(101)
+            self.send_header('Upgrade', 'websocket')
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Sec-WebSocket-Accept', base64.b64encode(hashlib.sha1(key.encode()).digest()).decode())
+            self.end_headers()
+            self.close_connection = True
+            # the client needs to answer pings
+            self._send_frame(0x9, b'ping')
+            while True:
+                readable, _, _ = select.select([self.connection], [], [], 0.05)
+                if readable and not self.connection.recv(1024):
+                    return
+                try:
+                    event = events.get_nowait()
+                except queue.Empty:
+                    continue
+                self._send_frame(0x1, json.dumps(event).encode())
+        except OSError:
+            return
+        finally:
+            fake_lxd.event_listeners.remove(events)
+
+    def _send_frame(self, opcode, payload):
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x80 | opcode, len(payload))
+        else:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, len(payload))
+        self.wfile.write(header + payload)
+        self.wfile.flush()
+
+    def _handle(self):
+        fake_lxd = self.server.fake_lxd
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._handle_websocket()
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length).decode()) if length else None
+        try:
+            with fake_lxd.lock:
+                status_code, metadata, asynchronous = fake_lxd.handle(self.command, self.path, body)
+                if asynchronous:
+                    response = {'type': 'async', 'status': 'Operation created', 'status_code': 100,
+                                'operation': fake_lxd.create_operation(status_code, metadata), 'metadata': {}}
+                    status_code = 202
+                else:
+                    response = {'type': 'sync', 'status': 'Success', 'status_code': 200, 'metadata': metadata}
+        except FakeLxdError as error:
+            status_code = error.status_code
+            response = {'type': 'error', 'error': str(error), 'error_code': error.status_code}
+
+        content = json.dumps(response).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_PATCH = _handle
+    do_DELETE = _handle
+
+
+class _FakeLxdServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) tuple
+        return request, ('fake-lxd', 0)
+
+
+@contextmanager
+def fake_lxd_server(socket_path):
+    """
+    Serves a FakeLxd on a unix socket.
+    :param socket_path: The path of the unix socket.
+    :return: The FakeLxd.
+    """
+    server = _FakeLxdServer(socket_path, _FakeLxdRequestHandler)
+    server.fake_lxd = FakeLxd()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.fake_lxd
+    finally:
+        server.shutdown()
+        server.server_close()
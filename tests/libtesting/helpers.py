@@ -23,6 +23,7 @@ import os
 import string
 import random
 import shutil
+import subprocess
 from edi.lib.helpers import get_user
 
 
@@ -32,7 +33,7 @@ def get_random_string(length):
 
 def get_command(popenargs):
     def get_real_command(cmd, expected_position):
-        if cmd[expected_position] == 'env':
+        if cmd[expected_position] == 'env' and cmd[expected_position + 1] != '-0':
             return cmd[expected_position + 2]
         else:
             return cmd[expected_position]
@@ -47,6 +48,18 @@ def get_command(popenargs):
         return get_real_command(command, 0)
 
 
+def is_environment_query(popenargs):
+    return get_command(popenargs) == 'env' and get_sub_command(popenargs) == '-0'
+
+
+def fake_environment(variables):
+    """
+    Fake the output of an 'env -0' call.
+    """
+    output = ''.join('{}={}\0'.format(name, value) for name, value in variables.items())
+    return subprocess.CompletedProcess("fakerun", 0, stdout=output)
+
+
 def get_sub_command(popenargs):
     main_command = get_command(popenargs)
     return get_command_parameter(popenargs, main_command)